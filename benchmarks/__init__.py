@@ -0,0 +1,4 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Benchmarks for airspeed velocity (asv)."""
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Data for the benchmarks."""
+
+import os
+
+import mne
+
+import numpy as np
+
+from philistine.mne import simulate_raw
+
+# parameter combinations needing more memory than this (in bytes) for the
+# data are skipped; override with PHILISTINE_BENCH_MAX_BYTES
+max_bytes = int(os.environ.get('PHILISTINE_BENCH_MAX_BYTES', 2 ** 31))
+
+
+def check_size(*shape):
+    """Skip a benchmark whose float64 data would exceed max_bytes."""
+    if 8 * np.prod(shape, dtype=np.int64) > max_bytes:
+        # asv skips benchmarks raising NotImplementedError in setup
+        raise NotImplementedError('data too large for this machine')
+
+
+def make_raw(n_chan, duration, sfreq, iaf=10., seed=42):
+    """Generate EEG-like data with an alpha peak and a stim channel."""
+    check_size(n_chan + 1, duration, sfreq)
+    return simulate_raw(n_chan, sfreq, duration, iaf=iaf, seed=seed)
+
+
+def make_epochs(n_chan, n_epochs, sfreq):
+    """Generate one-second epochs."""
+    check_size(n_chan + 1, n_epochs, sfreq)
+    # on average one event per second, with enough spare events
+    raw = make_raw(n_chan, 1.5 * n_epochs + 10, sfreq)
+    events = mne.find_events(raw, shortest_event=1, verbose=False)
+    return mne.Epochs(raw, events[:n_epochs], tmin=0., tmax=1. - 1. / sfreq,
+                      baseline=None, preload=True, verbose=False)
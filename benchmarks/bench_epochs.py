@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Benchmarks for the epoch functions."""
+
+from philistine.mne import abs_threshold, retrieve
+
+from ._data import make_epochs
+
+
+class AbsThreshold(object):
+    """Benchmark abs_threshold."""
+
+    params = ([16, 64, 256], [100, 1000, 5000], [250, 1000])
+    param_names = ['n_chan', 'n_epochs', 'sfreq']
+
+    def setup(self, n_chan, n_epochs, sfreq):
+        """Generate the data."""
+        self.epochs = make_epochs(n_chan, n_epochs, sfreq)
+
+    def time_abs_threshold(self, n_chan, n_epochs, sfreq):
+        """Time abs_threshold."""
+        # abs_threshold picks channels in place
+        abs_threshold(self.epochs.copy(), 20e-6)
+
+    def peakmem_abs_threshold(self, n_chan, n_epochs, sfreq):
+        """Measure the peak memory of abs_threshold."""
+        abs_threshold(self.epochs.copy(), 20e-6)
+
+
+class Retrieve(object):
+    """Benchmark retrieve."""
+
+    params = ([16, 64], [100, 1000], [250, 1000])
+    param_names = ['n_chan', 'n_epochs', 'sfreq']
+    timeout = 600
+
+    def setup(self, n_chan, n_epochs, sfreq):
+        """Generate the data."""
+        self.epochs = make_epochs(n_chan, n_epochs, sfreq)
+        self.windows = dict(early=(100, 200), late=(300, 500))
+
+    def time_retrieve(self, n_chan, n_epochs, sfreq):
+        """Time retrieve."""
+        retrieve(self.epochs, self.windows, time_format='ms')
+
+    def peakmem_retrieve(self, n_chan, n_epochs, sfreq):
+        """Measure the peak memory of retrieve."""
+        retrieve(self.epochs, self.windows, time_format='ms')
@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Benchmarks for the IAF estimators."""
+
+from philistine.mne import attenuation_iaf, savgol_iaf
+
+from ._data import make_raw
+
+
+class SavgolIAF(object):
+    """Benchmark savgol_iaf."""
+
+    params = ([16, 64, 256], [60, 600, 3600], [250, 1000, 5000])
+    param_names = ['n_chan', 'duration', 'sfreq']
+    timeout = 600
+
+    def setup(self, n_chan, duration, sfreq):
+        """Generate the data."""
+        self.raw = make_raw(n_chan, duration, sfreq, iaf=11.25)
+
+    def time_savgol_iaf(self, n_chan, duration, sfreq):
+        """Time savgol_iaf."""
+        savgol_iaf(self.raw, ax=False)
+
+    def peakmem_savgol_iaf(self, n_chan, duration, sfreq):
+        """Measure the peak memory of savgol_iaf."""
+        savgol_iaf(self.raw, ax=False)
+
+    def time_savgol_iaf_fft(self, n_chan, duration, sfreq):
+        """Time savgol_iaf with the batched FFT backend on all CPUs."""
+        savgol_iaf(self.raw, ax=False, backend='fft', n_jobs=-1)
+
+
+class AttenuationIAF(object):
+    """Benchmark attenuation_iaf."""
+
+    params = ([16, 64, 256], [60, 600, 3600], [250, 1000, 5000])
+    param_names = ['n_chan', 'duration', 'sfreq']
+    timeout = 600
+
+    def setup(self, n_chan, duration, sfreq):
+        """Generate the data."""
+        self.raws = [make_raw(n_chan, duration / 2, sfreq, iaf=11.25),
+                     make_raw(n_chan, duration / 2, sfreq, iaf=35.,
+                              seed=43)]
+
+    def time_attenuation_iaf(self, n_chan, duration, sfreq):
+        """Time attenuation_iaf."""
+        attenuation_iaf(self.raws, ax=False)
+
+    def peakmem_attenuation_iaf(self, n_chan, duration, sfreq):
+        """Measure the peak memory of attenuation_iaf."""
+        attenuation_iaf(self.raws, ax=False)
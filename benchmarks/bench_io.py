@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Benchmarks for the BrainVision writer."""
+
+import os
+from shutil import rmtree
+from tempfile import mkdtemp
+
+from philistine.mne import write_raw_brainvision
+
+from ._data import make_raw
+
+
+class WriteRawBrainVision(object):
+    """Benchmark write_raw_brainvision."""
+
+    params = ([16, 64, 256], [60, 600, 3600], [250, 1000, 5000],
+              ['binary_float32', 'binary_int16'])
+    param_names = ['n_chan', 'duration', 'sfreq', 'format']
+    timeout = 600
+
+    def setup(self, n_chan, duration, sfreq, format):
+        """Generate the data."""
+        self.raw = make_raw(n_chan, duration, sfreq)
+        self.tmpdir = mkdtemp(prefix='philistine_bench_')
+        self.fname = os.path.join(self.tmpdir, 'bench.vhdr')
+
+    def teardown(self, n_chan, duration, sfreq, format):
+        """Remove the written files."""
+        rmtree(self.tmpdir)
+
+    def time_write_raw_brainvision(self, n_chan, duration, sfreq, format):
+        """Time write_raw_brainvision."""
+        write_raw_brainvision(self.raw, self.fname, format=format)
+
+    def peakmem_write_raw_brainvision(self, n_chan, duration, sfreq,
+                                      format):
+        """Measure the peak memory of write_raw_brainvision."""
+        write_raw_brainvision(self.raw, self.fname, format=format)
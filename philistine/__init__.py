@@ -5,5 +5,21 @@
 
 __version__ = '0.2.0'
 
-from . import mne
 from ._base import (invert_dict, )
+from .precision import (get_precision, set_precision, use_precision, )
+from .profiling import (profile, )
+
+
+def __getattr__(name):
+    """Import the submodules on first access."""
+    # importing philistine.mne is slow, so it is only done when needed
+    if name == 'mne':
+        import importlib
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module {!r} has no attribute '
+                         '{!r}'.format(__name__, name))
+
+
+def __dir__():
+    """List the attributes including the lazily imported submodules."""
+    return sorted(list(globals()) + ['mne'])
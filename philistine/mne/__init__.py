@@ -3,7 +3,62 @@
 # License: BSD (3-clause)
 """MNE-based functions for manipulating EEG data."""
 
-from ._base import (savgol_iaf, attenuation_iaf,
-                    abs_threshold, retrieve)
+import importlib
 
-from .io import (write_raw_brainvision, )
+# the public functions and the submodules defining them -- the submodules
+# are only imported when one of their functions is first accessed, so that
+# e.g. the BrainVision functions don't pay for the imports of the IAF
+# functions
+_submodules = {
+    'savgol_iaf': '_base',
+    'attenuation_iaf': '_base',
+    'abs_threshold': '_base',
+    'retrieve': '_base',
+    'plot_iaf_diagnostics': 'viz',
+    'render_iaf_diagnostics': 'viz',
+    'write_raw_brainvision': 'io',
+    'write_array_brainvision': 'io',
+    'append_raw_brainvision': 'io',
+    'write_epochs_brainvision': 'io',
+    'read_brainvision': 'io',
+    'read_epochs_brainvision': 'io',
+    'BrainVisionData': 'io',
+    'anonymize_brainvision': 'io',
+    'verify_brainvision': 'io',
+    'compare_raw_brainvision': 'io',
+    'convert_to_brainvision': 'convert',
+    'ResultStore': 'store',
+    'run_pipeline': 'pipeline',
+    'SharedData': 'shared',
+    'parallel_sweep': 'shared',
+    'simulate_eeg': 'simulation',
+    'simulate_events': 'simulation',
+    'simulate_raw': 'simulation',
+}
+
+# the public submodules, which are also imported on first access, e.g. as
+# philistine.mne.io
+_public_submodules = ('convert', 'io', 'pipeline', 'shared', 'simulation',
+                      'store', 'utils', 'viz')
+
+__all__ = sorted(_submodules)
+
+
+def __getattr__(name):
+    """Import a submodule or the submodule defining a function on access."""
+    if name in _public_submodules:
+        return importlib.import_module('.' + name, __name__)
+    if name not in _submodules:
+        raise AttributeError('module {!r} has no attribute '
+                             '{!r}'.format(__name__, name))
+    module = importlib.import_module('.' + _submodules[name], __name__)
+    value = getattr(module, name)
+    # later accesses don't go through __getattr__
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    """List the attributes including the lazily imported names."""
+    return sorted(set(globals()) | set(_submodules) |
+                  set(_public_submodules))
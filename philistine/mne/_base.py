@@ -5,29 +5,47 @@
 
 from collections import namedtuple  # noqa: I100
 
-import matplotlib.pyplot as plt
-
 import mne  # noqa: F401
 
 import numpy as np
 
-import pandas as pd
-
-from scipy import stats
 from scipy.ndimage import center_of_mass
 from scipy.signal import argrelmin, savgol_filter
 
+from ._spectral import _compute_psd
+from ..precision import _working_dtype
+from ..profiling import _profiled, _stage
+
+# matplotlib, pandas and scipy.stats are slow to import and only needed by
+# some functions, so they are imported in those functions
+
 IafEst = namedtuple('IAFEstimate',
                     ['PeakAlphaFrequency', 'CenterOfGravity', 'AlphaBand'])
+# estimates are pickled under the name of their type, e.g. by process pools
+IAFEstimate = IafEst
+
+# the spectra and fits behind an estimate, for plotting and quality control
+SavgolDiagnostics = namedtuple('SavgolDiagnostics',
+                               ['freqs', 'psd', 'psd_smooth', 'pink_fit',
+                                'pink_r2', 'freqs_search', 'psd_search',
+                                'estimate'])
+AttenuationDiagnostics = namedtuple('AttenuationDiagnostics',
+                                    ['freqs', 'psds', 'att_psd', 'savgol',
+                                     'r', 'freqs_search', 'psd_search',
+                                     'estimate'])
 
 
+@_profiled
 def savgol_iaf(raw, picks=None,  # noqa: C901
                fmin=None, fmax=None,
                resolution=0.25,
                average=True,
                ax=None,
                window_length=11, polyorder=5,
-               pink_max_r2=0.9):
+               pink_max_r2=0.9,
+               return_diagnostics=False,
+               precision=None,
+               backend='welch', n_jobs=1):
     """Estimate individual alpha frequency (IAF).
 
     Parameters
@@ -54,7 +72,8 @@ def savgol_iaf(raw, picks=None,  # noqa: C901
         supported.
     ax : instance of matplotlib Axes | None | False
         Axes to plot PSD analysis into. If None, axes will be created
-        (and plot not shown by default). If False, no plotting will be done.
+        (and plot not shown by default), unless return_diagnostics is True.
+        If False, no plotting will be done.
     window_length : int
         Window length in samples to use for Savitzky-Golay smoothing of
         PSD when estimating IAF.
@@ -66,6 +85,25 @@ def savgol_iaf(raw, picks=None,  # noqa: C901
         pink noise 1/f distribution on the range 1 to 30 Hz.
         If this threshold is exceeded, then IAF is assumed unclear and
         None is returned for both PAF and CoG.
+    return_diagnostics : bool
+        Whether to also return the spectra and fits the estimate is based
+        on, e.g. for plotting with render_iaf_diagnostics.
+    precision : None | 'float64' | 'float32'
+        Precision of the PSD computation, see philistine.set_precision. If
+        None, the package-wide setting is used. In single precision, the
+        data are read and transformed a block of channels at a time, and the
+        PSD has a relative error of about 1e-6; as the estimates are
+        frequencies of the PSD, they only differ in case of near ties. Data
+        with bad segments are always processed in double precision.
+    backend : 'welch' | 'fft'
+        How to compute the Welch PSD (Hamming windows of 1 / resolution
+        seconds without overlap). 'welch' uses MNE's implementation. 'fft'
+        transforms all segments of a block of channels in one call of
+        ``scipy.fft.rfft`` with n_jobs threads; the PSD is the same up to
+        rounding (a relative difference of about 1e-15 in double
+        precision). Data with bad segments always use MNE's implementation.
+    n_jobs : int
+        The number of threads for the 'fft' backend, -1 for all CPUs.
 
     Returns
     -------
@@ -74,6 +112,12 @@ def savgol_iaf(raw, picks=None,  # noqa: C901
          Named tuple with fields for the peak alpha frequency (PAF),
          alpha center of gravity (CoG), and the bounds of the alpha band
          (as a tuple).
+    diagnostics : instance of SavgolDiagnostics
+
+         Only returned if return_diagnostics is True. Named tuple with fields
+         for the frequencies, the raw and smoothed PSD, the 1/f fit and its
+         R^2, the frequencies and values of the alpha-band search parabola
+         (None if the alpha band was fully specified) and the estimate.
 
     Notes
     -----
@@ -87,18 +131,17 @@ def savgol_iaf(raw, picks=None,  # noqa: C901
         of individual alpha frequency (IAF) quantification. Psychophysiology,
         e13064. doi:10.1111/psyp.13064
     """
-    n_fft = int(raw.info['sfreq'] / resolution)
-    spectrum = raw.compute_psd(method="welch", picks=picks, n_fft=n_fft,
-                               fmin=1., fmax=30.)
-    psd = spectrum.get_data()
-    freqs = spectrum.freqs
-    if ax is None:
-        fig = plt.figure()  # noqa: F841
-        ax = plt.gca()
+    with _stage('savgol_iaf.psd'):
+        n_fft = int(raw.info['sfreq'] / resolution)
+        psd, freqs = _compute_psd(raw, picks, n_fft, 1., 30.,
+                                  _working_dtype(precision), backend, n_jobs)
+        # the spectra are small, the rest is done in double precision
+        psd = psd.astype(np.float64, copy=False)
 
-    if average:
-        psd = np.mean(psd, axis=0)
+        if average:
+            psd = np.mean(psd, axis=0)
 
+    freqs_search = psd_search = None
     if fmin is None or fmax is None:
         if fmin is None:
             fmin_bound = 5
@@ -113,9 +156,10 @@ def savgol_iaf(raw, picks=None,  # noqa: C901
         alpha_search = np.logical_and(freqs >= fmin_bound,
                                       freqs <= fmax_bound)
         freqs_search = freqs[alpha_search]
-        psd_search = savgol_filter(psd[alpha_search],
-                                   window_length=psd[alpha_search].shape[0],
-                                   polyorder=10)
+        with _stage('savgol_iaf.band_search'):
+            psd_search = savgol_filter(
+                psd[alpha_search], window_length=psd[alpha_search].shape[0],
+                polyorder=10)
         # argrel min returns a tuple, so we flatten that with [0]
         # then we get the last element of the resulting array with [-1]
         # which is the minimum closest to the 'median' alpha of 10 Hz
@@ -133,13 +177,16 @@ def savgol_iaf(raw, picks=None,  # noqa: C901
                 fmax = freqs_search[freqs_search > 10][right_min]
             except IndexError:
                 raise ValueError("Unable to automatically determine upper end of alpha band.")   # noqa: 501
-    psd_smooth = savgol_filter(psd,
-                               window_length=window_length,
-                               polyorder=polyorder)
+    with _stage('savgol_iaf.smooth'):
+        psd_smooth = savgol_filter(psd,
+                                   window_length=window_length,
+                                   polyorder=polyorder)
     alpha_band = np.logical_and(freqs >= fmin, freqs <= fmax)
 
-    slope, intercept, r, p, se = stats.linregress(np.log(freqs),
-                                                  np.log(psd_smooth))
+    with _stage('savgol_iaf.pink_fit'):
+        from scipy import stats
+        slope, intercept, r, p, se = stats.linregress(np.log(freqs),
+                                                      np.log(psd_smooth))
     if r**2 > pink_max_r2:
         paf = None
         cog = None
@@ -156,26 +203,19 @@ def savgol_iaf(raw, picks=None,  # noqa: C901
             # set PAF to None as well, because this is a pathological case
             paf = None
 
-    if ax:
-        plt_psd, = ax.plot(freqs, psd, label="Raw PSD")
-        plt_smooth, = ax.plot(freqs, psd_smooth, label="Smoothed PSD")
-        plt_pink, = ax.plot(freqs,
-                            np.exp(slope * np.log(freqs) + intercept),
-                            label='$1/f$ fit ($R^2={:0.2}$)'.format(r**2))
-        try:
-            plt_search, = ax.plot(freqs_search, psd_search,
-                                  label='Alpha-band Search Parabola')
-            ax.legend(handles=[plt_psd, plt_smooth, plt_search, plt_pink])
-        except UnboundLocalError:
-            # this happens when the user fully specified an alpha band
-            ax.legend(handles=[plt_psd, plt_smooth, plt_pink])
-
-        ax.set_ylabel("PSD")
-        ax.set_xlabel("Hz")
+    iaf = IafEst(paf, cog, (fmin, fmax))
+    diagnostics = SavgolDiagnostics(freqs, psd, psd_smooth,
+                                    np.exp(slope * np.log(freqs) + intercept),
+                                    r**2, freqs_search, psd_search, iaf)
+    with _stage('savgol_iaf.plot'):
+        _plot_diagnostics(ax, diagnostics, return_diagnostics)
 
-    return IafEst(paf, cog, (fmin, fmax))
+    if return_diagnostics:
+        return iaf, diagnostics
+    return iaf
 
 
+@_profiled
 def attenuation_iaf(raws, picks=None,  # noqa: C901
                     fmin=None, fmax=None,
                     resolution=0.25,
@@ -183,7 +223,10 @@ def attenuation_iaf(raws, picks=None,  # noqa: C901
                     ax=None,
                     savgol=False,
                     window_length=11, polyorder=5,
-                    flat_max_r=0.98):
+                    flat_max_r=0.98,
+                    return_diagnostics=False,
+                    precision=None,
+                    backend='welch', n_jobs=1):
     """Estimate individual alpha frequency (IAF).
 
     Parameters
@@ -210,7 +253,8 @@ def attenuation_iaf(raws, picks=None,  # noqa: C901
         supported.
     ax : instance of matplotlib Axes | None | False
         Axes to plot PSD analysis into. If None, axes will be created
-        (and plot not shown by default). If False, no plotting will be done.
+        (and plot not shown by default), unless return_diagnostics is True.
+        If False, no plotting will be done.
     savgol : False | 'each' | 'diff'
         Use Savitzky-Golay filtering to smooth PSD estimates -- either applied
         to either each PSD estimate or to the difference (i.e. the attenuation
@@ -227,6 +271,15 @@ def attenuation_iaf(raws, picks=None,  # noqa: C901
         If this threshold is exceeded, then IAF is assumed unclear and
         None is returned for both PAF and CoG. Note that the sign of the
         coefficient is ignored.
+    return_diagnostics : bool
+        Whether to also return the spectra the estimate is based on, e.g.
+        for plotting with render_iaf_diagnostics.
+    precision : None | 'float64' | 'float32'
+        Precision of the PSD computation, see savgol_iaf.
+    backend : 'welch' | 'fft'
+        How to compute the PSD, see savgol_iaf.
+    n_jobs : int
+        The number of threads for the 'fft' backend, see savgol_iaf.
 
     Returns
     -------
@@ -235,6 +288,13 @@ def attenuation_iaf(raws, picks=None,  # noqa: C901
          Named tuple with fields for the peak alpha frequency (PAF),
          alpha center of gravity (CoG), and the bounds of the alpha band
          (as a tuple).
+    diagnostics : instance of AttenuationDiagnostics
+
+         Only returned if return_diagnostics is True. Named tuple with fields
+         for the frequencies, the two PSDs, the attenuation PSD, the savgol
+         setting, the correlation of the two PSDs, the frequencies and values
+         of the alpha-band search parabola (None if the alpha band was fully
+         specified) and the estimate.
 
     Notes
     -----
@@ -252,13 +312,12 @@ def attenuation_iaf(raws, picks=None,  # noqa: C901
     # TODO: check value of savgol parameter
     def psd_est(r):
         n_fft = int(r.info['sfreq'] / resolution)
-        spectrum = r.compute_psd(method="welch", picks=picks, n_fft=n_fft,
-                                 fmin=1., fmax=30.)
-        psd = spectrum.get_data()
-        freqs = spectrum.freqs
-        return psd, freqs
+        psd, freqs = _compute_psd(r, picks, n_fft, 1., 30.,
+                                  _working_dtype(precision), backend, n_jobs)
+        return psd.astype(np.float64, copy=False), freqs
 
-    psd, freqs = zip(*[psd_est(r) for r in raws])
+    with _stage('attenuation_iaf.psd'):
+        psd, freqs = zip(*[psd_est(r) for r in raws])
     assert np.allclose(*freqs)
 
     if savgol == 'each':
@@ -276,10 +335,7 @@ def attenuation_iaf(raws, picks=None,  # noqa: C901
 
     att_freqs = freqs[0]
 
-    if ax is None:
-        fig = plt.figure()  # noqa: F841
-        ax = plt.gca()
-
+    freqs_search = psd_search = None
     if fmin is None or fmax is None:
         if fmin is None:
             fmin_bound = 5
@@ -298,9 +354,10 @@ def attenuation_iaf(raws, picks=None,  # noqa: C901
         # don't use the name window_length because that's used as a
         # parameter for the function as a whole
         wlen = att_psd[alpha_search].shape[0]
-        psd_search = savgol_filter(att_psd[alpha_search],
-                                   window_length=wlen,
-                                   polyorder=10)
+        with _stage('attenuation_iaf.band_search'):
+            psd_search = savgol_filter(att_psd[alpha_search],
+                                       window_length=wlen,
+                                       polyorder=10)
         # argrel min returns a tuple, so we flatten that with [0]
         # then we get the last element of the resulting array with [-1]
         # which is the minimum closest to the 'median' alpha of 10 Hz
@@ -326,7 +383,9 @@ def attenuation_iaf(raws, picks=None,  # noqa: C901
 
     alpha_band = np.logical_and(att_freqs >= fmin, att_freqs <= fmax)
 
-    r, p = stats.pearsonr(psd[0], psd[1])
+    with _stage('attenuation_iaf.pearsonr'):
+        from scipy import stats
+        r, p = stats.pearsonr(psd[0], psd[1])
 
     if np.abs(r) > np.abs(flat_max_r):
         paf = None
@@ -342,37 +401,33 @@ def attenuation_iaf(raws, picks=None,  # noqa: C901
         cog_idx = int(np.round(cog_idx[0]))
         cog = att_freqs[alpha_band][cog_idx]
 
-    if ax:
-        sgnote = '(with SG-Smoothing)' if savgol == 'each' else ''
-        plt_psd1, = ax.plot(freqs[0], psd[0],
-                            label="Raw PSD #1 {}".format(sgnote))
-        plt_psd2, = ax.plot(freqs[1], psd[1],
-                            label="Raw PSD #2 {}".format(sgnote))
-
-        sgnote = '(with SG-Smoothing)' if savgol == 'diff' else ''
-        plt_att_psd, = ax.plot(att_freqs, att_psd,
-                               label="Attenuated PSD {}".format(sgnote))
-#         plt_pink, = ax.plot(att_freqs,
-#                      np.exp(slope * np.log(att_freqs) + intercept),
-#                      label='$1/f$ fit ($R^2={:0.2}$)'.format(r**2))
-        ax.text(np.max(att_freqs) * 0.5, np.max(att_psd) * 0.67,
-                'Raw PSD Pearson $r={:0.2}$'.format(r))
-        try:
-            plt_search, = ax.plot(freqs_search, psd_search,
-                                  label='Alpha-band Search Parabola')
-            ax.legend(handles=[plt_psd1, plt_psd2, plt_att_psd, plt_search])
-        except UnboundLocalError:
-            # this happens when the user fully specified an alpha band
-            ax.legend(handles=[plt_psd1, plt_psd2, plt_att_psd])
+    iaf = IafEst(paf, cog, (fmin, fmax))
+    diagnostics = AttenuationDiagnostics(att_freqs, psd, att_psd, savgol, r,
+                                         freqs_search, psd_search, iaf)
+    with _stage('attenuation_iaf.plot'):
+        _plot_diagnostics(ax, diagnostics, return_diagnostics)
 
-        ax.set_ylabel("PSD")
-        ax.set_xlabel("Hz")
+    if return_diagnostics:
+        return iaf, diagnostics
+    return iaf
 
-    return IafEst(paf, cog, (fmin, fmax))
+
+def _plot_diagnostics(ax, diagnostics, return_diagnostics):
+    """Plot diagnostics into ax, creating a pyplot figure if ax is None."""
+    if ax is None and not return_diagnostics:
+        import matplotlib.pyplot as plt
+        fig = plt.figure()  # noqa: F841
+        ax = plt.gca()
+
+    if ax:
+        from .viz import plot_iaf_diagnostics
+        plot_iaf_diagnostics(diagnostics, ax)
 
 
+@_profiled
 def abs_threshold(epochs, threshold,
-                  eeg=True, eog=False, misc=False, stim=False):
+                  eeg=True, eog=False, misc=False, stim=False,
+                  precision=None):
     """Compute mask for dropping epochs based on absolute voltage threshold.
 
     Parameters
@@ -389,6 +444,11 @@ def abs_threshold(epochs, threshold,
         If True include miscellaneous channels in thresholding procedure.
     stim : bool
         If True include stimulus channels in thresholding procedure.
+    precision : None | 'float64' | 'float32'
+        Precision of the comparison, see philistine.set_precision. If None,
+        the package-wide setting is used. In single precision, values within
+        a relative distance of about 6e-8 of the threshold may be classified
+        differently than in double precision.
 
     Returns
     -------
@@ -401,16 +461,32 @@ def abs_threshold(epochs, threshold,
     More precise selection of channels can be performed by passing a
     'reduced' Epochs instance from the various ``picks`` methods.
     """
-    data = epochs.pick_types(eeg=eeg, misc=misc, stim=stim).get_data()
-    # channels and times are last two dimension in MNE ndarrays,
-    # and we collapse across them to get a (n_epochs,) shaped array
-    rej = np.any( np.abs(data) > threshold, axis=(-1, -2) )  # noqa: E201, E202
+    epochs = epochs.pick_types(eeg=eeg, misc=misc, stim=stim)
+    # reading the data drops bad epochs, which changes the number of epochs
+    epochs.drop_bad(verbose=False)
+    dtype = _working_dtype(precision)
+    n_epochs = len(epochs)
+    # the epochs are converted in blocks of about 2 ** 20 values
+    block = max(1, 2 ** 20 // max(1, len(epochs.ch_names) *
+                                  len(epochs.times)))
+    rej = np.zeros(n_epochs, dtype=bool)
+    for start in range(0, n_epochs, block):
+        with _stage('abs_threshold.get_data'):
+            data = epochs.get_data(item=slice(start, start + block))
+            data = data.astype(dtype, copy=False)
+        # channels and times are last two dimension in MNE ndarrays,
+        # and we collapse across them to get a (n_epochs,) shaped array
+        with _stage('abs_threshold.threshold'):
+            # not in place, the data may be a view of the epochs' data
+            rej[start:start + block] = np.any(np.abs(data) > threshold,
+                                              axis=(-1, -2))
 
     return rej
 
 
+@_profiled
 def retrieve(epochs, windows, items=None,
-             summary_fnc=dict(mean=np.mean), **kwargs):
+             summary_fnc=dict(mean=np.mean), precision=None, **kwargs):
     """Retrieve summarized epoch data for further statistical analysis.
 
     Parameters
@@ -429,6 +505,15 @@ def retrieve(epochs, windows, items=None,
         e.g. repeated measure designs). Shape should be (n_epochs,). If
         None (default), then item numbers will not be included in the
         generated data frame.
+    precision : None | 'float64' | 'float32'
+        Precision of the channel columns while windowing and summarizing,
+        see philistine.set_precision. If None, the package-wide setting is
+        used. In single precision, the data have a relative error of about
+        6e-8 and sums (e.g. for the mean) accumulate a relative error of at
+        most about 1e-7 times the logarithm of the number of samples per
+        window. This halves the copies made for the windows, but not the
+        peak memory use, as the data frame is first created in double
+        precision by Epochs.to_data_frame.
     kwargs :
         Keyword arguments to pass to Epochs.to_data_frame. Particularly
         relevant are ``scalings`` and ``scale_time``.
@@ -439,8 +524,15 @@ def retrieve(epochs, windows, items=None,
         Long-format data frame of summarized data
 
     """
-    df = epochs.to_data_frame(index=['epoch', 'time'], **kwargs)
+    import pandas as pd
+
+    with _stage('retrieve.to_data_frame'):
+        df = epochs.to_data_frame(index=['epoch', 'time'], **kwargs)
     chs = [c for c in df.columns if c not in ('condition')]
+    dtype = _working_dtype(precision)
+    if dtype != np.float64:
+        # the windows and their summaries are copies of these columns
+        df = df.astype(dict((ch, dtype) for ch in chs))
     # the order is important here!
     # otherwise the shortcut with items later won't  work
     factors = ['epoch', 'condition']
@@ -457,7 +549,8 @@ def retrieve(epochs, windows, items=None,
         for w in windows:
             temp = df[ df.time >= windows[w][0] ]  # noqa: E201, E202
             dfw = temp[ temp.time <= windows[w][1] ]   # noqa: E201, E202
-            dfw_summary = dfw[sel].groupby(factors).apply(fnc)
+            with _stage('retrieve.summarize'):
+                dfw_summary = dfw[sel].groupby(factors).apply(fnc)
 
             if items is not None:
                 dfw_summary["item"] = items
@@ -465,17 +558,18 @@ def retrieve(epochs, windows, items=None,
             dfw_summary["wname"] = w
             d.append(dfw_summary)
 
-        d = pd.concat(d)
-        # get rid of epoch and condition if they're already columns
-        # before we can move them from the index to columns
-        d.drop('epoch', axis=1, inplace=True, errors='ignore')
-        d.drop('condition', axis=1, inplace=True, errors='ignore')
-        d.reset_index(inplace=True)
-        d = pd.melt(d,
-                    id_vars=id_vars,
-                    value_vars=chs,
-                    var_name="channel",
-                    value_name=fnc_name)
-        dat = pd.merge(dat, d, how='outer')
+        with _stage('retrieve.reshape'):
+            d = pd.concat(d)
+            # get rid of epoch and condition if they're already columns
+            # before we can move them from the index to columns
+            d.drop('epoch', axis=1, inplace=True, errors='ignore')
+            d.drop('condition', axis=1, inplace=True, errors='ignore')
+            d.reset_index(inplace=True)
+            d = pd.melt(d,
+                        id_vars=id_vars,
+                        value_vars=chs,
+                        var_name="channel",
+                        value_name=fnc_name)
+            dat = pd.merge(dat, d, how='outer')
 
     return dat
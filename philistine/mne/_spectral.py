@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Welch PSD of Raw data, channel block by channel block."""
+
+import numpy as np
+
+try:
+    from mne._fiff.pick import _picks_to_idx
+except ImportError:  # MNE < 1.6
+    from mne.io.pick import _picks_to_idx
+
+# number of values per block of channels, i.e. 4 MiB in float32
+_block_values = 2 ** 20
+
+_backends = ('welch', 'fft')
+
+
+def _has_bad_annotations(raw):
+    """Check whether MNE would reject parts of raw by annotation."""
+    return any(desc.lower().startswith('bad')
+               for desc in raw.annotations.description)
+
+
+def _channel_blocks(raw, picks, n_fft, fmin, fmax, dtype):
+    """Set up the blockwise computation of the PSD of the picked channels.
+
+    Returns the frequencies, the mask of those between fmin and fmax, the
+    output array and a generator of (selection of the output, data in
+    dtype) for each block of channels.
+    """
+    picks = _picks_to_idx(raw.info, picks, 'data', 'bads',
+                          with_ref_meg=False)
+    freqs = np.arange(n_fft // 2 + 1) * (raw.info['sfreq'] / n_fft)
+    fmask = (freqs >= fmin) & (freqs <= fmax)
+    psd = np.empty((len(picks), fmask.sum()), dtype=dtype)
+
+    def blocks():
+        block = max(1, _block_values // max(raw.n_times, 1))
+        for start in range(0, len(picks), block):
+            sel = picks[start:start + block]
+            data = raw.get_data(picks=sel).astype(dtype, copy=False)
+            yield slice(start, start + len(sel)), data
+
+    return freqs, fmask, psd, blocks()
+
+
+def _welch_psd(raw, picks, n_fft, fmin, fmax, dtype):
+    """Compute the Welch PSD like Raw.compute_psd(method='welch').
+
+    The data are read a block of channels at a time and the spectra
+    computed in dtype. With the same segmentation (non-overlapping Hamming
+    windows of n_fft samples with the mean removed), the result matches
+    MNE's up to the precision of dtype.
+
+    Returns psd, shape (n_picks, n_freqs), and freqs.
+    """
+    from scipy.signal import welch
+
+    freqs, fmask, psd, blocks = _channel_blocks(raw, picks, n_fft, fmin,
+                                                fmax, dtype)
+    for sel, data in blocks:
+        _, spect = welch(data, fs=raw.info['sfreq'], window='hamming',
+                         nperseg=n_fft, noverlap=0, nfft=n_fft,
+                         detrend='constant', scaling='density',
+                         average='mean', axis=-1)
+        psd[sel] = spect[:, fmask]
+    return psd, freqs[fmask]
+
+
+def _fft_psd(raw, picks, n_fft, fmin, fmax, dtype, n_jobs=1):
+    """Compute the Welch PSD with one batched, multithreaded FFT per block.
+
+    The non-overlapping segments of all channels of a block are a view of
+    the data of shape (n_channels, n_segments, n_fft), which is detrended,
+    windowed and transformed in a single call of scipy.fft.rfft with n_jobs
+    workers. The steps and scaling are those of scipy.signal.welch, so that
+    the result matches _welch_psd and MNE up to rounding.
+
+    Returns psd, shape (n_picks, n_freqs), and freqs.
+    """
+    from scipy import fft
+    from scipy.signal import get_window
+
+    n_seg = raw.n_times // n_fft
+    if n_seg == 0:
+        raise ValueError('The data ({} samples) are shorter than one FFT '
+                         'segment ({} samples).'.format(raw.n_times, n_fft))
+    window = get_window('hamming', n_fft).astype(dtype)
+    # density scaling, with the power of the negative frequencies added to
+    # that of the positive ones (except for DC and Nyquist)
+    scale = np.full(n_fft // 2 + 1,
+                    2. / (raw.info['sfreq'] * np.sum(window ** 2)))
+    scale[0] /= 2
+    if n_fft % 2 == 0:
+        scale[-1] /= 2
+
+    freqs, fmask, psd, blocks = _channel_blocks(raw, picks, n_fft, fmin,
+                                                fmax, dtype)
+    scale = scale[fmask].astype(dtype)
+    for sel, data in blocks:
+        segments = data[:, :n_seg * n_fft].reshape(len(data), n_seg, n_fft)
+        segments = segments - segments.mean(axis=-1, keepdims=True)
+        segments *= window
+        spect = fft.rfft(segments, axis=-1, workers=n_jobs)[..., fmask]
+        power = spect.real ** 2 + spect.imag ** 2
+        psd[sel] = power.mean(axis=1) * scale
+    return psd, freqs[fmask]
+
+
+def _compute_psd(raw, picks, n_fft, fmin, fmax, dtype, backend='welch',
+                 n_jobs=1):
+    """Compute the Welch PSD of raw with a backend in the working precision.
+
+    Data with bad segments (which are handled by MNE's implementation) and
+    the Welch backend in double precision use Raw.compute_psd.
+    """
+    if backend not in _backends:
+        raise ValueError('backend must be one of {}, got '
+                         '{!r}.'.format(', '.join(_backends), backend))
+    if _has_bad_annotations(raw) or (backend == 'welch' and
+                                     dtype == np.float64):
+        spectrum = raw.compute_psd(method="welch", picks=picks, n_fft=n_fft,
+                                   fmin=fmin, fmax=fmax)
+        return spectrum.get_data(), spectrum.freqs
+    if backend == 'fft':
+        return _fft_psd(raw, picks, n_fft, fmin, fmax, dtype, n_jobs)
+    return _welch_psd(raw, picks, n_fft, fmin, fmax, dtype)
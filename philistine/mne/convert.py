@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Batch conversion of whole studies to BrainVision format."""
+
+from __future__ import division, print_function
+
+import argparse
+import fnmatch
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+ConversionReport = namedtuple('ConversionReport',
+                              ['converted', 'skipped', 'failed',
+                               'n_bytes', 'elapsed'])
+
+# name of the file in the output directory recording the converted inputs
+_manifest_fname = '.philistine_convert.json'
+
+
+def convert_to_brainvision(in_dir, out_dir, pattern='*.fif', n_jobs=1,
+                           check='mtime', verbose=True, **kwargs):
+    """Convert all FIF files in a directory tree to BrainVision format.
+
+    Parameters
+    ----------
+    in_dir : str
+        Directory to search recursively for files to convert.
+    out_dir : str
+        Directory to write the BrainVision files to. The directory structure
+        of in_dir is mirrored in out_dir.
+    pattern : str
+        Shell-style pattern for the names of the files to convert.
+    n_jobs : int
+        The number of files to convert in parallel, each in its own process.
+    check : 'mtime' | 'hash' | False
+        How to determine whether an existing output is up to date with its
+        input: by comparing the size and modification time or the SHA-256
+        hash of the input to those recorded for the last conversion.
+        If False, all files are converted.
+    verbose : bool
+        Whether to print progress and throughput statistics.
+    kwargs :
+        Keyword arguments to pass to write_raw_brainvision.
+
+    Returns
+    -------
+    report : instance of ``collections.namedtuple`` called ConversionReport
+        Named tuple with fields for the converted, skipped and failed
+        (input, error) files, the number of bytes written and the elapsed
+        time in seconds.
+
+    Notes
+    -----
+    The record of converted inputs is kept in a hidden file in out_dir,
+    together with the keyword arguments of their conversion. Outputs which
+    have been deleted since the last conversion or were written with
+    different keyword arguments are always converted again.
+
+    The files are not loaded into memory as a whole, but streamed to the
+    output one block at a time, so that the memory use of each of the n_jobs
+    workers does not grow with the size of the recordings.
+    """
+    if check not in ('mtime', 'hash', False):
+        raise ValueError("check must be 'mtime', 'hash' or False.")
+
+    start = time.time()
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    manifest = _read_manifest(out_dir)
+
+    todo, skipped = _plan(in_dir, out_dir, pattern, check, manifest,
+                          _params_key(kwargs))
+
+    converted = []
+    failed = []
+    n_bytes = 0
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        futures = dict((pool.submit(_convert_file, in_fname, out_fname,
+                                    kwargs), (in_fname, rel, stamp))
+                       for in_fname, out_fname, rel, stamp in todo)
+        for future in as_completed(futures):
+            in_fname, rel, stamp = futures[future]
+            try:
+                n_bytes += future.result()
+            except Exception as err:
+                failed.append((in_fname, err))
+                if verbose:
+                    print('Failed: {} ({})'.format(in_fname, err))
+                continue
+            converted.append(in_fname)
+            manifest[rel] = stamp
+            # keep the record current so that an interrupted run resumes
+            _write_manifest(out_dir, manifest)
+            if verbose:
+                print('Converted: {}'.format(in_fname))
+
+    report = ConversionReport(converted, skipped, failed, n_bytes,
+                              time.time() - start)
+    if verbose:
+        _print_report(report)
+
+    return report
+
+
+def _plan(in_dir, out_dir, pattern, check, manifest, params):
+    """Split the input files into those to convert and those up to date.
+
+    params is the serialized keyword arguments for write_raw_brainvision.
+    """
+    todo = []
+    skipped = []
+    for in_fname in _find_files(in_dir, pattern):
+        rel = os.path.relpath(in_fname, in_dir)
+        out_fname = os.path.join(out_dir, os.path.splitext(rel)[0] + '.vhdr')
+        stamp = _stamp(in_fname, check)
+        # the options of the conversion are recorded with the input
+        stamp['params'] = params
+        if check and _is_current(manifest.get(rel), stamp, out_fname):
+            skipped.append(in_fname)
+        else:
+            todo.append((in_fname, out_fname, rel, stamp))
+
+    return todo, skipped
+
+
+def _find_files(in_dir, pattern):
+    """Find all files matching pattern in a directory tree."""
+    return sorted(os.path.join(root, f)
+                  for root, _, files in os.walk(in_dir)
+                  for f in fnmatch.filter(files, pattern))
+
+
+def _stamp(fname, check):
+    """Get the record of an input file to check for changes."""
+    stat = os.stat(fname)
+    stamp = dict(size=stat.st_size, mtime=stat.st_mtime)
+    if check == 'hash':
+        sha = hashlib.sha256()
+        with open(fname, 'rb') as fin:
+            for block in iter(lambda: fin.read(2 ** 20), b''):
+                sha.update(block)
+        stamp['sha256'] = sha.hexdigest()
+    return stamp
+
+
+def _is_current(recorded, stamp, out_fname):
+    """Check whether the output for an input is up to date."""
+    if recorded is None:
+        return False
+    outputs = [out_fname[:-4] + ext for ext in ('vhdr', 'vmrk', 'eeg')]
+    if not all(os.path.exists(f) for f in outputs):
+        return False
+    if recorded.get('params') != stamp['params']:
+        return False
+    if 'sha256' in stamp:
+        return recorded.get('sha256') == stamp['sha256']
+    return (recorded['size'] == stamp['size'] and
+            recorded['mtime'] == stamp['mtime'])
+
+
+def _params_key(params):
+    """Serialize parameters to a canonical string."""
+    return json.dumps(params, sort_keys=True, default=_json_default)
+
+
+def _json_default(obj):
+    """Serialize the parameter values that JSON does not support."""
+    import numpy as np
+
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    if isinstance(obj, np.generic):
+        return obj.item()
+    if callable(obj):
+        # e.g. the summary functions of retrieve
+        name = getattr(obj, '__qualname__', None)
+        if name is None or '<' in name:
+            # lambdas, closures, partials etc. are not identified by name
+            raise TypeError('Function {!r} has no stable name and cannot be '
+                            'stored. Use a function defined at the top '
+                            'level of a module instead.'.format(obj))
+        return '{}.{}'.format(getattr(obj, '__module__', None), name)
+    raise TypeError('Parameter of type {} cannot be '
+                    'stored.'.format(type(obj).__name__))
+
+
+def _read_manifest(out_dir):
+    """Read the record of converted inputs."""
+    try:
+        with open(os.path.join(out_dir, _manifest_fname)) as fin:
+            return json.load(fin)
+    except (IOError, ValueError):
+        return dict()
+
+
+def _write_manifest(out_dir, manifest):
+    """Write the record of converted inputs."""
+    fname = os.path.join(out_dir, _manifest_fname)
+    with open(fname + '.tmp', 'w') as fout:
+        json.dump(manifest, fout, indent=1, sort_keys=True)
+    os.replace(fname + '.tmp', fname)
+
+
+def _convert_file(in_fname, out_fname, kwargs):
+    """Convert a single file, returning the number of bytes written."""
+    import mne
+
+    from .io import write_raw_brainvision
+
+    out_path = os.path.dirname(out_fname)
+    if out_path and not os.path.isdir(out_path):
+        os.makedirs(out_path)
+
+    # the data are streamed block by block, reading overlapping with writing
+    raw = mne.io.read_raw_fif(in_fname, preload=False, verbose=False)
+    write_raw_brainvision(raw, out_fname, **kwargs)
+
+    return sum(os.path.getsize(out_fname[:-4] + ext)
+               for ext in ('vhdr', 'vmrk', 'eeg'))
+
+
+def _print_report(report):
+    """Print throughput statistics for a conversion."""
+    mb = report.n_bytes / 2 ** 20
+    print('{} converted, {} up to date, {} failed'.format(
+        len(report.converted), len(report.skipped), len(report.failed)))
+    print('{:.1f} MiB written in {:.1f} s ({:.1f} MiB/s, {:.2f} files/s)'.format(  # noqa: E501
+        mb, report.elapsed, mb / max(report.elapsed, 1e-9),
+        len(report.converted) / max(report.elapsed, 1e-9)))
+
+
+def main(argv=None):
+    """Convert a directory tree of FIF files to BrainVision format."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('in_dir', help='directory with the FIF files')
+    parser.add_argument('out_dir', help='directory for the BrainVision files')
+    parser.add_argument('--pattern', default='*.fif',
+                        help='pattern for the files to convert')
+    parser.add_argument('-j', '--n-jobs', type=int, default=1,
+                        help='number of parallel conversions')
+    parser.add_argument('--check', choices=['mtime', 'hash', 'none'],
+                        default='mtime',
+                        help='how to detect outputs that are up to date')
+    parser.add_argument('--format', default='binary_float32',
+                        help='binary format of the BrainVision data')
+    parser.add_argument('--orientation', default='multiplexed',
+                        help='orientation of the BrainVision data')
+    args = parser.parse_args(argv)
+
+    report = convert_to_brainvision(
+        args.in_dir, args.out_dir, pattern=args.pattern, n_jobs=args.n_jobs,
+        check=False if args.check == 'none' else args.check,
+        format=args.format, orientation=args.orientation)
+
+    return 1 if report.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -6,34 +6,42 @@
 from __future__ import division, print_function
 
 import codecs
+import csv
+import hashlib
+import json
 import os
+import re
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
 
 import mne
 
 import numpy as np
 
 from .. import __version__
+from .._base import invert_dict
+from ..precision import _working_dtype
+from ..profiling import _profiled, _stage
 
-# TODO: include boundaries in MNE annotation as segment markers
-#       in write_raw_brainvision
-# TODO: expose support for different numeric formats
-# TODO: support export to vectorized data
 # TODO: allow arbitrary names for vmrk and eeg
-# TODO: epochs exporter using segment markers
-# TODO: epochs importer using segment markers
-#       (is there another epochs format?)
 # TODO: make helper dicts private
 
 # ascii as future formats
 supported_formats = {
     'binary_float32' : 'IEEE_FLOAT_32',  # noqa: E203
     'binary_int16'   : 'INT_16',  # noqa: E203
+    'binary_int32'   : 'INT_32',  # noqa: E203
 }
 
-supported_orients = set(['multiplexed'])
+supported_orients = set(['multiplexed', 'vectorized'])
 
 
-def write_raw_brainvision(raw, vhdr_fname, events=True):
+@_profiled
+def write_raw_brainvision(raw, vhdr_fname, events=True,
+                          format='binary_float32', resolution=None,
+                          orientation='multiplexed', annotations=True,
+                          index=False, precision=None):
     """Write raw data to BrainVision format.
 
     Parameters
@@ -45,7 +53,40 @@ def write_raw_brainvision(raw, vhdr_fname, events=True):
 
     events : boolean or ndarray
         If ndarry, events to write in marker file. Otherwise, boolean indicator
-        to extract and write events from raw.
+        to extract and write events from raw. Instead of an MNE events array,
+        a structured array of markers (see Notes) can be passed.
+    format : str
+        Binary format of the data file, one of 'binary_float32',
+        'binary_int16' or 'binary_int32'.
+    resolution : float | array-like of float | None
+        Resolution in microvolts, either a single value for all channels or
+        one value per exported channel. If None, 0.1 µV is used for floating
+        point formats and the finest resolution that represents each
+        channel's full amplitude range without clipping is used for integer
+        formats.
+    orientation : str
+        Data orientation, either 'multiplexed' (all channels for one time
+        point, then the next time point) or 'vectorized' (all time points
+        for one channel, then the next channel). Vectorized data can be
+        written directly from MNE's channels x times buffer without
+        transposing.
+    annotations : bool
+        Whether to write the annotations of raw to the marker file, see
+        Notes.
+    index : bool
+        Whether to write an integrity index next to the header file, with
+        the SHA-256 hash of each block of the data file and the minimum,
+        maximum and sum of the stored values of each channel. The index is
+        computed while writing and used by verify_brainvision.
+    precision : None | 'float64' | 'float32'
+        Precision of the scaling to the resolution, see
+        philistine.set_precision. If None, the package-wide setting is used.
+        In single precision, the blocks of data are converted to float32
+        before scaling for 'binary_float32', which halves the temporary
+        arrays. The stored values then differ from those of double precision
+        by at most one unit in the last place of float32. The integer
+        formats are always scaled in double precision, so that the
+        round-trip error stays within half the resolution.
 
     Notes
     -----
@@ -57,7 +98,26 @@ def write_raw_brainvision(raw, vhdr_fname, events=True):
     simple integers, e.g. distinguishing on supported hardware between stimulus
     codes (prefixed by an S) and responses codes (prefixed by an R). MNE's
     numeric events are all treated as 'stimulus markers' and prefixed by an S
-    on output.
+    on output. Other marker types can be written by passing a structured
+    array with fields 'type', 'description', 'position' (0-based sample),
+    'size' (in samples) and 'channel' (0 for all channels), as returned by
+    the marker reader, instead of an events array.
+
+    Markers from events and from annotations are positioned differently.
+    For compatibility with earlier versions, the sample numbers of events
+    are written as is, as 1-based positions. As MNE's event samples include
+    ``raw.first_samp``, a stimulus marker is thus at the data index
+    ``sample - 1`` for Raws starting at the first sample of a recording, but
+    offset by ``first_samp`` otherwise. Annotations and structured markers
+    are written at their index in the exported data (i.e. relative to the
+    first exported sample), which MNE's reader turns back into the same
+    onsets.
+
+    Annotations are exported as markers with their duration as size.
+    Annotations read by MNE from BrainVision files have descriptions of the
+    form 'Stimulus/S  1' and are split back into type and description.
+    Boundary annotations (e.g. from concatenating Raws) are exported as
+    'New Segment' markers and all other annotations as 'Comment' markers.
 
     Note however that only channels of type 'eeg','eog', 'meg' and 'misc' are
     exported. This follows from the observation that BrainVision recordings
@@ -82,77 +142,705 @@ def write_raw_brainvision(raw, vhdr_fname, events=True):
     In other words, a round trip import-export is a lossy operation in terms of
     metadata. The actual EEG recording should be losslessly preserved within
     the realm of floating point precision and the constraints above.
+
+    For the integer formats, the data are additionally quantized to the
+    (per-channel) resolution, i.e. the round-trip error is at most half the
+    resolution of each channel. A ValueError is raised if an explicitly
+    specified resolution is too fine to represent the data without clipping.
+    """
+    orientation = _check_orientation(orientation)
+    fmt = _check_format(format)
+    with _stage('write_raw_brainvision.markers'):
+        markers = _get_markers(raw, events, annotations)
+
+    # eliminate the stim channel -- without copying the data, the blocks of
+    # the remaining channels are read on demand
+    picks = _export_picks(raw)
+    ch_names = [raw.ch_names[p] for p in picks]
+    _write_brainvision(vhdr_fname, _raw_block_reader(raw, picks), ch_names,
+                       raw.info['sfreq'], raw.n_times, markers, fmt,
+                       resolution, orientation, index=index,
+                       precision=precision)
+
+
+def write_array_brainvision(data, vhdr_fname, ch_names, sfreq, events=None,
+                            format='binary_float32', resolution=None,
+                            orientation='multiplexed', index=False):
+    """Write an array of data to BrainVision format.
+
+    Parameters
+    ----------
+    data : array-like, shape (n_channels, n_times)
+        The data in volts, e.g. an ndarray or a ``numpy.memmap``. Data stored
+        with time as the first axis can be passed transposed, e.g.
+        ``np.load(fname, mmap_mode='r').T``.
+    vhdr_fname : str
+        Path to the EEG header file.
+    ch_names : list of str
+        The channel names.
+    sfreq : float
+        The sampling frequency in Hz.
+    events : ndarray | None
+        Events to write in the marker file, either an MNE-style events array
+        with the 0-based sample of each event in the first column or a
+        structured array of markers, see write_raw_brainvision. If None, only
+        the initial "New Segment" marker is written.
+    format : str
+        Binary format of the data file, see write_raw_brainvision.
+    resolution : float | array-like of float | None
+        Resolution in microvolts, see write_raw_brainvision.
+    orientation : str
+        Data orientation, see write_raw_brainvision.
+    index : bool
+        Whether to write an integrity index, see write_raw_brainvision.
+
+    Notes
+    -----
+    The data are read, converted and written one block at a time, so that
+    a memory-mapped array is never loaded as a whole. Array-likes that are
+    not ndarrays are converted with ``np.asarray`` once, which does not copy
+    objects implementing ``__array__`` as a view, e.g. memmaps.
+
+    The markers of an events array are positioned at the given 0-based
+    samples, i.e. the file stores ``sample + 1`` as the 1-based position.
+    This differs from write_raw_brainvision, which keeps its legacy use of
+    the sample number as the 1-based position.
+    """
+    data = np.asarray(data)
+    if data.ndim != 2:
+        raise ValueError('data must be a 2D array of channels x times.')
+    if len(ch_names) != data.shape[0]:
+        raise ValueError('The number of channel names ({}) does not match '
+                         'the number of channels in data '
+                         '({}).'.format(len(ch_names), data.shape[0]))
+
+    orientation = _check_orientation(orientation)
+    fmt = _check_format(format)
+    if events is None:
+        events = np.empty((0, 3), dtype=int)
+    markers = np.asarray(events)
+    if markers.dtype.names is None:
+        markers = _events_to_markers(events)
+        markers['position'] = np.asarray(events)[:, 0]
+
+    _write_brainvision(vhdr_fname, lambda start, stop: data[:, start:stop],
+                       list(ch_names), sfreq, data.shape[1], markers, fmt,
+                       resolution, orientation, index=index)
+
+
+def _write_brainvision(vhdr_fname, read_block, ch_names, sfreq, n_times,
+                       markers, fmt, resolution, orientation, index=False,
+                       block_size=None, precision=None):
+    """Write the BrainVision header, marker and data files.
+
+    The data are given as a function reading blocks of data in volts, see
+    _raw_block_reader. The resolution is determined from the data if
+    necessary and the integrity index written if requested; a stale index
+    from an earlier export is removed otherwise.
+
+    For integer formats, the peak of the data is checked against the
+    resolution before any file is opened, so that a ValueError for data
+    that would be clipped leaves an earlier export at the same path intact.
     """
     vmrk_fname = vhdr_fname[:-4] + 'vmrk'
     eeg_fname = vhdr_fname[:-4] + 'eeg'
 
+    n_chan = len(ch_names)
+    dtype = _format_dtype(fmt)
+    with _stage('write_brainvision.resolution'):
+        peak = None
+        if dtype.kind != 'f':
+            peak = _blockwise_peak(read_block, n_chan, n_times, block_size)
+        resolution = _get_resolution(n_chan, fmt, resolution,
+                                     peak=lambda: peak)
+        if peak is not None and np.any(np.round(peak * 1e6 / resolution) >
+                                       np.iinfo(dtype).max):
+            raise ValueError('Data would be clipped when written as {} with '
+                             'the given resolution. Use a coarser resolution '
+                             'or let it be determined '
+                             'automatically.'.format(dtype.name))
+
+    with _stage('write_brainvision.vmrk'):
+        _write_vmrk_file(vmrk_fname, eeg_fname, markers)
+    with _stage('write_brainvision.vhdr'):
+        _write_vhdr(vhdr_fname, vmrk_fname, eeg_fname, ch_names, sfreq,
+                    orientation, fmt, resolution)
+
+    block_index = _BlockIndex(n_chan) if index else None
+    with _stage('write_brainvision.eeg'):
+        _write_bveeg_blocks(eeg_fname, read_block, n_chan, n_times,
+                            orientation, dtype, resolution,
+                            block_size=block_size, index=block_index,
+                            precision=precision)
+    if index:
+        with _stage('write_brainvision.index'):
+            _write_index_file(_index_fname(vhdr_fname), block_index,
+                              ch_names)
+    elif os.path.exists(_index_fname(vhdr_fname)):
+        # an index left over from an earlier export would not match
+        os.remove(_index_fname(vhdr_fname))
+
+
+def append_raw_brainvision(raw, vhdr_fname, events=True, annotations=True):
+    """Append raw data as a new segment to an existing BrainVision file.
+
+    Parameters
+    ----------
+    raw : instance of Raw
+        The raw data to append. The exported channels (see
+        write_raw_brainvision) and the sampling frequency must match the
+        existing file.
+    vhdr_fname : str
+        Path to the EEG header file.
+    events : boolean or ndarray
+        If ndarry, events to write in marker file. Otherwise, boolean indicator
+        to extract and write events from raw. Instead of an MNE events array,
+        a structured array of markers can be passed.
+    annotations : bool
+        Whether to write the annotations of raw to the marker file.
+
+    Notes
+    -----
+    The new data are appended to the data file in the binary format and with
+    the resolution of the existing file; the header is not modified. A
+    "New Segment" marker is appended to the marker file at the start of the
+    new data, followed by the events and annotations of raw, shifted to
+    their position in the file; within the new segment, they are positioned
+    as in write_raw_brainvision. The existing data and markers are left
+    untouched, so that the cost of appending is proportional to the size of
+    the appended data.
+
+    Only multiplexed files can be appended to, as the channels in vectorized
+    files are stored one after another. For integer formats, a ValueError is
+    raised before anything is written if the new data exceed the range of
+    the existing resolution.
+    """
+    header = _read_vhdr_file(vhdr_fname)
+    if header['orientation'] != 'multiplexed':
+        raise ValueError('Only multiplexed BrainVision files can be '
+                         'appended to.')
+
+    picks = _export_picks(raw)
+    ch_names = [raw.ch_names[p] for p in picks]
+    if ch_names != header['ch_names']:
+        raise ValueError('The channels of raw do not match the channels '
+                         'of {}.'.format(vhdr_fname))
+    if int(1e6 / raw.info['sfreq']) != round(1e6 / header['sfreq']):
+        raise ValueError('The sampling frequency of raw does not match the '
+                         'sampling frequency of {}.'.format(vhdr_fname))
+
+    dtype = _format_dtype(header['format'])
+    resolution = header['cals'] * 1e6
+    read_block = _raw_block_reader(raw, picks)
+    if dtype.kind != 'f':
+        peak = _blockwise_peak(read_block, len(picks), raw.n_times)
+        if np.any(np.round(peak * 1e6 / resolution) > np.iinfo(dtype).max):
+            raise ValueError('Data would be clipped when appended with the '
+                             'resolution of {}.'.format(vhdr_fname))
+
+    n_times = (os.path.getsize(header['eeg_fname']) //
+               (dtype.itemsize * len(ch_names)))
+
+    segment = np.zeros(1, dtype=_marker_dtype(len('New Segment'), 1))
+    segment['type'] = 'New Segment'
+    segment['size'] = 1
+    markers = _concatenate_markers([segment,
+                                    _get_markers(raw, events, annotations)])
+    markers['position'] += n_times
+
+    _append_vmrk_file(header['vmrk_fname'], markers)
+    _write_bveeg_blocks(header['eeg_fname'], read_block, len(picks),
+                        raw.n_times, 'multiplexed', dtype, resolution,
+                        mode='ab')
+    # the integrity index no longer matches the data file
+    if os.path.exists(_index_fname(vhdr_fname)):
+        os.remove(_index_fname(vhdr_fname))
+
+
+def write_epochs_brainvision(epochs, vhdr_fname, format='binary_float32',
+                             resolution=None, orientation='multiplexed'):
+    """Write epoched data to BrainVision format as segmented data.
+
+    Parameters
+    ----------
+    epochs : instance of Epochs
+        The epoched data to write.
+    vhdr_fname : str
+        Path to the EEG header file.
+    format : str
+        Binary format of the data file, see write_raw_brainvision.
+    resolution : float | array-like of float | None
+        Resolution in microvolts, see write_raw_brainvision.
+    orientation : str
+        Data orientation, see write_raw_brainvision.
+
+    Notes
+    -----
+    The epochs are written one after another, each starting with a
+    "New Segment" marker, as in segmented exports from BrainVision Analyzer.
+    Time zero of each epoch is marked with a "Time 0" marker and the
+    time-locking event as a stimulus marker at the same position, with the
+    event code from ``epochs.events`` as description. The event names in
+    ``epochs.event_id`` are not stored.
+
+    The data are streamed to disk a few epochs at a time, without building
+    a concatenated array of all epochs. Epochs that are not preloaded are
+    read from their Raw on demand; bad epochs are dropped first.
+
+    The time-locking point must be within the epochs, i.e. tmin <= 0 <= tmax,
+    as it is only stored as the position of the markers in each segment.
+
+    The same restrictions on exported channels as for write_raw_brainvision
+    apply.
+    """
+    orientation = _check_orientation(orientation)
+    fmt = _check_format(format)
+    if epochs.tmin > 0 or epochs.tmax < 0:
+        raise ValueError('The time-locking point (time 0) must be within the '
+                         'epochs to be marked in the segments, got tmin={} '
+                         'and tmax={}.'.format(epochs.tmin, epochs.tmax))
+
+    if not epochs.preload:
+        epochs.drop_bad()
+
+    picks = _export_picks(epochs)
+    ch_names = [epochs.ch_names[p] for p in picks]
+    n_samp = len(epochs.times)
+    # blocks of whole epochs
+    block_size = n_samp * max(1, _block_samples(len(picks)) // n_samp)
+    _write_brainvision(vhdr_fname, _epochs_block_reader(epochs, picks),
+                       ch_names, epochs.info['sfreq'],
+                       len(epochs.events) * n_samp,
+                       _epochs_to_markers(epochs), fmt, resolution,
+                       orientation, block_size=block_size)
+
+
+def _epochs_block_reader(epochs, picks):
+    """Get a function reading blocks of the picked channels from Epochs.
+
+    The function takes start and stop samples of the concatenated epochs,
+    which must be aligned to the epoch boundaries (except for the end of the
+    last epoch), and returns the data in volts with shape
+    (n_picks, stop - start).
+    """
+    n_samp = len(epochs.times)
+
+    def read_block(start, stop):
+        first, last = start // n_samp, -(-stop // n_samp)
+        if epochs.preload:
+            data = epochs._data[first:last][:, picks]
+        else:
+            data = epochs[first:last].get_data(picks=picks)
+        # epochs x channels x times -> channels x (epochs, times)
+        return data.transpose(1, 0, 2).reshape(len(picks), -1)
+
+    return read_block
+
+
+def _epochs_to_markers(epochs):
+    """Get the segment and event markers for writing Epochs."""
+    n_samp = len(epochs.times)
+    onsets = np.arange(len(epochs.events)) * n_samp
+    zero = int(np.round(-epochs.tmin * epochs.info['sfreq']))
+
+    # the first segment marker is always written with the header
+    segments = np.zeros(max(len(onsets) - 1, 0),
+                        dtype=_marker_dtype(len('New Segment'), 1))
+    segments['type'] = 'New Segment'
+    segments['position'] = onsets[1:]
+    segments['size'] = 1
+
+    # the time-locking point, as in segmented exports from Analyzer
+    time0 = np.zeros(len(onsets), dtype=_marker_dtype(len('Time 0'), 1))
+    time0['type'] = 'Time 0'
+    time0['position'] = onsets + zero
+    time0['size'] = 1
+
+    events = _events_to_markers(epochs.events)
+    events['position'] = onsets + zero
+
+    markers = _concatenate_markers([segments, time0, events])
+    return markers[np.argsort(markers['position'], kind='stable')]
+
+
+def _export_picks(raw):
+    """Get the indices of the channels exported to BrainVision."""
+    return mne.pick_types(raw.info, eeg=True, eog=True, meg=True, misc=True)
+
+
+def _get_markers(raw, events, annotations):
+    """Get the markers to export for a Raw, sorted by position."""
     if isinstance(events, np.ndarray):
         pass
     elif events is False:
         events = np.ndarray([0, 3])
     elif events is True:
-        # if there are no events, then don't fail
-        try:
-            events = mne.find_events(raw, verbose=False)
-        except ValueError:
-            events = np.ndarray([0, 3])
+        events = _find_events_blockwise(raw)
     else:
         raise ValueError('events must be boolean or 3 x n_events ndarray.')   # noqa: E501
 
-    # eliminate the stim channel
-    raw = raw.copy().pick_types(eeg=True, eog=True, meg=True, misc=True)
+    markers = events
+    if markers.dtype.names is None:
+        markers = _events_to_markers(markers)
+    if annotations:
+        markers = _concatenate_markers([markers,
+                                        _annotations_to_markers(raw)])
+        markers = markers[np.argsort(markers['position'], kind='stable')]
 
-    _write_vmrk_file(vmrk_fname, eeg_fname, events)
-    _write_vhdr_file(vhdr_fname, vmrk_fname, eeg_fname, raw)
-    _write_bveeg_file(eeg_fname, raw)
+    return markers
 
 
-def _write_vmrk_file(vmrk_fname, eeg_fname, events):
-    """Write BrainvVision marker file."""
-    with codecs.open(vmrk_fname, 'w', encoding='utf-8') as fout:
-        print(r'Brain Vision Data Exchange Marker File, Version 1.0', file=fout)  # noqa: E501
-        print(r';Exported from MNE-Python using philistine {}'.format(__version__), file=fout)  # noqa: E501
-        print(r'', file=fout)
-        print(r'[Common Infos]', file=fout)
-        print(r'Codepage=UTF-8', file=fout)
-        print(r'DataFile={}'.format(eeg_fname.split(os.sep)[-1]), file=fout)  # noqa: E501
-        print(r'', file=fout)
-        print(r'[Marker Infos]', file=fout)
-        print(r'; Each entry: Mk<Marker number>=<Type>,<Description>,<Position in data points>,', file=fout)  # noqa: E501
-        print(r'; <Size in data points>, <Channel number (0 = marker is related to all channels)>', file=fout)  # noqa: E501
-        print(r'; Fields are delimited by commas, some fields might be omitted (empty).', file=fout)  # noqa: E501
-        print(r'; Commas in type or description text are coded as "\1".', file=fout)  # noqa: E501
-        print(r'Mk1=New Segment,,1,1,0,0', file=fout)
+# default stim channels, in the order MNE looks for them
+_stim_channels = ('STI101', 'STI 014', 'STI014')
 
-        if events.shape[0] == 0:
-            return
 
-        twidth = int(np.ceil(np.log10(np.max(events[:, 2]))))
-        tformat = 'S{:>' + str(twidth) + '}'
+def _find_events_blockwise(raw, block_size=None):
+    """Find events in the stim channel(s) of a Raw, one block at a time.
 
-        for i, r in enumerate(range(events.shape[0]), start=2):
-            print(r'Mk{}=Stimulus,{},{},1,0'.format(i, tformat.format(events[r, 2]),   # noqa: E501
-                                                    events[r, 0]), file=fout)
+    The events are the same as with ``mne.find_events`` with its default
+    settings, i.e. the onsets of all increasing steps, but only one block
+    of the stim channel is in memory at a time, so that this also works
+    for large Raws which are not preloaded. Unlike ``mne.find_events``,
+    events shorter than two samples are kept and a Raw without stim channel
+    simply has no events.
+    """
+    picks = [raw.ch_names.index(ch) for ch in _stim_channels
+             if ch in raw.ch_names][:1]
+    if not picks:
+        picks = mne.pick_types(raw.info, meg=False, stim=True)
+    if block_size is None:
+        block_size = _block_samples(1)
 
+    events = [np.empty((0, 3), dtype=np.int64)]
+    for pick in picks:
+        previous = None
+        for start, stop in _block_ranges(raw.n_times, block_size):
+            data = raw.get_data(picks=[pick], start=start, stop=stop)[0]
+            # trigger channels are treated as positive, as in MNE
+            data = np.abs(data.astype(np.int64))
+            if previous is None:
+                previous = data[0]
+            # the last value of the previous block is the first reference
+            pre = np.concatenate([[previous], data[:-1]])
+            onsets = np.flatnonzero(data > pre)
+            events.append(np.column_stack([onsets + start + raw.first_samp,
+                                           pre[onsets], data[onsets]]))
+            previous = data[-1]
+
+    events = np.concatenate(events)
+    return events[np.argsort(events[:, 0], kind='stable')]
 
-def _write_vhdr_file(vhdr_fname, vmrk_fname, eeg_fname, raw,
-                     orientation='multiplexed',
-                     format='binary_float32'):
-    """Write BrainvVision header file."""
-    fmt = format.lower()
 
+def _check_orientation(orientation):
+    """Check that a data orientation is supported."""
     if orientation.lower() not in supported_orients:
         errmsg = ('Orientation {} not supported.'.format(orientation) +
                   'Currently supported orientations are: ' +
                   ', '.join(supported_orients))
         raise ValueError(errmsg)
 
-    if fmt not in supported_formats:
+    return orientation.lower()
+
+
+def _check_format(format):
+    """Check that a data format is supported."""
+    if format.lower() not in supported_formats:
         errmsg = ('Data format {} not supported.'.format(format) +
                   'Currently supported formats are: ' +
                   ', '.join(supported_formats))
         raise ValueError(errmsg)
 
+    return format.lower()
+
+
+def _format_dtype(format):
+    """Map a data format to the matching (little-endian) NumPy dtype."""
+    fmt = format.lower()
+    if fmt[:len('binary')] == 'binary':
+        return np.dtype(fmt[len('binary') + 1:]).newbyteorder('<')
+    else:
+        errmsg = 'Cannot map data format {} to NumPy dtype'.format(format)
+        raise ValueError(errmsg)
+
+
+def _get_resolution(n_chan, format, resolution=None, peak=None):
+    """Get the per-channel resolution in µV for writing data.
+
+    Parameters
+    ----------
+    n_chan : int
+        The number of channels to be written.
+    format : str
+        The data format to be written.
+    resolution : float | array-like of float | None
+        The requested resolution. If None, the default for the format is
+        used, see Notes.
+    peak : callable
+        Function returning the maximum absolute value (in volts) of each
+        channel. It is only called when needed, i.e. for integer formats
+        without explicit resolution.
+
+    Returns
+    -------
+    resolution : ndarray, shape (n_channels,)
+        The resolution in µV for each channel.
+
+    Notes
+    -----
+    For floating point formats, the default resolution is 0.1 µV, which is
+    what BrainVision Recorder uses for most amplifiers. For integer formats,
+    the resolution is the finest resolution that still allows for
+    representing the largest absolute value in each channel.
+    """
+    dtype = _format_dtype(format)
+
+    if resolution is not None:
+        resolution = np.broadcast_to(np.asarray(resolution, dtype=np.float64),
+                                     (n_chan,)).copy()
+        if np.any(resolution <= 0):
+            raise ValueError('resolution must be positive.')
+    elif dtype.kind == 'f':
+        resolution = np.full(n_chan, 0.1)
+    else:
+        # the smallest step size that maps the peak value onto the largest
+        # representable integer, expressed in µV
+        resolution = peak() * 1e6 / np.iinfo(dtype).max
+        # flat channels don't constrain the resolution
+        resolution[resolution == 0] = 0.1
+
+    return resolution
+
+
+def _format_resolution(resolution):
+    """Format resolution for the header such that it is read back exactly."""
+    # repr gives the shortest string that round trips
+    return repr(float(resolution))
+
+
+def _scale_data(data, dtype, resolution, work_dtype=np.float64):
+    """Scale data (in volts) to the given resolution and convert to dtype.
+
+    The scaling is done in work_dtype for floating point formats. Integer
+    formats are always scaled in double precision, as rounding in single
+    precision can change the stored integers.
+    """
+    scale = 1e6 / resolution[:, np.newaxis]
+    if work_dtype != np.float64 and dtype.kind == 'f':
+        # scale a single precision copy in place
+        data = data.astype(work_dtype)
+        data *= scale.astype(work_dtype)
+    else:
+        data = data * scale
+
+    if dtype.kind == 'f':
+        return data.astype(dtype, copy=False)
+
+    np.rint(data, out=data)
+    info = np.iinfo(dtype)
+    if data.size and (data.max() > info.max or data.min() < info.min):
+        raise ValueError('Data would be clipped when written as {} with the '
+                         'given resolution. Use a coarser resolution or '
+                         'let it be determined '
+                         'automatically.'.format(dtype.name))
+
+    return data.astype(dtype)
+
+
+def _write_vmrk_file(vmrk_fname, eeg_fname, events):
+    """Write BrainvVision marker file.
+
+    Events are either an MNE events array or a structured array of markers.
+    The marker entries are formatted in batches and written in one go per
+    batch, which is much faster for large numbers of markers than writing
+    line by line.
+    """
+    if events.dtype.names is None:
+        events = _events_to_markers(events)
+
+    with open(vmrk_fname, 'w', encoding='utf-8',
+              buffering=_vmrk_buffer_size) as fout:
+        fout.write('\n'.join([
+            r'Brain Vision Data Exchange Marker File, Version 1.0',
+            r';Exported from MNE-Python using philistine {}'.format(__version__),  # noqa: E501
+            r'',
+            r'[Common Infos]',
+            r'Codepage=UTF-8',
+            r'DataFile={}'.format(eeg_fname.split(os.sep)[-1]),
+            r'',
+            r'[Marker Infos]',
+            r'; Each entry: Mk<Marker number>=<Type>,<Description>,<Position in data points>,',  # noqa: E501
+            r'; <Size in data points>, <Channel number (0 = marker is related to all channels)>',  # noqa: E501
+            r'; Fields are delimited by commas, some fields might be omitted (empty).',  # noqa: E501
+            r'; Commas in type or description text are coded as "\1".',
+            r'Mk1=New Segment,,1,1,0,0',
+            r'']))
+
+        for start in range(0, events.shape[0], _vmrk_batch_size):
+            fout.write(_format_markers(events[start:start + _vmrk_batch_size],
+                                       first=start + 2))
+
+
+# number of markers formatted in one batch
+_vmrk_batch_size = 2 ** 16
+_vmrk_buffer_size = 2 ** 20
+
+
+def _append_vmrk_file(vmrk_fname, markers):
+    """Append markers to an existing BrainVision marker file.
+
+    The markers are numbered after the last existing marker. If the marker
+    section is the last section of the file (as is usually the case), the
+    markers are simply appended; otherwise, the file is rewritten with the
+    markers inserted at the end of the marker section.
+    """
+    text, encoding = _read_text(vmrk_fname, return_encoding=True)
+    start = text.find('[Marker Infos]')
+    if start < 0:
+        raise ValueError('{} has no marker section.'.format(vmrk_fname))
+    stop = text.find('\n[', start + 1)
+
+    numbers = _mk_number.findall(text, start, stop if stop >= 0 else len(text))
+    first = max(int(n) for n in numbers) + 1 if numbers else 1
+    entries = ''.join(_format_markers(markers[ii:ii + _vmrk_batch_size],
+                                      first=first + ii)
+                      for ii in range(0, markers.shape[0], _vmrk_batch_size))
+    newline = '\r\n' if '\r\n' in text else '\n'
+    entries = entries.replace('\n', newline)
+
+    if stop < 0:
+        if not text.endswith('\n'):
+            entries = newline + entries
+        with open(vmrk_fname, 'ab') as fout:
+            fout.write(entries.encode(encoding))
+    else:
+        # insert before the blank line(s) preceding the next section
+        insert = len(text[:stop + 1].rstrip()) + len(newline)
+        text = text[:insert] + entries + text[insert:]
+        with open(vmrk_fname + '.tmp', 'wb') as fout:
+            fout.write(text.encode(encoding))
+        os.replace(vmrk_fname + '.tmp', vmrk_fname)
+
+
+_mk_number = re.compile(r'^Mk(\d+)=', re.MULTILINE)
+
+
+def _format_markers(markers, first):
+    """Format markers as marker file entries, starting with Mk<first>."""
+    if markers.shape[0] == 0:
+        return ''
+    mtype = _escape_commas(markers['type'])
+    desc = _escape_commas(markers['description'])
+    # the file stores 1-based positions
+    entries = map(r'Mk{}={},{},{},{},{}'.format,
+                  range(first, first + markers.shape[0]),
+                  mtype, desc,
+                  (markers['position'] + 1).tolist(),
+                  markers['size'].tolist(),
+                  markers['channel'].tolist())
+    return '\n'.join(entries) + '\n'
+
+
+def _escape_commas(text):
+    """Code commas in marker text as required for the marker file."""
+    text = text.tolist()
+    if any(',' in t for t in set(text)):
+        text = [t.replace(',', r'\1') for t in text]
+    return text
+
+
+def _events_to_markers(events):
+    """Convert an MNE events array to stimulus markers."""
+    events = np.asarray(events)
+    if events.shape[0] == 0:
+        return np.array([], dtype=_marker_dtype(1, 1))
+
+    twidth = int(np.ceil(np.log10(np.max(events[:, 2]))))
+    tformat = 'S{:>' + str(twidth) + '}'
+    # format each distinct code only once
+    codes, inverse = np.unique(events[:, 2], return_inverse=True)
+    desc = np.array(list(map(tformat.format, codes.tolist())))
+    desc = desc[inverse.ravel()]
+
+    markers = np.empty(events.shape[0],
+                       dtype=_marker_dtype(len('Stimulus'),
+                                           desc.itemsize // 4))
+    markers['type'] = 'Stimulus'
+    markers['description'] = desc
+    # event samples have always been written as is, i.e. the sample index is
+    # used as 1-based position -- we keep that for compatibility
+    markers['position'] = events[:, 0] - 1
+    markers['size'] = 1
+    markers['channel'] = 0
+
+    return markers
+
+
+# marker types used by BrainVision Recorder and Analyzer, which MNE's reader
+# prepends to the description of the corresponding annotations
+_marker_types = ('Stimulus', 'Response', 'Comment', 'New Segment',
+                 'Bad Interval', 'SyncStatus', 'Time 0')
+
+_boundary_descriptions = ('BAD boundary', 'EDGE boundary')
+
+
+def _annotations_to_markers(raw):
+    """Convert the annotations of a Raw to markers."""
+    annot = raw.annotations
+    if len(annot) == 0:
+        return np.array([], dtype=_marker_dtype(1, 1))
+
+    # there are generally few distinct descriptions, so we only split those
+    uniq, inverse = np.unique(annot.description, return_inverse=True)
+    mtype = []
+    desc = []
+    for d in uniq:
+        prefix, sep, rest = d.partition('/')
+        if d in _boundary_descriptions:
+            mtype.append('New Segment')
+            desc.append('')
+        elif sep and prefix in _marker_types:
+            mtype.append(prefix)
+            desc.append(rest)
+        else:
+            mtype.append('Comment')
+            desc.append(d)
+    mtype = np.array(mtype)[inverse.ravel()]
+    desc = np.array(desc)[inverse.ravel()]
+
+    sfreq = raw.info['sfreq']
+    markers = np.empty(len(annot), dtype=_marker_dtype(mtype.itemsize // 4,
+                                                       desc.itemsize // 4))
+    markers['type'] = mtype
+    markers['description'] = desc
+    onset = annot.onset
+    if annot.orig_time is None:
+        # without orig_time, the onsets include the time of the first sample
+        onset = onset - raw.first_time
+    markers['position'] = raw.time_as_index(onset, use_rounding=True,
+                                            origin=annot.orig_time)
+    markers['size'] = np.maximum(np.round(annot.duration * sfreq), 1)
+    markers['channel'] = 0
+
+    return markers
+
+
+def _write_vhdr_file(vhdr_fname, vmrk_fname, eeg_fname, raw,
+                     orientation='multiplexed',
+                     format='binary_float32',
+                     resolution=None):
+    """Write BrainvVision header file."""
+    orientation = _check_orientation(orientation)
+    fmt = _check_format(format)
+    resolution = _get_resolution(len(raw.ch_names), fmt, resolution,
+                                 peak=lambda: _peak(raw._data))
+
+    _write_vhdr(vhdr_fname, vmrk_fname, eeg_fname, raw.ch_names,
+                raw.info['sfreq'], orientation, fmt, resolution)
+
+
+def _write_vhdr(vhdr_fname, vmrk_fname, eeg_fname, ch_names, sfreq,
+                orientation, fmt, resolution):
+    """Write BrainvVision header file for checked orientation and format."""
     with codecs.open(vhdr_fname, 'w', encoding='utf-8') as fout:
         print(r'Brain Vision Data Exchange Header File Version 1.0', file=fout)  # noqa: E501
         print(r';Exported from MNE-Python using philistine {}'.format(__version__), file=fout)  # noqa: E501
@@ -162,21 +850,24 @@ def _write_vhdr_file(vhdr_fname, vmrk_fname, eeg_fname, raw,
         print(r'DataFile={}'.format(eeg_fname.split(os.sep)[-1]), file=fout)  # noqa: E501
         print(r'MarkerFile={}'.format(vmrk_fname.split(os.sep)[-1]), file=fout)  # noqa: E501
 
-        if 'binary' in format.lower():
+        if 'binary' in fmt:
             print(r'DataFormat=BINARY', file=fout)
 
-        if 'multiplexed' == orientation.lower():
+        if 'multiplexed' == orientation:
             print(r'Data orientation: MULTIPLEXED=ch1,pt1, ch2,pt1 ...', file=fout)  # noqa: E501
             print(r'DataOrientation=MULTIPLEXED', file=fout)
+        elif 'vectorized' == orientation:
+            print(r'Data orientation: VECTORIZED=ch1,pt1, ch1,pt2 ...', file=fout)  # noqa: E501
+            print(r'DataOrientation=VECTORIZED', file=fout)
 
-        print(r'NumberOfChannels={}'.format(len(raw.ch_names)), file=fout)  # noqa: E501
+        print(r'NumberOfChannels={}'.format(len(ch_names)), file=fout)  # noqa: E501
         print(r'; Sampling interval in microseconds', file=fout)
-        print(r'SamplingInterval={}'.format(int(1e6 / raw.info['sfreq'])), file=fout)  # noqa: E501
+        print(r'SamplingInterval={}'.format(int(1e6 / sfreq)), file=fout)  # noqa: E501
         print(r'', file=fout)
 
-        if 'binary' in format.lower():
+        if 'binary' in fmt:
             print(r'[Binary Infos]', file=fout)
-            print(r'BinaryFormat={}'.format(supported_formats[format]), file=fout)  # noqa: E501
+            print(r'BinaryFormat={}'.format(supported_formats[fmt]), file=fout)  # noqa: E501
             print(r'', file=fout)
 
         print(r'[Channel Infos]', file=fout)
@@ -184,11 +875,8 @@ def _write_vhdr_file(vhdr_fname, vmrk_fname, eeg_fname, raw,
         print(r'; <Resolution in microvolts>,<Future extensions..', file=fout)
         print(r'; Fields are delimited by commas, some fields might be omitted (empty).', file=fout)  # noqa: E501
         print(r'; Commas in channel names are coded as "\1".', file=fout)
-        for i, ch in enumerate(raw.ch_names, start=1):
-            # not sure 0.1 µV is a sensible default resolution or if there is a
-            # good way to determine this based on the values in the array, but
-            #  this is the resolution in the BV files this is being tested on
-            print(r'Ch{}={},,0.1'.format(i, ch), file=fout)
+        for i, (ch, res) in enumerate(zip(ch_names, resolution), start=1):
+            print(r'Ch{}={},,{}'.format(i, ch, _format_resolution(res)), file=fout)  # noqa: E501
 
         print(r'', file=fout)
         print(r'[Comment]', file=fout)
@@ -196,49 +884,999 @@ def _write_vhdr_file(vhdr_fname, vmrk_fname, eeg_fname, raw,
 
 
 def _write_bveeg_file(eeg_fname, raw, orientation='multiplexed',
-                      format='binary_float32'):
+                      format='binary_float32', resolution=None):
     """Write BrainVision data file."""
-    fmt = format.lower()
+    orientation = _check_orientation(orientation)
+    fmt = _check_format(format)
+    dtype = _format_dtype(fmt)
+    resolution = _get_resolution(len(raw.ch_names), fmt, resolution,
+                                 peak=lambda: _peak(raw._data))
 
-    if orientation.lower() not in supported_orients:
-        errmsg = ('Orientation {} not supported.'.format(orientation) +
-                  'Currently supported orientations are: ' +
-                  ', '.join(supported_orients))
-        raise ValueError(errmsg)
+    picks = np.arange(len(raw.ch_names))
+    _write_bveeg_blocks(eeg_fname, _raw_block_reader(raw, picks),
+                        len(picks), raw.n_times, orientation, dtype,
+                        resolution)
 
-    if fmt not in supported_formats:
-        errmsg = ('Data format {} not supported.'.format(format) +
-                  'Currently supported formats are: ' +
-                  ', '.join(supported_formats))
-        raise ValueError(errmsg)
 
-    if fmt[:len('binary')] == 'binary':
-        dtype = np.dtype(format.lower()[len('binary') + 1:])
+# approximate size of the (float64) blocks the data are processed in
+_block_bytes = 2 ** 24
+
+
+def _block_samples(n_chan):
+    """Get the number of samples per block for the given channel count."""
+    return max(1, _block_bytes // (8 * max(n_chan, 1)))
+
+
+def _block_ranges(n_times, block_size):
+    """Get (start, stop) of the blocks covering n_times samples."""
+    return [(start, min(start + block_size, n_times))
+            for start in range(0, n_times, block_size)]
+
+
+def _raw_block_reader(raw, picks):
+    """Get a function reading blocks of the picked channels from a Raw.
+
+    The function takes start and stop samples and returns the data of the
+    picked channels in volts. Preloaded data are only indexed; otherwise
+    the blocks are read from disk on demand.
+    """
+    picks = np.asarray(picks, dtype=int)
+    if not raw.preload:
+        return lambda start, stop: raw.get_data(picks=picks, start=start,
+                                                stop=stop)
+
+    if picks.size and np.array_equal(picks, np.arange(picks[0],
+                                                      picks[-1] + 1)):
+        # contiguous picks are views, not copies
+        picks = slice(picks[0], picks[-1] + 1)
+    return lambda start, stop: raw._data[picks, start:stop]
+
+
+def _peak(data):
+    """Get the maximum absolute value of each channel."""
+    if data.size == 0:
+        return np.zeros(data.shape[0])
+    return np.max(np.abs(data), axis=1)
+
+
+def _blockwise_peak(read_block, n_chan, n_times, block_size=None):
+    """Get the maximum absolute value of each channel, one block at a time."""
+    if block_size is None:
+        block_size = _block_samples(n_chan)
+    peak = np.zeros(n_chan)
+    for start, stop in _block_ranges(n_times, block_size):
+        np.maximum(peak, _peak(read_block(start, stop)), out=peak)
+    return peak
+
+
+def _write_bveeg_blocks(eeg_fname, read_block, n_chan, n_times,
+                        orientation, dtype, resolution, block_size=None,
+                        mode='wb', index=None, precision=None):
+    """Write BrainVision data file from blocks of data.
+
+    Reading, converting and writing the data are pipelined: while block n
+    is written to disk in a background thread, block n + 1 is scaled and
+    converted in the calling thread and block n + 2 is read (e.g. from a
+    non-preloaded Raw) in another background thread. NumPy and file I/O
+    release the GIL, so that the export is limited by the slowest stage
+    instead of the sum of all stages.
+
+    With mode='ab', multiplexed data are appended to an existing file.
+
+    If index is an instance of _BlockIndex, the channel statistics and block
+    hashes of the written data are added to it.
+
+    The blocks are scaled in the working precision, see _scale_data.
+    """
+    work_dtype = _working_dtype(precision)
+    if block_size is None:
+        block_size = _block_samples(n_chan)
+    blocks = _block_ranges(n_times, block_size)
+
+    with open(eeg_fname, mode) as fout, \
+            ThreadPoolExecutor(max_workers=1) as reader, \
+            ThreadPoolExecutor(max_workers=1) as writer:
+        if orientation == 'vectorized':
+            # the channels are written to their final positions block by
+            # block, so we reserve the space for the whole file
+            fout.truncate(n_chan * n_times * dtype.itemsize)
+
+        reads = deque(reader.submit(read_block, *b) for b in blocks[:2])
+        pending = None
+        for ii, (start, stop) in enumerate(blocks):
+            data = reads.popleft().result()
+            if ii + 2 < len(blocks):
+                reads.append(reader.submit(read_block, *blocks[ii + 2]))
+
+            # the multiplicative factor here is dependent on resolution
+            # for 0.1 µV, this works out to 1e7
+            data = _scale_data(data, dtype, resolution, work_dtype)
+            if index is not None:
+                index.add_stats(data)
+            if orientation == 'multiplexed':
+                # channel changes fast and channel is first axis -> F order
+                data = np.ascontiguousarray(data.T)
+            else:
+                # rows are written as is, e.g. from a transposed memmap
+                data = np.ascontiguousarray(data)
+
+            # double buffering: at most one block is waiting to be written
+            if pending is not None:
+                pending.result()
+            pending = writer.submit(_write_block, fout, data, start, n_times,
+                                    orientation, index)
+
+        if pending is not None:
+            pending.result()
+
+
+def _write_block(fout, data, start, n_times, orientation, index=None):
+    """Write a converted block of data to its place in the data file."""
+    if orientation == 'multiplexed':
+        # blocks are written in order, so the file position is correct
+        if index is not None:
+            index.add_block(fout.tell(), data)
+        fout.write(data)
     else:
-        errmsg = 'Cannot map data format {} to NumPy dtype'.format(format)
-        raise ValueError(errmsg)
+        # time changes fast and time is the last axis -> each row is
+        # written to its part of the channel, without transposing
+        for ii in range(data.shape[0]):
+            offset = (ii * n_times + start) * data.itemsize
+            if index is not None:
+                index.add_block(offset, data[ii])
+            fout.seek(offset)
+            fout.write(data[ii])
+
 
-    # ndarry.tofile uses column-major order
-    # the multiplicative factor here is dependent on resolution
-    # for 0.1 µV, this works out to 1e7
-    # multiplexed:
-    #    channel changes fast and channel is first axis -> C order
-    with open(eeg_fname, 'wb') as fout:
-        # skip the stim channel and scale
-        data = raw._data * 1e7
-        fout.write(data.astype(dtype=dtype).ravel(order='F').tobytes())
+class _BlockIndex(object):
+    """Block hashes and channel statistics of a data file being written."""
+
+    def __init__(self, n_chan):  # noqa: D107
+        self.blocks = []
+        self.min = np.full(n_chan, np.inf)
+        self.max = np.full(n_chan, -np.inf)
+        self.sum = np.zeros(n_chan)
+
+    def add_stats(self, data):
+        """Add a block of stored values, shape (n_channels, n_samples)."""
+        if data.shape[1]:
+            np.minimum(self.min, data.min(axis=1), out=self.min)
+            np.maximum(self.max, data.max(axis=1), out=self.max)
+            self.sum += data.sum(axis=1, dtype=np.float64)
+
+    def add_block(self, offset, data):
+        """Add the hash of a contiguous block written at offset."""
+        self.blocks.append((int(offset), data.nbytes,
+                            hashlib.sha256(data).hexdigest()))
+
+
+def _index_fname(vhdr_fname):
+    """Get the name of the integrity index for a header file."""
+    return vhdr_fname[:-4] + 'vidx'
+
+
+def _write_index_file(idx_fname, index, ch_names):
+    """Write the integrity index of a data file."""
+    blocks = sorted(index.blocks)
+    size = blocks[-1][0] + blocks[-1][1] if blocks else 0
+    content = dict(version=__version__,
+                   algorithm='sha256',
+                   size=size,
+                   blocks=blocks,
+                   channels=dict((ch, dict(min=float(lo), max=float(hi),
+                                           sum=float(total)))
+                                 for ch, lo, hi, total
+                                 in zip(ch_names, index.min, index.max,
+                                        index.sum)))
+    with open(idx_fname, 'w') as fout:
+        json.dump(content, fout, indent=1)
+
+
+BVIntegrity = namedtuple('BVIntegrity',
+                         ['valid', 'size_matches', 'n_checked', 'corrupt'])
+
+
+def verify_brainvision(vhdr_fname, n_blocks=None, random_state=None):
+    """Verify a BrainVision data file against its integrity index.
+
+    Parameters
+    ----------
+    vhdr_fname : str
+        Path to the EEG header file. The data file must have been written
+        with ``index=True``, see write_raw_brainvision.
+    n_blocks : int | None
+        The number of randomly chosen blocks to check. If None, all blocks
+        are checked.
+    random_state : None | int | instance of RandomState
+        Seed or random number generator for choosing the blocks.
+
+    Returns
+    -------
+    result : instance of ``collections.namedtuple`` called BVIntegrity
+        Named tuple with fields for whether the data file is valid, whether
+        its size matches the index, the number of blocks checked and the
+        (offset, length) in bytes of each corrupt block.
+
+    Notes
+    -----
+    Only the raw bytes of the checked blocks are read and hashed; the data
+    are never decoded. Checking a random sample of blocks is a fast test
+    for damage spread over a file, e.g. by a faulty transfer, while the
+    size check catches truncated files.
+    """
+    header = _read_vhdr_file(vhdr_fname)
+    with open(_index_fname(vhdr_fname)) as fin:
+        index = json.load(fin)
+    blocks = index['blocks']
+
+    if n_blocks is not None and n_blocks < len(blocks):
+        rng = random_state
+        if not isinstance(rng, np.random.RandomState):
+            rng = np.random.RandomState(rng)
+        picks = np.sort(rng.choice(len(blocks), n_blocks, replace=False))
+        blocks = [blocks[ii] for ii in picks]
+
+    size_matches = os.path.getsize(header['eeg_fname']) == index['size']
+    corrupt = []
+    with open(header['eeg_fname'], 'rb') as fin:
+        for offset, length, digest in blocks:
+            fin.seek(offset)
+            if hashlib.sha256(fin.read(length)).hexdigest() != digest:
+                corrupt.append((offset, length))
+
+    return BVIntegrity(size_matches and not corrupt, size_matches,
+                       len(blocks), corrupt)
+
+
+BVComparison = namedtuple('BVComparison',
+                          ['valid', 'ch_names', 'max_error', 'tolerance'])
+
+
+def compare_raw_brainvision(raw, vhdr_fname, start=0):
+    """Compare a written BrainVision data file to its source Raw.
+
+    Parameters
+    ----------
+    raw : instance of Raw
+        The raw data the file was written from.
+    vhdr_fname : str
+        Path to the EEG header file.
+    start : int
+        The sample of the data file corresponding to the first sample of
+        raw, e.g. for checking a segment added with append_raw_brainvision.
+
+    Returns
+    -------
+    result : instance of ``collections.namedtuple`` called BVComparison
+        Named tuple with fields for whether all channels are within
+        tolerance, the names of the exported channels and the maximum
+        absolute error and the tolerance of each channel in volts.
+
+    Notes
+    -----
+    The data file is memory-mapped and compared to raw one block at a
+    time, so that neither needs to fit into memory. The tolerance is half
+    the resolution of each channel for integer formats and the rounding
+    error of single precision at the channel's peak amplitude for
+    floating-point formats.
+
+    A ValueError is raised if the exported channels of raw do not match the
+    channels in the file or raw extends beyond the end of the file.
+    """
+    picks = _export_picks(raw)
+    ch_names = [raw.ch_names[p] for p in picks]
+    read_block = _raw_block_reader(raw, picks)
+
+    with BrainVisionData(vhdr_fname) as bv:
+        if ch_names != bv.ch_names:
+            raise ValueError('The channels of raw do not match the channels '
+                             'of {}.'.format(vhdr_fname))
+        if start + raw.n_times > bv.n_times:
+            raise ValueError('raw extends beyond the end of '
+                             '{}.'.format(vhdr_fname))
+
+        max_error = np.zeros(len(picks))
+        peak = np.zeros(len(picks))
+        for first, last in _block_ranges(raw.n_times,
+                                         _block_samples(len(picks))):
+            data = read_block(first, last)
+            error = _peak(bv[:, start + first:start + last] - data)
+            np.maximum(max_error, error, out=max_error)
+            np.maximum(peak, _peak(data), out=peak)
+
+        dtype = _format_dtype(bv.format)
+        if dtype.kind == 'f':
+            tolerance = peak * np.finfo(dtype).eps
+        else:
+            tolerance = bv.cals / 2
+        # allow for the rounding error of the scaling itself
+        tolerance = tolerance * (1 + 1e-6)
+
+    return BVComparison(bool(np.all(max_error <= tolerance)), ch_names,
+                        max_error, tolerance)
+
+
+# units as they appear in the vhdr files, scaled to volts
+_unit_scales = {
+    'v': 1.,
+    'mv': 1e-3,
+    'µv': 1e-6,  # micro sign
+    'μv': 1e-6,  # greek mu
+    'uv': 1e-6,
+    'nv': 1e-9,
+}
+
+
+def read_brainvision(vhdr_fname, mode='r'):
+    """Open BrainVision data for memory-mapped, random access reading.
+
+    Parameters
+    ----------
+    vhdr_fname : str
+        Path to the EEG header file.
+    mode : str
+        Mode to open the data file with, see ``numpy.memmap``. The default
+        is read-only access.
+
+    Returns
+    -------
+    bv : instance of BrainVisionData
+        Lazy accessor for the BrainVision data.
+
+    See Also
+    --------
+    BrainVisionData
+    """
+    return BrainVisionData(vhdr_fname, mode=mode)
+
+
+class BrainVisionData(object):
+    """Memory-mapped access to BrainVision data.
+
+    Parameters
+    ----------
+    vhdr_fname : str
+        Path to the EEG header file.
+    mode : str
+        Mode to open the data file with, see ``numpy.memmap``.
+
+    Attributes
+    ----------
+    ch_names : list of str
+        The channel names.
+    sfreq : float
+        The sampling frequency in Hz.
+    orientation : str
+        The data orientation, 'multiplexed' or 'vectorized'.
+    format : str
+        The data format, e.g. 'binary_float32'.
+    resolution : ndarray, shape (n_channels,)
+        The resolution of each channel in its unit (generally µV).
+    cals : ndarray, shape (n_channels,)
+        The factor for scaling the stored values of each channel to volts.
+    memmap : instance of numpy.memmap
+        The data file as stored on disk, with shape (n_times, n_channels)
+        for multiplexed data and (n_channels, n_times) for vectorized data.
+
+    Notes
+    -----
+    Indexing an instance with ``bv[picks, start:stop]`` returns the selected
+    channels and samples scaled to volts. Only the selected part of the data
+    file is read and converted; the rest of the file is never touched. The
+    unscaled values are available without any copy as :attr:`data`.
+    """
+
+    def __init__(self, vhdr_fname, mode='r'):  # noqa: D107
+        header = _read_vhdr_file(vhdr_fname)
+
+        self.vhdr_fname = vhdr_fname
+        self.eeg_fname = header['eeg_fname']
+        self.vmrk_fname = header['vmrk_fname']
+        self.ch_names = header['ch_names']
+        self.sfreq = header['sfreq']
+        self.orientation = header['orientation']
+        self.format = header['format']
+        self.resolution = header['resolution']
+        self.cals = header['cals']
+        self._markers = None
+        self._segments = None
+
+        n_chan = len(self.ch_names)
+        dtype = _format_dtype(self.format)
+        n_times = os.path.getsize(self.eeg_fname) // (dtype.itemsize * n_chan)
+
+        if self.orientation == 'multiplexed':
+            shape = (n_times, n_chan)
+        else:
+            shape = (n_chan, n_times)
+        self.memmap = np.memmap(self.eeg_fname, dtype=dtype, mode=mode,
+                                shape=shape)
+
+    def __repr__(self):
+        """Return a summary of the file."""
+        return '<BrainVisionData | {}, {} x {} ({}, {})>'.format(
+            os.path.basename(self.vhdr_fname), self.n_channels, self.n_times,
+            self.orientation, self.format)
+
+    def __len__(self):
+        """Return the number of channels."""
+        return self.n_channels
+
+    def __enter__(self):
+        """Enter context."""
+        return self
+
+    def __exit__(self, *args):
+        """Close the data file on exiting the context."""
+        self.close()
+
+    def close(self):
+        """Release the memory map of the data file.
+
+        The file is unmapped by NumPy once the last view of it (e.g. of
+        :attr:`data` or :attr:`segment_data`) is gone, so that views taken
+        before closing remain valid.
+        """
+        self.memmap = None
+
+    @property
+    def n_channels(self):
+        """The number of channels."""
+        return len(self.ch_names)
+
+    @property
+    def n_times(self):
+        """The number of samples."""
+        return self.data.shape[1]
+
+    @property
+    def data(self):
+        """The stored, unscaled values with shape (n_channels, n_times).
+
+        This is a view of the memory map, i.e. no data are read or copied
+        until the values are actually accessed.
+        """
+        if self.orientation == 'multiplexed':
+            return self.memmap.T
+        return self.memmap
+
+    @property
+    def markers(self):
+        """The markers from the marker file, see _read_vmrk_file."""
+        if self._markers is None:
+            self._markers = _read_vmrk_file(self.vmrk_fname)
+        return self._markers
+
+    @property
+    def segments(self):
+        """The segments from the marker file, see _extract_bv_segments."""
+        if self._segments is None:
+            self._segments = _extract_bv_segments(self.vmrk_fname)
+        return self._segments
+
+    @property
+    def segment_data(self):
+        """The stored, unscaled values of each segment.
+
+        If all segments have the same length, this is a view of the memory
+        map with shape (n_segments, n_channels, n_samples). Otherwise, it is
+        a list with a view of shape (n_channels, n_samples) for each segment.
+        In both cases, no data are read or copied until the values are
+        actually accessed.
+        """
+        bounds = np.append(self.segments.onsets, self.n_times)
+        lengths = np.diff(bounds)
+        if np.all(lengths == lengths[0]):
+            data = self.data[:, bounds[0]:]
+            # channels x (segments, samples) -> segments x channels x samples
+            return data.reshape(self.n_channels, len(lengths),
+                                lengths[0]).transpose(1, 0, 2)
+        return [self.data[:, start:stop]
+                for start, stop in zip(bounds[:-1], bounds[1:])]
+
+    def __getitem__(self, item):
+        """Return the selected data scaled to volts."""
+        if not isinstance(item, tuple):
+            item = (item,)
+        data = np.array(self.data[item], dtype=np.float64)
+        cals = self.cals[item[0]]
+        # align the calibration factors with the channel axis (if present)
+        cals = np.reshape(cals, np.shape(cals) +
+                          (1,) * (data.ndim - np.ndim(cals)))
+        data *= cals
+        return data
+
+    def get_data(self, picks=None, start=0, stop=None):
+        """Get data scaled to volts.
+
+        Parameters
+        ----------
+        picks : array-like of int | array-like of str | None
+            The channels to get, either by index or by name. If None, all
+            channels are returned.
+        start : int
+            The first sample to get.
+        stop : int | None
+            The sample after the last sample to get. If None, data until
+            the end of the file are returned.
+
+        Returns
+        -------
+        data : ndarray, shape (n_picks, n_samples)
+            The data in volts.
+        """
+        if picks is None:
+            picks = slice(None)
+        else:
+            picks = np.array([self.ch_names.index(p) if isinstance(p, str)
+                              else p for p in np.atleast_1d(picks)],
+                             dtype=int)
+        return self[picks, start:stop]
+
+
+def read_epochs_brainvision(vhdr_fname, event_id=None, tmin=None):
+    """Read segmented BrainVision data as epochs.
+
+    Parameters
+    ----------
+    vhdr_fname : str
+        Path to the EEG header file.
+    event_id : dict | None
+        Mapping of marker names, in the form "type/description" as used for
+        annotations by ``mne.io.read_raw_brainvision``, to event codes.
+        If None, stimulus and response markers are coded as in MNE, i.e.
+        "Stimulus/S  1" as 1 and "Response/R  1" as 1001.
+    tmin : float | None
+        Start time of the segments relative to their time-locking point in
+        seconds. If None, the time-locking point is taken from the
+        "Time 0" markers, if any, or else the start of the segments.
+
+    Returns
+    -------
+    epochs : instance of EpochsArray
+        The segments as epochs, all channels treated as EEG. The event of
+        each epoch is the first marker in event_id at its time-locking point.
+        Segments without such a marker are coded as "New Segment/" (99999).
+
+    Notes
+    -----
+    All segments must have the same length. The segments are scaled to
+    volts directly from the memory-mapped data file, without reading the
+    file as a whole first. To access the segments without any copy, use
+    :attr:`BrainVisionData.segment_data`.
+
+    See Also
+    --------
+    write_epochs_brainvision
+    """
+    with BrainVisionData(vhdr_fname) as bv:
+        data = bv.segment_data
+        if isinstance(data, list):
+            raise ValueError('Segments must all have the same length to be '
+                             'read as epochs.')
+        if tmin is None:
+            zero = _segment_zero(bv.segments)
+        else:
+            zero = int(np.round(-tmin * bv.sfreq))
+            if not 0 <= zero < data.shape[-1]:
+                raise ValueError('The time-locking point (time 0) must be '
+                                 'within the segments, got tmin='
+                                 '{}.'.format(tmin))
+        events, event_id = _segment_events(bv.segments, data.shape[-1], zero,
+                                           event_id)
+        data = np.multiply(data, bv.cals[:, np.newaxis], dtype=np.float64)
+        info = mne.create_info(bv.ch_names, bv.sfreq, 'eeg')
+
+    return mne.EpochsArray(data, info, events=events,
+                           tmin=-zero / info['sfreq'], event_id=event_id,
+                           verbose=False)
+
+
+def _segment_zero(segments):
+    """Get the sample of the time-locking point within the segments."""
+    positions = segments.markers['position']
+    time0 = positions[segments.markers['type'] == 'Time 0']
+    if time0.size == 0:
+        return 0
+    return int(time0[0] - segments.onsets[_find_segment(segments, time0[0])])
+
+
+_bv_event_code = re.compile(r'^(Stimulus|Response)/([SR])\s*(\d+)$')
+
+
+def _segment_events(segments, n_samples, zero, event_id=None):
+    """Get the events and event_id for equal-length segments."""
+    markers = segments.markers
+    names = np.char.add(np.char.add(markers['type'], '/'),
+                        markers['description'])
+    if event_id is None:
+        event_id = dict()
+        for name in np.unique(names):
+            match = _bv_event_code.match(name)
+            if match:
+                offset = 1000 if match.group(2) == 'R' else 0
+                # plain str keys, as in the event_id of MNE's epochs
+                event_id[str(name)] = int(match.group(3)) + offset
+
+    # markers with an event code at the time-locking point of a segment
+    seg = _find_segment(segments, markers['position'])
+    keep = (np.isin(names, list(event_id)) &
+            (markers['position'] == segments.onsets[seg] + zero))
+    # the first such marker per segment
+    seg, first = np.unique(seg[keep], return_index=True)
+
+    events = np.zeros((len(segments.onsets), 3), dtype=int)
+    events[:, 0] = np.arange(len(segments.onsets)) * n_samples + zero
+    events[:, 2] = 99999
+    events[seg, 2] = [event_id[name] for name in names[keep][first]]
+
+    used = set(events[:, 2])
+    event_id = dict((name, code) for name, code in event_id.items()
+                    if code in used)
+    if len(seg) < len(segments.onsets):
+        event_id['New Segment/'] = 99999
+
+    return events, event_id
+
+
+def _read_text(fname, return_encoding=False):
+    """Read a BrainVision text file, guessing the codepage."""
+    with open(fname, 'rb') as fin:
+        text = fin.read()
+    try:
+        text, encoding = text.decode('utf-8'), 'utf-8'
+    except UnicodeDecodeError:
+        # older files are generally in the Windows ANSI codepage
+        text, encoding = text.decode('latin-1'), 'latin-1'
+
+    if return_encoding:
+        return text, encoding
+    return text
+
+
+def _patch_text(fname, out_fname, substitutions):
+    """Apply regex substitutions to a BrainVision text file.
+
+    The codepage and line endings of the file are preserved. If out_fname
+    is the same as fname, the file is replaced atomically.
+    """
+    text, encoding = _read_text(fname, return_encoding=True)
+    for pattern, repl in substitutions:
+        text = pattern.sub(repl, text)
+
+    tmp_fname = out_fname + '.tmp'
+    with open(tmp_fname, 'wb') as fout:
+        fout.write(text.encode(encoding))
+    os.replace(tmp_fname, out_fname)
+
+
+def _parse_bv_ini(text):
+    """Parse the INI-like sections of a BrainVision text file.
+
+    The identification line and comments are skipped. Returns a dictionary
+    mapping section names to lists of (key, value) pairs in file order.
+    """
+    sections = dict()
+    section = sections.setdefault('', [])
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith(';'):
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            section = sections.setdefault(line[1:-1], [])
+        elif '=' in line:
+            key, value = line.split('=', 1)
+            section.append((key.strip(), value))
+    return sections
+
+
+def _read_vhdr_file(vhdr_fname):
+    """Read the relevant information from a BrainVision header file."""
+    sections = _parse_bv_ini(_read_text(vhdr_fname))
+    common = dict(sections.get('Common Infos', []))
+    binary = dict(sections.get('Binary Infos', []))
+    path = os.path.dirname(vhdr_fname)
+
+    if common.get('DataFormat', 'BINARY').upper() != 'BINARY':
+        raise ValueError('Only binary BrainVision files are supported.')
+
+    bin_formats = invert_dict(supported_formats)
+    bin_format = binary.get('BinaryFormat', '').upper()
+    if bin_format not in bin_formats:
+        raise ValueError('Binary format {} not supported.'.format(bin_format))
+
+    ch_names, resolution, cals = [], [], []
+    for key, value in sections.get('Channel Infos', []):
+        fields = value.split(',')
+        fields += [''] * (4 - len(fields))
+        name, _, res, unit = fields[:4]
+        res = float(res) if res.strip() else 1.
+        unit = unit.strip().lower() or 'µv'
+        if unit not in _unit_scales:
+            raise ValueError('Unit {} of channel {} not '
+                             'supported.'.format(unit, name))
+        ch_names.append(name.replace(r'\1', ','))
+        resolution.append(res)
+        cals.append(res * _unit_scales[unit])
+
+    n_chan = int(common['NumberOfChannels'])
+    if n_chan != len(ch_names):
+        raise ValueError('NumberOfChannels does not match the number of '
+                         'channels in [Channel Infos].')
+
+    return dict(eeg_fname=os.path.join(path, common['DataFile']),
+                vmrk_fname=os.path.join(path, common['MarkerFile']),
+                orientation=_check_orientation(
+                    common.get('DataOrientation', 'MULTIPLEXED')),
+                format=bin_formats[bin_format],
+                sfreq=1e6 / float(common['SamplingInterval']),
+                ch_names=ch_names,
+                resolution=np.array(resolution),
+                cals=np.array(cals))
+
+
+def _read_vmrk_file(vmrk_fname):
+    """Read the markers from a BrainVision marker file.
+
+    Returns
+    -------
+    markers : ndarray
+        Structured array with fields 'type', 'description', 'position',
+        'size' and 'channel'. In line with MNE, positions are 0-based sample
+        indices, while the file stores 1-based positions.
+
+    Notes
+    -----
+    The marker entries are parsed in bulk with pandas' C parser instead of
+    line by line, which matters for files with hundreds of thousands of
+    markers.
+    """
+    import pandas as pd
+
+    text = _read_text(vmrk_fname)
+    start = text.find('[Marker Infos]')
+    if start < 0:
+        return np.array([], dtype=_marker_dtype(1, 1))
+    stop = text.find('\n[', start + 1)
+    # skip the comments at the start of the section
+    start = text.find('\nMk', start, stop if stop >= 0 else len(text))
+    if start < 0:
+        return np.array([], dtype=_marker_dtype(1, 1))
+    block = text[start + 1:stop if stop >= 0 else len(text)].rstrip()
+
+    cols = ['type', 'description', 'position', 'size', 'channel', 'date']
+    n_lines = block.count('\n') + 1
+    if block.count('=') == n_lines == block.count('\nMk') + 1:
+        # one marker per line and no '=' in the descriptions, so we can
+        # split off the marker name like any other field
+        block = block.replace('=', ',')
+        names = ['name'] + cols
+    else:
+        block = '\n'.join(_mk_line.findall(block))
+        names = cols
+        n_lines = block.count('\n') + 1
+    # pandas' column selection only works if the date field is present for at
+    # least some markers, so we drop it if it is absent (e.g. anonymized)
+    if block.count(',') == (len(names) - 2) * n_lines:
+        names = names[:-1]
+
+    df = pd.read_csv(StringIO(block), sep=',', header=None,
+                     names=names, usecols=cols[:5], quoting=csv.QUOTE_NONE,
+                     dtype=dict(type='category', description='category'),
+                     keep_default_na=False,
+                     na_values=dict(size=[''], channel=['']),
+                     engine='c', low_memory=False)
+
+    mtype = _decode_categorical(df['type'])
+    desc = _decode_categorical(df['description'])
+
+    markers = np.empty(len(df), dtype=_marker_dtype(mtype.itemsize // 4,
+                                                    desc.itemsize // 4))
+    markers['type'] = mtype
+    markers['description'] = desc
+    markers['position'] = df['position'].to_numpy() - 1
+    markers['size'] = df['size'].fillna(1).to_numpy()
+    markers['channel'] = df['channel'].fillna(0).to_numpy()
+
+    return markers
+
+
+def _decode_categorical(col):
+    """Expand a categorical column of marker text to a string array."""
+    levels = col.cat.categories.to_numpy(dtype=str)
+    levels = np.char.replace(levels, r'\1', ',')
+    return levels[col.cat.codes.to_numpy()]
+
+
+# the part after the marker name, without line endings
+_mk_line = re.compile(r'^Mk\d+=([^\r\n]*)', re.MULTILINE)
+
+
+def _concatenate_markers(markers):
+    """Concatenate structured arrays of markers with any string widths."""
+    twidth = max(m.dtype['type'].itemsize // 4 for m in markers)
+    dwidth = max(m.dtype['description'].itemsize // 4 for m in markers)
+    dtype = _marker_dtype(twidth, dwidth)
+    return np.concatenate([m.astype(dtype) for m in markers])
+
+
+def _marker_dtype(twidth, dwidth):
+    """Get the structured dtype for markers with the given string widths."""
+    return np.dtype([('type', 'U{}'.format(max(twidth, 1))),
+                     ('description', 'U{}'.format(max(dwidth, 1))),
+                     ('position', np.int64),
+                     ('size', np.int64),
+                     ('channel', np.int64)])
+
+
+def anonymize_brainvision(path, n_jobs=1):
+    """Anonymize BrainVision files by stripping time stamps from the markers.
+
+    Parameters
+    ----------
+    path : str
+        Path to a marker file or to a directory, which is searched
+        recursively for marker files.
+    n_jobs : int
+        The number of files to process in parallel.
+
+    Returns
+    -------
+    vmrk_fnames : list of str
+        The anonymized marker files.
+
+    Notes
+    -----
+    Only the marker files are modified, in place. The data files are never
+    read or written, so that anonymizing a full dataset only takes as long
+    as rewriting its (small) marker files.
+    """
+    if os.path.isdir(path):
+        vmrk_fnames = sorted(os.path.join(root, f)
+                             for root, _, files in os.walk(path)
+                             for f in files if f.lower().endswith('.vmrk'))
+    else:
+        vmrk_fnames = [path]
+
+    if n_jobs == 1:
+        for vmrk_fname in vmrk_fnames:
+            _anonymize_bv(vmrk_fname)
+    else:
+        # the work is I/O bound, so threads are sufficient
+        with ThreadPoolExecutor(max_workers=n_jobs) as pool:
+            list(pool.map(_anonymize_bv, vmrk_fnames))
+
+    return vmrk_fnames
+
+
+# the optional date field of a marker, i.e. everything after the channel
+_mk_date = re.compile(r'^(Mk\d+=(?:[^,\r\n]*,){4}[^,\r\n]*),[^\r\n]*',
+                      re.MULTILINE)
 
 
 def _anonymize_bv(vmrk_fname):
     """Anonymize BrainVision marker files by stripping out time stamps."""
-    pass
+    _patch_text(vmrk_fname, vmrk_fname, [(_mk_date, r'\1')])
 
 
-def _rename_bv(vhdr_fname):
-    """Rename a BrainVision file, including updating internal links."""
-    pass
+def _common_info(key):
+    """Get a pattern matching a [Common Infos] entry."""
+    return re.compile(r'^{}=[^\r\n]*'.format(key), re.MULTILINE)
+
+
+def _rename_bv(vhdr_fname, new_vhdr_fname, link=False):
+    """Rename a BrainVision file, including updating internal links.
+
+    Parameters
+    ----------
+    vhdr_fname : str
+        Path to the EEG header file.
+    new_vhdr_fname : str
+        New path of the EEG header file. The data and marker files are
+        renamed to match.
+    link : bool
+        If True, the data file is hard linked instead of renamed and the
+        original files are kept.
+
+    Notes
+    -----
+    Only the header and marker files are rewritten; the data file is renamed
+    or linked, but never read or written.
+    """
+    header = _read_vhdr_file(vhdr_fname)
+    base = os.path.splitext(new_vhdr_fname)[0]
+    new_eeg_fname = base + '.eeg'
+    new_vmrk_fname = base + '.vmrk'
+
+    for fname in (new_vhdr_fname, new_vmrk_fname, new_eeg_fname):
+        if os.path.exists(fname):
+            raise FileExistsError('{} already exists.'.format(fname))
+
+    data_file = r'DataFile={}'.format(os.path.basename(new_eeg_fname))
+    marker_file = r'MarkerFile={}'.format(os.path.basename(new_vmrk_fname))
+    # the new names are inserted literally, not as regex templates
+    _patch_text(header['vmrk_fname'], new_vmrk_fname,
+                [(_common_info('DataFile'), lambda m: data_file)])
+    _patch_text(vhdr_fname, new_vhdr_fname,
+                [(_common_info('DataFile'), lambda m: data_file),
+                 (_common_info('MarkerFile'), lambda m: marker_file)])
+
+    # the integrity index refers to the data file by the header's name
+    idx_fname = _index_fname(vhdr_fname)
+    has_index = os.path.exists(idx_fname)
+
+    if link:
+        os.link(header['eeg_fname'], new_eeg_fname)
+        if has_index:
+            os.link(idx_fname, _index_fname(new_vhdr_fname))
+    else:
+        os.rename(header['eeg_fname'], new_eeg_fname)
+        if has_index:
+            os.rename(idx_fname, _index_fname(new_vhdr_fname))
+        os.remove(header['vmrk_fname'])
+        os.remove(vhdr_fname)
+
+
+BVSegments = namedtuple('BVSegments',
+                        ['markers', 'onsets', 'descriptions'])
 
 
 def _extract_bv_segments(vmrk_fname):
-    """Extract segments from BrainVision VMRK file."""
-    pass
+    """Extract segments from BrainVision VMRK file.
+
+    Parameters
+    ----------
+    vmrk_fname : str
+        Path to the marker file.
+
+    Returns
+    -------
+    segments : instance of ``collections.namedtuple`` called BVSegments
+        Named tuple with fields for all markers (as a structured array
+        sorted by position, see _read_vmrk_file), the onsets of the segments
+        (i.e. the positions of the "New Segment" markers) and a dictionary
+        mapping each description to the indices of its markers.
+
+    Notes
+    -----
+    As both the markers and the segment onsets are sorted by position,
+    finding the segment containing a given position and the markers within a
+    given segment are binary searches, see _find_segment and
+    _segment_markers.
+    """
+    markers = _read_vmrk_file(vmrk_fname)
+    # marker files are usually, but not necessarily, sorted already
+    if np.any(np.diff(markers['position']) < 0):
+        order = np.argsort(markers['position'], kind='stable')
+        markers = markers[order]
+
+    onsets = markers['position'][markers['type'] == 'New Segment']
+    # files without explicit segments consist of a single segment
+    if onsets.size == 0 or onsets[0] > 0:
+        onsets = np.concatenate([[0], onsets])
+
+    uniq, inverse = np.unique(markers['description'], return_inverse=True)
+    inverse = inverse.ravel()
+    by_desc = np.argsort(inverse, kind='stable')
+    bounds = np.cumsum(np.bincount(inverse, minlength=len(uniq)))[:-1]
+    descriptions = dict(zip(uniq, np.split(by_desc, bounds)))
+
+    return BVSegments(markers, onsets, descriptions)
+
+
+def _find_segment(segments, position):
+    """Find the index of the segment(s) containing the given position(s)."""
+    return np.searchsorted(segments.onsets, position, side='right') - 1
+
+
+def _segment_markers(segments, index):
+    """Get the markers within the given segment."""
+    positions = segments.markers['position']
+    start = segments.onsets[index]
+    lo = np.searchsorted(positions, start, side='left')
+    if index + 1 < len(segments.onsets):
+        hi = np.searchsorted(positions, segments.onsets[index + 1],
+                             side='left')
+    else:
+        hi = len(positions)
+    return segments.markers[lo:hi]
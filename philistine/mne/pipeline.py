@@ -0,0 +1,401 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Resumable per-subject pipelines driven by a configuration file."""
+
+from __future__ import division, print_function
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from .convert import _find_files, _stamp
+
+PipelineReport = namedtuple('PipelineReport',
+                            ['completed', 'skipped', 'failed',
+                             'stage_times', 'elapsed'])
+
+# the stages in the order they are run and the stage each depends on
+# (None for the raw data), see _runners for their implementation
+_stages = [
+    ('savgol_iaf', None),
+    ('write_raw_brainvision', None),
+    ('epochs', None),
+    ('abs_threshold', 'epochs'),
+    ('retrieve', 'abs_threshold'),
+]
+
+# name of the file in each subject's output directory recording the
+# completed stages
+_state_fname = '.philistine_pipeline.json'
+
+
+def run_pipeline(config, n_jobs=None, force=False, verbose=True):
+    """Run the stages of a pipeline for each subject of a study.
+
+    Parameters
+    ----------
+    config : str | dict
+        The path to a JSON configuration file or the configuration itself,
+        see Notes.
+    n_jobs : int | None
+        The number of subjects to process in parallel, each in its own
+        process. If None, the value of 'n_jobs' in the configuration is used
+        (default 1).
+    force : bool
+        Whether to run all stages again, even if their results are up to
+        date.
+    verbose : bool
+        Whether to print progress, failures and throughput statistics.
+
+    Returns
+    -------
+    report : instance of ``collections.namedtuple`` called PipelineReport
+        Named tuple with fields for the subjects for which stages were run,
+        the subjects that were up to date, the failed (subject, stage, error)
+        triples, the total time spent in each stage and the elapsed time in
+        seconds.
+
+    Notes
+    -----
+    The configuration is a dictionary with the following entries:
+
+    subjects : dict
+        The path of the raw data file of each subject, by subject. Any file
+        that ``mne.io.read_raw`` supports can be used.
+    in_dir, pattern : str
+        Alternatively to subjects, a directory to search recursively for raw
+        data files and a shell-style pattern (default '*.fif') for their
+        names. The subjects are named after the files, without extension.
+    out_dir : str
+        The directory to write the results to, in one directory per subject.
+    n_jobs : int
+        The number of subjects to process in parallel.
+    stages : dict
+        The stages to run and their parameters, see below. Stages which are
+        not listed are not run.
+
+    Relative paths are relative to the directory of the configuration file.
+    The stages and their results are:
+
+    savgol_iaf
+        Keyword arguments to savgol_iaf. Writes the estimate to 'iaf.json'.
+    write_raw_brainvision
+        Keyword arguments to write_raw_brainvision. Writes the BrainVision
+        files named after the subject.
+    epochs
+        Keyword arguments to ``mne.Epochs``, e.g. tmin, tmax, event_id and
+        baseline. The events are found in the stim channels or, if there
+        are none, in the annotations. Writes 'epochs-epo.fif'.
+    abs_threshold
+        Keyword arguments to abs_threshold, at least threshold. Writes the
+        epochs below the threshold to 'clean-epo.fif' and the indices of the
+        rejected epochs to 'rejected.json'.
+    retrieve
+        Keyword arguments to retrieve, at least windows. Uses the clean
+        epochs if abs_threshold is run and all epochs otherwise. Writes the
+        data frame to 'retrieve.csv'.
+
+    Each stage is checkpointed when it finishes. A stage is skipped if it
+    has been completed with the same parameters and the same input, i.e.
+    the raw data file (compared by size and modification time) or the
+    result of the stage it depends on, and its output files still exist,
+    so that an interrupted or partially failed run resumes where it stopped
+    and changed parameters only rerun the stages that depend on them.
+    """
+    start = time.time()
+    config = _read_config(config)
+    if n_jobs is None:
+        n_jobs = config.get('n_jobs', 1)
+    stages = config.get('stages', dict())
+    _check_stages(stages)
+
+    completed = []
+    skipped = []
+    failed = []
+    stage_times = dict()
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        futures = dict((pool.submit(_run_subject, subject, in_fname,
+                                    os.path.join(config['out_dir'], subject),
+                                    stages, force), subject)
+                       for subject, in_fname in config['subjects'].items())
+        for future in as_completed(futures):
+            subject = futures[future]
+            times, failure = future.result()
+            for name, elapsed in times.items():
+                stage_times[name] = stage_times.get(name, 0.) + elapsed
+            if failure is not None:
+                failed.append((subject,) + failure)
+                if verbose:
+                    print('Failed: {} in {} ({})'.format(subject, *failure))
+            elif times:
+                completed.append(subject)
+                if verbose:
+                    print('Completed: {}'.format(subject))
+            else:
+                skipped.append(subject)
+
+    report = PipelineReport(sorted(completed), sorted(skipped),
+                            sorted(failed), stage_times, time.time() - start)
+    if verbose:
+        _print_report(report)
+    return report
+
+
+def _check_stages(stages):
+    """Check that the stages are known and their dependencies are run."""
+    unknown = set(stages) - set(_runners)
+    if unknown:
+        raise ValueError('Unknown stages: '
+                         '{}.'.format(', '.join(sorted(unknown))))
+    if 'epochs' not in stages and ('abs_threshold' in stages or
+                                   'retrieve' in stages):
+        raise ValueError('abs_threshold and retrieve need the epochs stage.')
+
+
+def _read_config(config):
+    """Read the configuration and resolve paths and subjects."""
+    base_dir = ''
+    if not isinstance(config, dict):
+        base_dir = os.path.dirname(os.path.abspath(config))
+        with open(config) as fin:
+            config = json.load(fin)
+    config = dict(config)
+
+    if 'out_dir' not in config:
+        raise ValueError('The configuration must specify out_dir.')
+    config['out_dir'] = os.path.join(base_dir, config['out_dir'])
+
+    if 'subjects' in config:
+        subjects = dict((subject, os.path.join(base_dir, fname))
+                        for subject, fname in config['subjects'].items())
+    elif 'in_dir' in config:
+        in_dir = os.path.join(base_dir, config['in_dir'])
+        fnames = _find_files(in_dir, config.get('pattern', '*.fif'))
+        subjects = dict((os.path.splitext(os.path.basename(f))[0], f)
+                        for f in fnames)
+        if len(subjects) != len(fnames):
+            raise ValueError('The names of the input files are not unique.')
+    else:
+        raise ValueError('The configuration must specify subjects or in_dir.')
+    config['subjects'] = subjects
+    return config
+
+
+def _run_subject(subject, in_fname, out_dir, stages, force):
+    """Run the stages for a subject, returning the times and any failure."""
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    state = dict() if force else _read_state(out_dir)
+    stamp = _stamp(in_fname, check=False)
+    keys = dict()
+    times = dict()
+    data = dict()
+    for name, dependency in _stages:
+        if name not in stages:
+            # stages depending on a stage that is not run use its input
+            keys[name] = keys.get(dependency, None)
+            continue
+        keys[name] = _stage_key(stages[name], keys.get(dependency) or stamp)
+        if (state.get(name) == keys[name] and
+                _has_outputs(name, subject, out_dir)):
+            continue
+
+        t0 = time.time()
+        try:
+            _runners[name](subject, in_fname, out_dir, stages, data)
+        except Exception as err:
+            return times, (name, '{}: {}'.format(type(err).__name__, err))
+        times[name] = time.time() - t0
+        state[name] = keys[name]
+        # checkpoint, so that an interrupted run resumes after this stage
+        _write_state(out_dir, state)
+
+    return times, None
+
+
+def _has_outputs(name, subject, out_dir):
+    """Check whether the output files of a stage exist."""
+    return all(os.path.exists(os.path.join(out_dir, f.format(subject=subject)))
+               for f in _outputs[name])
+
+
+def _stage_key(params, dependency):
+    """Hash the parameters and the input of a stage."""
+    key = json.dumps([params, dependency], sort_keys=True)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def _run_iaf(subject, in_fname, out_dir, stages, data):
+    """Estimate the IAF and write it to iaf.json."""
+    from ._base import savgol_iaf
+
+    iaf = savgol_iaf(_get_raw(in_fname, data), ax=False,
+                     **stages['savgol_iaf'])
+    _write_json(os.path.join(out_dir, 'iaf.json'),
+                dict((k, _jsonable(v)) for k, v in iaf._asdict().items()))
+
+
+def _run_write(subject, in_fname, out_dir, stages, data):
+    """Write the raw data to BrainVision files named after the subject."""
+    from .io import write_raw_brainvision
+
+    write_raw_brainvision(_get_raw(in_fname, data),
+                          os.path.join(out_dir, subject + '.vhdr'),
+                          **stages['write_raw_brainvision'])
+
+
+def _run_epochs(subject, in_fname, out_dir, stages, data):
+    """Epoch the raw data at the events in its stim channels or annotations."""
+    import mne
+
+    raw = _get_raw(in_fname, data)
+    params = dict(stages['epochs'])
+    if params.get('baseline') is not None:
+        params['baseline'] = tuple(params['baseline'])
+    if len(mne.pick_types(raw.info, meg=False, stim=True)):
+        events = mne.find_events(raw, verbose=False)
+    else:
+        events, _ = mne.events_from_annotations(raw, verbose=False)
+    data['epochs'] = mne.Epochs(raw, events, preload=True, verbose=False,
+                                **params)
+    _save_epochs(data['epochs'], os.path.join(out_dir, 'epochs-epo.fif'))
+
+
+def _run_threshold(subject, in_fname, out_dir, stages, data):
+    """Drop the epochs exceeding the threshold and write the others."""
+    from ._base import abs_threshold
+
+    epochs = _get_epochs(out_dir, 'epochs', data)
+    # abs_threshold picks channels in place
+    rej = abs_threshold(epochs.copy(), **stages['abs_threshold'])
+    data['abs_threshold'] = epochs.copy().drop(rej, reason='ABS_THRESHOLD',
+                                               verbose=False)
+    _save_epochs(data['abs_threshold'], os.path.join(out_dir,
+                                                     'clean-epo.fif'))
+    _write_json(os.path.join(out_dir, 'rejected.json'),
+                [int(ii) for ii in rej.nonzero()[0]])
+
+
+def _run_retrieve(subject, in_fname, out_dir, stages, data):
+    """Summarize the (clean) epochs and write the data frame to CSV."""
+    from ._base import retrieve
+
+    source = 'abs_threshold' if 'abs_threshold' in stages else 'epochs'
+    params = dict(stages['retrieve'])
+    # JSON has no tuples
+    params['windows'] = dict((w, tuple(bounds))
+                             for w, bounds in params['windows'].items())
+    dat = retrieve(_get_epochs(out_dir, source, data), **params)
+    fname = os.path.join(out_dir, 'retrieve.csv')
+    dat.to_csv(fname + '.tmp', index=False)
+    os.replace(fname + '.tmp', fname)
+
+
+_runners = {
+    'savgol_iaf': _run_iaf,
+    'write_raw_brainvision': _run_write,
+    'epochs': _run_epochs,
+    'abs_threshold': _run_threshold,
+    'retrieve': _run_retrieve,
+}
+
+# the files each stage writes to the subject's output directory
+_outputs = {
+    'savgol_iaf': ['iaf.json'],
+    'write_raw_brainvision': ['{subject}.vhdr', '{subject}.vmrk',
+                              '{subject}.eeg'],
+    'epochs': ['epochs-epo.fif'],
+    'abs_threshold': ['clean-epo.fif', 'rejected.json'],
+    'retrieve': ['retrieve.csv'],
+}
+
+
+def _get_raw(in_fname, data):
+    """Get the raw data of a subject, reading it on first use."""
+    if 'raw' not in data:
+        import mne
+        data['raw'] = mne.io.read_raw(in_fname, preload=True, verbose=False)
+    return data['raw']
+
+
+def _get_epochs(out_dir, name, data):
+    """Get the epochs of a stage, reading its checkpoint if necessary."""
+    if name not in data:
+        import mne
+        fname = 'epochs-epo.fif' if name == 'epochs' else 'clean-epo.fif'
+        data[name] = mne.read_epochs(os.path.join(out_dir, fname),
+                                     verbose=False)
+    return data[name]
+
+
+def _save_epochs(epochs, fname):
+    """Save epochs, replacing an earlier checkpoint only when complete."""
+    tmp_fname = fname[:-len('-epo.fif')] + '.tmp-epo.fif'
+    epochs.save(tmp_fname, overwrite=True, verbose=False)
+    os.replace(tmp_fname, fname)
+
+
+def _jsonable(value):
+    """Convert numpy scalars (in nested tuples) for JSON."""
+    if isinstance(value, tuple):
+        return [_jsonable(v) for v in value]
+    return None if value is None else float(value)
+
+
+def _write_json(fname, obj):
+    """Write an object to a JSON file atomically."""
+    with open(fname + '.tmp', 'w') as fout:
+        json.dump(obj, fout, indent=1, sort_keys=True)
+    os.replace(fname + '.tmp', fname)
+
+
+def _read_state(out_dir):
+    """Read the record of completed stages."""
+    try:
+        with open(os.path.join(out_dir, _state_fname)) as fin:
+            return json.load(fin)
+    except (IOError, ValueError):
+        return dict()
+
+
+def _write_state(out_dir, state):
+    """Write the record of completed stages."""
+    _write_json(os.path.join(out_dir, _state_fname), state)
+
+
+def _print_report(report):
+    """Print throughput statistics for a pipeline run."""
+    print('{} completed, {} up to date, {} failed'.format(
+        len(report.completed), len(report.skipped), len(report.failed)))
+    print('{:.1f} s elapsed ({:.2f} subjects/s)'.format(
+        report.elapsed,
+        len(report.completed) / max(report.elapsed, 1e-9)))
+    for name, _ in _stages:
+        if name in report.stage_times:
+            print('  {:<24} {:>8.1f} s'.format(name,
+                                               report.stage_times[name]))
+
+
+def main(argv=None):
+    """Run a study pipeline described by a JSON configuration file."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('config', help='the JSON configuration file')
+    parser.add_argument('-j', '--n-jobs', type=int, default=None,
+                        help='number of subjects to process in parallel')
+    parser.add_argument('--force', action='store_true',
+                        help='run all stages, even if up to date')
+    args = parser.parse_args(argv)
+
+    report = run_pipeline(args.config, n_jobs=args.n_jobs, force=args.force)
+
+    return 1 if report.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Raw and Epochs data in shared memory for parallel workers."""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import mne
+
+import numpy as np
+
+# the shared memory blocks attached in this process, by name -- they stay
+# attached for the lifetime of the process, so that views created from them
+# remain valid
+_attached = dict()
+
+
+class SharedData(object):
+    """The data of a Raw or Epochs in shared memory.
+
+    Parameters
+    ----------
+    inst : instance of Raw | Epochs
+        The data to share. Data which are not preloaded are read into
+        shared memory directly, without an intermediate copy for Raw.
+
+    Notes
+    -----
+    Instances can be passed to other processes, e.g. as arguments of tasks
+    of a process pool. Only the name of the shared memory block and the
+    (small) measurement info and events are pickled, so that N workers use
+    one copy of the data instead of N.
+
+    In each process, get returns a Raw or Epochs whose data are a read-only
+    view of the shared memory; operations that modify the data in place
+    raise an error, operations that copy the data (e.g. picking channels)
+    work as usual. Epochs are rebuilt with their events, event IDs, tmin
+    and metadata, but without baseline and projection settings, which have
+    already been applied to their data.
+
+    The process that created the instance owns the shared memory and frees
+    it with unlink or when used as a context manager. Requires Python 3.8
+    or newer.
+    """
+
+    def __init__(self, inst):  # noqa: D107
+        from multiprocessing.shared_memory import SharedMemory
+
+        if isinstance(inst, mne.BaseEpochs):
+            self._kind = 'epochs'
+            inst.drop_bad(verbose=False)
+            shape = (len(inst), len(inst.ch_names), len(inst.times))
+            self._meta = dict(events=inst.events, tmin=inst.tmin,
+                              event_id=inst.event_id,
+                              metadata=inst.metadata)
+        elif isinstance(inst, mne.io.BaseRaw):
+            self._kind = 'raw'
+            shape = (len(inst.ch_names), inst.n_times)
+            self._meta = dict(first_samp=inst.first_samp,
+                              annotations=inst.annotations)
+        else:
+            raise ValueError('inst must be an instance of Raw or Epochs, '
+                             'got {}.'.format(type(inst).__name__))
+
+        self._info = inst.info
+        self._shape = shape
+        self._shm = SharedMemory(create=True,
+                                 size=max(1, int(np.prod(shape)) * 8))
+        self.name = self._shm.name
+        self._owner = True
+        _attached[self.name] = self._shm
+        _fill(np.ndarray(shape, dtype=np.float64, buffer=self._shm.buf),
+              inst, self._kind)
+
+    def __getstate__(self):  # noqa: D105
+        state = self.__dict__.copy()
+        del state['_shm']
+        state['_owner'] = False
+        return state
+
+    def __setstate__(self, state):  # noqa: D105
+        self.__dict__.update(state)
+        self._shm = _attach(self.name)
+
+    def __enter__(self):  # noqa: D105
+        return self
+
+    def __exit__(self, *args):  # noqa: D105
+        self.unlink()
+
+    def _array(self):
+        """Get a read-only view of the shared data."""
+        data = np.ndarray(self._shape, dtype=np.float64,
+                          buffer=self._shm.buf)
+        data.flags.writeable = False
+        return data
+
+    def get(self):
+        """Get a Raw or Epochs with a view of the shared data.
+
+        Returns
+        -------
+        inst : instance of RawArray | EpochsArray
+            The data, sharing memory with all other views.
+        """
+        if self._kind == 'raw':
+            raw = mne.io.RawArray(self._array(), self._info,
+                                  first_samp=self._meta['first_samp'],
+                                  copy='info', verbose=False)
+            raw.set_annotations(self._meta['annotations'])
+            return raw
+        return mne.EpochsArray(self._array(), self._info,
+                               events=self._meta['events'],
+                               tmin=self._meta['tmin'],
+                               event_id=self._meta['event_id'],
+                               metadata=self._meta['metadata'],
+                               baseline=None, proj=False, verbose=False)
+
+    def unlink(self):
+        """Free the shared memory.
+
+        Only the process that created the shared data frees the memory, once
+        all views are gone; in other processes, this does nothing.
+        """
+        if self._owner and self.name in _attached:
+            del _attached[self.name]
+            self._shm.unlink()
+            try:
+                self._shm.close()
+            except BufferError:
+                # views are still in use, the mapping is released with them
+                pass
+
+
+def _fill(data, inst, kind):
+    """Copy the data of inst into the shared array."""
+    if kind == 'epochs':
+        data[:] = inst._data if inst.preload else inst.get_data()
+    elif inst.preload:
+        data[:] = inst._data
+    else:
+        from .io import _block_ranges, _block_samples
+
+        for start, stop in _block_ranges(inst.n_times,
+                                         _block_samples(data.shape[0])):
+            data[:, start:stop] = inst.get_data(start=start, stop=stop)
+
+
+def _attach(name):
+    """Attach to a shared memory block, once per process."""
+    from multiprocessing.shared_memory import SharedMemory
+
+    if name not in _attached:
+        try:
+            # the creating process is responsible for the cleanup
+            _attached[name] = SharedMemory(name=name, track=False)
+        except TypeError:  # Python < 3.13
+            _attached[name] = SharedMemory(name=name)
+    return _attached[name]
+
+
+def _call(func, shared, kwargs):
+    """Call func with a view of the shared data."""
+    return func(shared.get(), **kwargs)
+
+
+def parallel_sweep(func, inst, params, n_jobs=1):
+    """Call a function with many parameters on the same data in parallel.
+
+    Parameters
+    ----------
+    func : callable
+        The function, taking a Raw or Epochs as its first argument, e.g.
+        savgol_iaf or abs_threshold. It must be importable from the worker
+        processes, i.e. defined at the top level of a module.
+    inst : instance of Raw | Epochs | SharedData
+        The data. Raw and Epochs are placed in shared memory for the
+        duration of the sweep.
+    params : list of dict
+        The keyword arguments of each call.
+    n_jobs : int
+        The number of worker processes.
+
+    Returns
+    -------
+    results : list
+        The results in the order of params.
+
+    Notes
+    -----
+    The workers get read-only views of the data in shared memory, see
+    SharedData, so that the memory use does not grow with the number of
+    workers.
+    """
+    if isinstance(inst, SharedData):
+        return _sweep(func, inst, params, n_jobs)
+    with SharedData(inst) as shared:
+        return _sweep(func, shared, params, n_jobs)
+
+
+def _sweep(func, shared, params, n_jobs):
+    """Run the calls of parallel_sweep."""
+    if n_jobs == 1:
+        return [_call(func, shared, kwargs) for kwargs in params]
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        futures = [pool.submit(_call, func, shared, kwargs)
+                   for kwargs in params]
+        return [future.result() for future in futures]
@@ -0,0 +1,280 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Synthetic EEG data of arbitrary size, e.g. for load testing."""
+
+import warnings
+
+import mne
+
+import numpy as np
+
+from scipy.signal import lfilter, lfilter_zi
+
+# IIR approximation of a 1/f spectrum over the whole frequency range
+# (Julius O. Smith, Spectral Audio Signal Processing)
+_pink_b = np.array([0.049922035, -0.095993537, 0.050612699, -0.004408786])
+_pink_a = np.array([1., -2.494956002, 2.017265875, -0.522189400])
+
+
+def _pink_gain():
+    """Get the standard deviation of the 1/f filter for unit white noise."""
+    impulse = np.zeros(2 ** 16)
+    impulse[0] = 1.
+    return np.sqrt(np.sum(lfilter(_pink_b, _pink_a, impulse) ** 2))
+
+
+def _simulate_chunks(n_chan, n_times, sfreq, iaf, alpha_amplitude,
+                     noise_amplitude, rng, chunk_size):
+    """Generate the data in volts, one chunk of samples at a time.
+
+    Yields (start, stop, data) with data of shape (n_chan, stop - start).
+    The noise is drawn time point by time point and filtered with the
+    filter state carried over between chunks, so that the data do not
+    depend on the chunk size.
+    """
+    iaf = np.broadcast_to(np.asarray(iaf, dtype=float), (n_chan,))
+    alpha_amplitude = np.broadcast_to(np.asarray(alpha_amplitude,
+                                                 dtype=float), (n_chan,))
+    phase = 2. * np.pi * rng.random(n_chan)
+    # start from the stationary state of the filter
+    zi = (lfilter_zi(_pink_b, _pink_a)[np.newaxis] *
+          rng.standard_normal(n_chan)[:, np.newaxis])
+    noise_scale = noise_amplitude / _pink_gain()
+
+    for start in range(0, n_times, chunk_size):
+        stop = min(start + chunk_size, n_times)
+        noise = rng.standard_normal((stop - start, n_chan)).T
+        data, zi = lfilter(_pink_b, _pink_a, noise, axis=1, zi=zi)
+        data *= noise_scale
+
+        times = np.arange(start, stop) / sfreq
+        for ii in range(n_chan):
+            data[ii] += alpha_amplitude[ii] * np.sin(
+                2. * np.pi * iaf[ii] * times + phase[ii])
+        yield start, stop, data
+
+
+def simulate_eeg(n_chan=16, sfreq=250., duration=30., iaf=10.,
+                 alpha_amplitude=10e-6, noise_amplitude=10e-6, seed=None,
+                 dtype=np.float64, out=None, chunk_duration=60.):
+    """Simulate EEG data with 1/f noise and an alpha peak.
+
+    Parameters
+    ----------
+    n_chan : int
+        The number of channels.
+    sfreq : float
+        The sampling frequency in Hz.
+    duration : float
+        The duration in seconds.
+    iaf : float | array-like of float
+        The individual alpha frequency in Hz, either for all channels or
+        for each channel.
+    alpha_amplitude : float | array-like of float
+        The amplitude of the alpha oscillation in volts, either for all
+        channels or for each channel.
+    noise_amplitude : float
+        The standard deviation of the 1/f noise in volts.
+    seed : None | int | instance of numpy.random.Generator
+        Seed or random number generator, see ``numpy.random.default_rng``.
+    dtype : numpy dtype
+        The data type of the returned data, e.g. ``np.float32`` to halve
+        the memory use.
+    out : None | str | ndarray
+        Where to put the data. If None, a new array is created. If a str,
+        the data are written to a memory-mapped ``.npy`` file of that name.
+        Otherwise, an array (e.g. a ``numpy.memmap``) of shape
+        (n_chan, n_times) to fill; dtype is ignored in this case.
+    chunk_duration : float
+        The duration in seconds of the chunks the data are generated in.
+        Only one chunk is held in double precision at a time.
+
+    Returns
+    -------
+    data : ndarray, shape (n_chan, n_times)
+        The simulated data in volts.
+
+    Notes
+    -----
+    The noise is pink (1/f) noise generated by filtering white noise, and
+    the alpha peak a sine wave with a random phase for each channel. The
+    data are the same for any chunk_duration.
+    """
+    rng = np.random.default_rng(seed)
+    n_times = int(round(duration * sfreq))
+    if out is None:
+        out = np.empty((n_chan, n_times), dtype=dtype)
+    elif isinstance(out, str):
+        out = np.lib.format.open_memmap(out, mode='w+', dtype=dtype,
+                                        shape=(n_chan, n_times))
+    elif out.shape != (n_chan, n_times):
+        raise ValueError('out must have shape {}, got '
+                         '{}.'.format((n_chan, n_times), out.shape))
+
+    chunk_size = max(1, int(chunk_duration * sfreq))
+    for start, stop, data in _simulate_chunks(n_chan, n_times, sfreq, iaf,
+                                              alpha_amplitude,
+                                              noise_amplitude, rng,
+                                              chunk_size):
+        out[:, start:stop] = data
+
+    return out
+
+
+def simulate_events(n_times, sfreq, rate=1., event_id=1, min_isi=0.2,
+                    seed=None):
+    """Simulate a stream of events.
+
+    Parameters
+    ----------
+    n_times : int
+        The number of samples to place events in.
+    sfreq : float
+        The sampling frequency in Hz.
+    rate : float
+        The average number of events per second.
+    event_id : int | array-like of int
+        The event code(s). Each event gets one of the codes at random.
+    min_isi : float
+        The minimum interval between events in seconds. Must be shorter than
+        1 / rate.
+    seed : None | int | instance of numpy.random.Generator
+        Seed or random number generator, see ``numpy.random.default_rng``.
+
+    Returns
+    -------
+    events : ndarray, shape (n_events, 3)
+        The events as an MNE events array.
+
+    Notes
+    -----
+    The intervals between events are min_isi plus exponentially distributed
+    intervals, i.e. the events are a Poisson process with refractory
+    period.
+    """
+    if min_isi * rate >= 1:
+        raise ValueError('min_isi must be shorter than the average interval '
+                         'between events (1 / rate).')
+    rng = np.random.default_rng(seed)
+    # draw enough intervals to cover the data with high probability
+    n_max = int(n_times / sfreq * rate * 1.5) + 10
+    isi = min_isi + rng.exponential(1. / rate - min_isi, n_max)
+    onsets = np.round(np.cumsum(isi) * sfreq).astype(np.int64)
+    onsets = onsets[onsets < n_times]
+
+    events = np.zeros((len(onsets), 3), dtype=np.int64)
+    events[:, 0] = onsets
+    events[:, 2] = rng.choice(np.atleast_1d(event_id), len(onsets))
+    return events
+
+
+def simulate_raw(n_chan=16, sfreq=250., duration=30., iaf=10.,
+                 alpha_amplitude=10e-6, noise_amplitude=10e-6,
+                 event_rate=1., event_id=1, seed=None, fname=None,
+                 chunk_duration=60.):
+    """Simulate a Raw with EEG data and events.
+
+    Parameters
+    ----------
+    n_chan : int
+        The number of EEG channels.
+    sfreq : float
+        The sampling frequency in Hz.
+    duration : float
+        The duration in seconds.
+    iaf : float | array-like of float
+        The individual alpha frequency in Hz, see simulate_eeg.
+    alpha_amplitude : float | array-like of float
+        The amplitude of the alpha oscillation in volts, see simulate_eeg.
+    noise_amplitude : float
+        The standard deviation of the 1/f noise in volts.
+    event_rate : float
+        The average number of events per second, see simulate_events. If 0,
+        no events are generated.
+    event_id : int | array-like of int
+        The event code(s), see simulate_events.
+    seed : None | int | instance of numpy.random.Generator
+        Seed or random number generator, see ``numpy.random.default_rng``.
+    fname : str | None
+        If None, the data are generated in memory, with the events in a
+        stim channel. Otherwise, the path of a BrainVision header file
+        (ending in .vhdr) to write the data and the events as markers to;
+        the returned Raw is then read from this file without preloading.
+    chunk_duration : float
+        The duration in seconds of the chunks the data are generated in.
+
+    Returns
+    -------
+    raw : instance of Raw
+        The simulated data.
+
+    Notes
+    -----
+    With fname, the data are generated chunk by chunk directly into the
+    memory-mapped data file (as 32-bit floating point with 0.1 µV
+    resolution), so that recordings much larger than the available memory
+    can be generated.
+    """
+    rng = np.random.default_rng(seed)
+    n_times = int(round(duration * sfreq))
+    ch_names = [str(ii) for ii in range(n_chan)]
+    if event_rate:
+        events = simulate_events(n_times, sfreq, event_rate, event_id,
+                                 min_isi=min(0.2, 0.5 / event_rate),
+                                 seed=rng)
+    else:
+        events = np.empty((0, 3), dtype=np.int64)
+
+    if fname is not None:
+        return _simulate_brainvision(fname, n_chan, sfreq, n_times, iaf,
+                                     alpha_amplitude, noise_amplitude,
+                                     events, rng, chunk_duration)
+
+    data = np.zeros((n_chan + 1, n_times))
+    simulate_eeg(n_chan, sfreq, duration, iaf, alpha_amplitude,
+                 noise_amplitude, seed=rng, out=data[:n_chan],
+                 chunk_duration=chunk_duration)
+    data[-1, events[:, 0]] = events[:, 2]
+
+    info = mne.create_info(ch_names + ['STI 014'], sfreq,
+                           ['eeg'] * n_chan + ['stim'])
+    return mne.io.RawArray(data, info, verbose=False)
+
+
+def _simulate_brainvision(vhdr_fname, n_chan, sfreq, n_times, iaf,
+                          alpha_amplitude, noise_amplitude, events, rng,
+                          chunk_duration):
+    """Simulate data directly into a BrainVision file."""
+    from .io import _events_to_markers, _write_vhdr, _write_vmrk_file
+
+    vmrk_fname = vhdr_fname[:-4] + 'vmrk'
+    eeg_fname = vhdr_fname[:-4] + 'eeg'
+    ch_names = [str(ii) for ii in range(n_chan)]
+    resolution = np.full(n_chan, 0.1)
+
+    markers = _events_to_markers(events)
+    markers['position'] = events[:, 0]
+    _write_vmrk_file(vmrk_fname, eeg_fname, markers)
+    _write_vhdr(vhdr_fname, vmrk_fname, eeg_fname, ch_names, sfreq,
+                'vectorized', 'binary_float32', resolution)
+
+    data = np.memmap(eeg_fname, dtype='<f4', mode='w+',
+                     shape=(n_chan, n_times))
+    # volts to multiples of the resolution
+    scale = 1e6 / resolution[:, np.newaxis]
+    chunk_size = max(1, int(chunk_duration * sfreq))
+    for start, stop, chunk in _simulate_chunks(n_chan, n_times, sfreq, iaf,
+                                               alpha_amplitude,
+                                               noise_amplitude, rng,
+                                               chunk_size):
+        chunk *= scale
+        data[:, start:stop] = chunk
+    data.flush()
+    del data
+
+    # the header has no DataPoints entry, so MNE infers it from the file size
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        return mne.io.read_raw_brainvision(vhdr_fname, preload=False,
+                                           verbose=False)
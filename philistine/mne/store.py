@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Persistent store of IAF and extraction results for incremental reruns."""
+
+from __future__ import division, print_function
+
+import hashlib
+import json
+import os
+import pickle
+import sqlite3
+import time
+
+import mne
+
+import numpy as np
+
+from .. import __version__
+from ..precision import _working_dtype
+from ._base import IafEst, attenuation_iaf, retrieve, savgol_iaf
+from .convert import _params_key, _stamp
+
+_schema = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY, size INTEGER, mtime REAL, sha256 TEXT);
+CREATE TABLE IF NOT EXISTS results (
+    func TEXT, subject TEXT, params TEXT, inputs TEXT, result BLOB,
+    version TEXT, created REAL,
+    PRIMARY KEY (func, subject, params));
+CREATE TABLE IF NOT EXISTS iaf (
+    func TEXT, subject TEXT, params TEXT, paf REAL, cog REAL,
+    fmin REAL, fmax REAL,
+    PRIMARY KEY (func, subject, params));
+CREATE INDEX IF NOT EXISTS iaf_subject ON iaf (subject);
+"""
+
+
+class ResultStore(object):
+    """Store of IAF and extraction results in an SQLite database.
+
+    Parameters
+    ----------
+    fname : str
+        Path to the database file, which is created if necessary.
+
+    Notes
+    -----
+    The methods savgol_iaf, attenuation_iaf and retrieve take the same
+    arguments as the functions of the same name plus the name of the
+    subject. Results are stored together with a hash of the inputs and the
+    parameters. When called again for the same subject and parameters,
+    the stored result is returned if the inputs have not changed and
+    computed (and replaced) otherwise.
+
+    The inputs are identified by the SHA-256 hash of their files for data
+    that are not loaded into memory, so that changes to the files are
+    detected; file hashes are cached by size and modification time. Data in
+    memory, which might have been changed since reading, are hashed
+    directly. The hash also covers the channels, the annotations of Raws,
+    the events, event IDs, times and metadata of Epochs and the working
+    precision (see philistine.set_precision).
+
+    Parameters are stored as JSON. Functions, e.g. the summary functions of
+    retrieve, are stored by their qualified name, so that lambdas and
+    functions defined inside other functions cannot be used.
+
+    IAF estimates are additionally stored in a table of their own, which
+    can be queried across subjects with iaf_table. The store can be used
+    as a context manager, closing the database on exit.
+    """
+
+    def __init__(self, fname):  # noqa: D107
+        self.fname = fname
+        self._conn = sqlite3.connect(fname)
+        self._conn.executescript(_schema)
+        self._conn.commit()
+
+    def __enter__(self):  # noqa: D105
+        return self
+
+    def __exit__(self, *args):  # noqa: D105
+        self.close()
+
+    def close(self):
+        """Close the database."""
+        self._conn.close()
+
+    def savgol_iaf(self, raw, subject, **kwargs):
+        """Estimate IAF with savgol_iaf, reusing a stored result.
+
+        Parameters
+        ----------
+        raw : instance of Raw
+            The raw data to estimate IAF from.
+        subject : str
+            The subject identifier the result is stored under.
+        kwargs :
+            Keyword arguments to pass to savgol_iaf. Nothing is plotted.
+
+        Returns
+        -------
+        iaf : IafEst | tuple
+            The result of savgol_iaf.
+        """
+        kwargs['ax'] = False
+        return self._cached(savgol_iaf, subject, [raw], (raw,), kwargs)
+
+    def attenuation_iaf(self, raws, subject, **kwargs):
+        """Estimate IAF with attenuation_iaf, reusing a stored result.
+
+        Parameters
+        ----------
+        raws : list-like of Raw
+            The two raws to estimate IAF from.
+        subject : str
+            The subject identifier the result is stored under.
+        kwargs :
+            Keyword arguments to pass to attenuation_iaf. Nothing is plotted.
+
+        Returns
+        -------
+        iaf : IafEst | tuple
+            The result of attenuation_iaf.
+        """
+        kwargs['ax'] = False
+        return self._cached(attenuation_iaf, subject, list(raws), (raws,),
+                            kwargs)
+
+    def retrieve(self, epochs, windows, subject, **kwargs):
+        """Summarize epochs with retrieve, reusing a stored result.
+
+        Parameters
+        ----------
+        epochs : instance of Epochs
+            The epoched data to extract windowed summary statistics from.
+        windows : dict of tuples
+            The time windows, see retrieve.
+        subject : str
+            The subject identifier the result is stored under.
+        kwargs :
+            Keyword arguments to pass to retrieve.
+
+        Returns
+        -------
+        dat : instance of pandas.DataFrame
+            The result of retrieve.
+        """
+        kwargs['windows'] = windows
+        return self._cached(retrieve, subject, [epochs], (epochs,), kwargs)
+
+    def _cached(self, func, subject, insts, args, kwargs):
+        """Get a stored result or compute and store it."""
+        name = func.__name__
+        params = _params_key(kwargs)
+        # the package-wide precision applies unless given for this call
+        inputs = self._inputs_key(insts, _working_dtype(
+            kwargs.get('precision')).name)
+        row = self._conn.execute(
+            'SELECT inputs, result FROM results '
+            'WHERE func = ? AND subject = ? AND params = ?',
+            (name, subject, params)).fetchone()
+        if row is not None and row[0] == inputs:
+            return pickle.loads(row[1])
+
+        result = func(*args, **kwargs)
+        with self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (name, subject, params, inputs,
+                 sqlite3.Binary(pickle.dumps(result, protocol=2)),
+                 __version__, time.time()))
+            iaf = result if isinstance(result, IafEst) else None
+            if iaf is None and isinstance(result, tuple):
+                # with return_diagnostics=True
+                iaf = result[0]
+            if iaf is not None:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO iaf VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    (name, subject, params, _float(iaf.PeakAlphaFrequency),
+                     _float(iaf.CenterOfGravity), _float(iaf.AlphaBand[0]),
+                     _float(iaf.AlphaBand[1])))
+        return result
+
+    def _inputs_key(self, insts, precision):
+        """Hash the inputs of a computation in the working precision."""
+        sha = hashlib.sha256(precision.encode('utf-8'))
+        for inst in insts:
+            sha.update(_params_key(_describe(inst)).encode('utf-8'))
+            fnames = [f for f in getattr(inst, 'filenames', []) if f]
+            if getattr(inst, 'preload', True) or not fnames:
+                sha.update(np.ascontiguousarray(inst.get_data()).data)
+                continue
+            # the part of the files that is used
+            sha.update('{} {}'.format(inst.first_samp,
+                                      inst.last_samp).encode('utf-8'))
+            for fname in fnames:
+                sha.update(self._file_hash(str(fname)).encode('utf-8'))
+        return sha.hexdigest()
+
+    def _file_hash(self, fname):
+        """Get the hash of a file, from the cache if it has not changed."""
+        fname = os.path.abspath(fname)
+        stamp = _stamp(fname, check=False)
+        row = self._conn.execute(
+            'SELECT size, mtime, sha256 FROM files WHERE path = ?',
+            (fname,)).fetchone()
+        if row is not None and row[:2] == (stamp['size'], stamp['mtime']):
+            return row[2]
+
+        stamp = _stamp(fname, check='hash')
+        with self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?)',
+                (fname, stamp['size'], stamp['mtime'], stamp['sha256']))
+        return stamp['sha256']
+
+    def subjects(self, func=None):
+        """List the subjects with stored results.
+
+        Parameters
+        ----------
+        func : str | None
+            Only list subjects with results of the function of this name,
+            e.g. 'savgol_iaf'. If None, subjects with any results are listed.
+
+        Returns
+        -------
+        subjects : list of str
+            The subject identifiers in sorted order.
+        """
+        query = 'SELECT DISTINCT subject FROM results'
+        args = ()
+        if func is not None:
+            query += ' WHERE func = ?'
+            args = (func,)
+        return sorted(row[0] for row in self._conn.execute(query, args))
+
+    def load(self, func, subjects=None):
+        """Load stored results.
+
+        Parameters
+        ----------
+        func : str
+            The name of the function, e.g. 'retrieve'.
+        subjects : list of str | None
+            The subjects to load the results of. If None, all subjects.
+
+        Returns
+        -------
+        results : list of tuple
+            The subject, the parameters (as dict) and the result of each
+            stored computation.
+        """
+        rows = self._conn.execute(
+            'SELECT subject, params, result FROM results WHERE func = ? '
+            'ORDER BY subject, params', (func,))
+        return [(subject, json.loads(params), pickle.loads(result))
+                for subject, params, result in rows
+                if subjects is None or subject in subjects]
+
+    def iaf_table(self, func=None, subjects=None):
+        """Get the stored IAF estimates as a data frame.
+
+        Parameters
+        ----------
+        func : str | None
+            Only include estimates of the function of this name, i.e.
+            'savgol_iaf' or 'attenuation_iaf'. If None, both.
+        subjects : list of str | None
+            The subjects to include. If None, all subjects.
+
+        Returns
+        -------
+        dat : instance of pandas.DataFrame
+            Data frame with one row per estimate and columns for the
+            function, the subject, the parameters (as JSON), the peak alpha
+            frequency, the center of gravity and the bounds of the alpha
+            band. Missing estimates are NaN.
+        """
+        import pandas as pd
+
+        query = 'SELECT * FROM iaf'
+        where = []
+        args = []
+        if func is not None:
+            where.append('func = ?')
+            args.append(func)
+        if subjects is not None:
+            where.append('subject IN ({})'.format(
+                ', '.join('?' * len(subjects))))
+            args.extend(subjects)
+        if where:
+            query += ' WHERE ' + ' AND '.join(where)
+        query += ' ORDER BY subject, func, params'
+        return pd.read_sql_query(query, self._conn, params=args)
+
+
+def _describe(inst):
+    """Get the properties of a Raw or Epochs besides the data."""
+    desc = dict(ch_names=inst.ch_names, bads=inst.info['bads'],
+                sfreq=inst.info['sfreq'])
+    if isinstance(inst, mne.BaseEpochs):
+        desc.update(events=inst.events, event_id=inst.event_id,
+                    times=[inst.tmin, inst.tmax, len(inst.times)],
+                    metadata=None if inst.metadata is None else
+                    inst.metadata.to_json(orient='split'))
+    else:
+        annot = inst.annotations
+        desc.update(annotations=[annot.onset, annot.duration,
+                                 annot.description, str(annot.orig_time)])
+    return desc
+
+
+def _float(value):
+    """Convert an estimate to float, keeping None."""
+    return None if value is None else float(value)
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""BrainVision reader tests."""
+
+import os
+from shutil import rmtree
+
+import mne
+
+from nose.tools import assert_equal, assert_raises, assert_true
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+
+from philistine.mne.io import (_extract_bv_segments, _find_segment,
+                               _rename_bv, _segment_markers)
+from philistine.mne.io import (anonymize_brainvision, append_raw_brainvision,
+                               read_brainvision, read_epochs_brainvision,
+                               write_epochs_brainvision, write_raw_brainvision)
+from philistine.mne.utils import _generate_raw, _mktmpdir
+
+
+def test_bv_reader_memmap():
+    """Test that memory-mapped reading matches MNE's reader."""
+    raw = _generate_raw()
+    raw.add_events(np.array([[1, 0, 82], [10, 0, 56]]))
+    tmpdir = _mktmpdir()
+
+    fname = os.path.join(tmpdir, "philistine.vhdr")
+
+    for orientation in ['multiplexed', 'vectorized']:
+        for fmt in ['binary_float32', 'binary_int16']:
+            write_raw_brainvision(raw, fname, format=fmt,
+                                  orientation=orientation)
+            raw_mne = mne.io.read_raw_brainvision(fname, preload=True)
+
+            with read_brainvision(fname) as bv:
+                assert_true(isinstance(bv.memmap, np.memmap))
+                assert_equal(bv.orientation, orientation)
+                assert_equal(bv.sfreq, raw.info['sfreq'])
+                assert_equal(bv.ch_names, raw_mne.ch_names)
+                assert_equal(bv.n_times, raw_mne.n_times)
+                assert_allclose(bv.get_data(), raw_mne._data)
+                # slicing
+                assert_allclose(bv[2:5, 100:200], raw_mne._data[2:5, 100:200])
+                assert_allclose(bv[3], raw_mne._data[3])
+                assert_allclose(bv[[1, 4], 17], raw_mne._data[[1, 4], 17])
+                assert_allclose(bv.get_data(picks=['3', 0], start=10,
+                                            stop=20),
+                                raw_mne._data[[3, 0], 10:20])
+
+                onsets = raw_mne.annotations.onset * raw_mne.info['sfreq']
+                assert_array_equal(bv.markers['position'][1:], onsets)
+                assert_array_equal(bv.markers['type'],
+                                   ['New Segment', 'Stimulus', 'Stimulus'])
+                assert_array_equal(bv.markers['description'][1:],
+                                   ['S82', 'S56'])
+                data, memmap = bv.data, bv.memmap
+                values = np.array(data[:, :3])
+
+            # views stay valid after closing
+            assert_true(bv.memmap is None)
+            assert_array_equal(data[:, :3], values)
+            assert_array_equal(memmap[:3].T if orientation == 'multiplexed'
+                               else memmap[:, :3], values)
+            del data, memmap
+
+    rmtree(tmpdir)
+
+
+def _write_segmented_vmrk(vmrk_fname, description='S{:>3}'):
+    """Write a marker file with three segments and a few stimuli each."""
+    lines = ['Brain Vision Data Exchange Marker File, Version 1.0',
+             '',
+             '[Common Infos]',
+             'Codepage=UTF-8',
+             'DataFile=philistine.eeg',
+             '',
+             '[Marker Infos]',
+             '; Each entry: Mk<Marker number>=<Type>,<Description>,...']
+    mk = 1
+    for seg in range(3):
+        lines.append('Mk{}=New Segment,,{},1,0,2023010112000000000'
+                     .format(mk, seg * 1000 + 1))
+        mk += 1
+        for stim in range(5):
+            lines.append('Mk{}=Stimulus,{},{},1,0'.format(
+                mk, description.format(stim), seg * 1000 + stim * 100 + 51))
+            mk += 1
+    lines.append('Mk{}=Comment,no\\1size,2500,,'.format(mk))
+    with open(vmrk_fname, 'w') as fout:
+        fout.write('\r\n'.join(lines) + '\r\n')
+
+
+def test_extract_bv_segments():
+    """Test extraction of segments and the marker index."""
+    tmpdir = _mktmpdir()
+    fname = os.path.join(tmpdir, "philistine.vmrk")
+
+    for description in ['S{:>3}', 'x={}']:
+        _write_segmented_vmrk(fname, description)
+        segments = _extract_bv_segments(fname)
+
+        assert_equal(len(segments.markers), 3 * 6 + 1)
+        assert_array_equal(segments.onsets, [0, 1000, 2000])
+        assert_array_equal(_find_segment(segments, [0, 999, 1000, 2500]),
+                           [0, 0, 1, 2])
+
+        seg = _segment_markers(segments, 1)
+        assert_equal(len(seg), 6)
+        assert_array_equal(seg['position'][1:], np.arange(5) * 100 + 1050)
+
+        idx = segments.descriptions[description.format(3)]
+        assert_array_equal(segments.markers['position'][idx],
+                           [350, 1350, 2350])
+
+        comment = segments.markers[-1]
+        assert_equal(comment['type'], 'Comment')
+        assert_equal(comment['description'], 'no,size')
+        assert_equal(comment['size'], 1)
+        assert_equal(comment['channel'], 0)
+
+    rmtree(tmpdir)
+
+
+def test_rename_bv():
+    """Test renaming without touching the data file."""
+    raw = _generate_raw()
+    tmpdir = _mktmpdir()
+
+    fname = os.path.join(tmpdir, "philistine.vhdr")
+    new_fname = os.path.join(tmpdir, "renamed.vhdr")
+    linked_fname = os.path.join(tmpdir, "linked.vhdr")
+    write_raw_brainvision(raw, fname)
+    raw_orig = mne.io.read_raw_brainvision(fname, preload=True)
+    inode = os.stat(fname[:-4] + 'eeg').st_ino
+
+    _rename_bv(fname, new_fname)
+    assert_true(not os.path.exists(fname))
+    assert_true(not os.path.exists(fname[:-4] + 'vmrk'))
+    assert_true(not os.path.exists(fname[:-4] + 'eeg'))
+    assert_equal(os.stat(new_fname[:-4] + 'eeg').st_ino, inode)
+
+    raw_renamed = mne.io.read_raw_brainvision(new_fname, preload=True)
+    assert_array_equal(raw_orig._data, raw_renamed._data)
+
+    _rename_bv(new_fname, linked_fname, link=True)
+    assert_true(os.path.exists(new_fname))
+    assert_equal(os.stat(linked_fname[:-4] + 'eeg').st_ino, inode)
+    with read_brainvision(linked_fname) as bv:
+        assert_true(bv.vmrk_fname.endswith('linked.vmrk'))
+        assert_allclose(bv.get_data(), raw_orig._data)
+
+    assert_raises(FileExistsError, _rename_bv, new_fname, linked_fname)
+
+    rmtree(tmpdir)
+
+
+def test_anonymize_bv():
+    """Test stripping time stamps from marker files in a directory tree."""
+    tmpdir = _mktmpdir()
+
+    fnames = []
+    for sub in ['a', 'b', os.path.join('b', 'c')]:
+        os.makedirs(os.path.join(tmpdir, sub))
+        fnames.append(os.path.join(tmpdir, sub, "philistine.vmrk"))
+        _write_segmented_vmrk(fnames[-1])
+
+    before = _extract_bv_segments(fnames[0]).markers
+    assert_equal(anonymize_brainvision(tmpdir, n_jobs=2), sorted(fnames))
+
+    for fname in fnames:
+        with open(fname) as fin:
+            text = fin.read()
+        assert_true('2023' not in text)
+        assert_array_equal(_extract_bv_segments(fname).markers, before)
+
+    rmtree(tmpdir)
+
+
+def test_read_epochs_brainvision():
+    """Test reading segmented data as epochs."""
+    raw = _generate_raw(duration=10)
+    raw._data[:-1] -= raw._data[:-1].mean(axis=1, keepdims=True)
+    events = np.array([[200, 0, 1], [1000, 0, 2], [2000, 0, 1]])
+    epochs = mne.Epochs(raw, events, dict(a=1, b=2), tmin=-0.1, tmax=0.5,
+                        baseline=None, preload=True, picks='eeg')
+    tmpdir = _mktmpdir()
+
+    fname = os.path.join(tmpdir, "philistine.vhdr")
+    for orientation in ['multiplexed', 'vectorized']:
+        write_epochs_brainvision(epochs, fname, orientation=orientation)
+
+        with read_brainvision(fname) as bv:
+            data = bv.segment_data
+            assert_equal(data.shape, epochs.get_data().shape)
+            assert_true(np.shares_memory(data, bv.memmap))
+            assert_allclose(data * bv.cals[:, np.newaxis], epochs.get_data(),
+                            rtol=1e-6)
+            cals = bv.cals
+        # the segments are still readable after closing
+        assert_allclose(data[1] * cals[:, np.newaxis], epochs.get_data()[1],
+                        rtol=1e-6)
+        del data
+
+        epochs_bv = read_epochs_brainvision(fname)
+        assert_allclose(epochs_bv.times, epochs.times)
+        assert_allclose(epochs_bv.get_data(), epochs.get_data(), rtol=1e-6)
+        assert_array_equal(epochs_bv.events[:, 2], events[:, 2])
+        assert_equal(epochs_bv.event_id,
+                     {'Stimulus/S1': 1, 'Stimulus/S2': 2})
+        assert_equal([type(name) for name in epochs_bv.event_id], [str, str])
+
+    # without a matching event the segment is coded as in MNE
+    epochs_bv = read_epochs_brainvision(fname, event_id={'Stimulus/S2': 2},
+                                        tmin=-0.1)
+    assert_array_equal(epochs_bv.events[:, 2], [99999, 2, 99999])
+    assert_equal(epochs_bv.event_id, {'Stimulus/S2': 2, 'New Segment/': 99999})
+    assert_raises(ValueError, read_epochs_brainvision, fname, tmin=0.1)
+
+    # the time-locking point can be at the start of the epochs, but not
+    # outside of them
+    for tmin, tmax in [(0., 0.5), (0.1, 0.5), (-0.5, -0.1)]:
+        epochs = mne.Epochs(raw, events, dict(a=1, b=2), tmin=tmin,
+                            tmax=tmax, baseline=None, preload=True,
+                            picks='eeg')
+        if tmin > 0 or tmax < 0:
+            assert_raises(ValueError, write_epochs_brainvision, epochs,
+                          fname)
+            continue
+        write_epochs_brainvision(epochs, fname)
+        epochs_bv = read_epochs_brainvision(fname)
+        assert_allclose(epochs_bv.times, epochs.times)
+        assert_array_equal(epochs_bv.events[:, 0],
+                           np.arange(3) * len(epochs.times))
+        assert_array_equal(epochs_bv.events[:, 2], events[:, 2])
+    # the previous file is left as is
+    assert_allclose(read_epochs_brainvision(fname).get_data(),
+                    epochs_bv.get_data())
+
+    # segments of unequal length are only available as a list of views
+    write_raw_brainvision(raw, fname)
+    append_raw_brainvision(raw.copy().crop(0, 1), fname)
+    with read_brainvision(fname) as bv:
+        assert_equal([seg.shape[1] for seg in bv.segment_data],
+                     [raw.n_times, 251])
+    assert_raises(ValueError, read_epochs_brainvision, fname)
+
+    rmtree(tmpdir)
@@ -3,19 +3,27 @@
 # License: BSD (3-clause)
 """BrainVision Writer tests."""
 
+import json
 import os
 from shutil import rmtree
 
 import mne
 
-from nose.tools import assert_equal, assert_raises
+from nose.tools import assert_equal, assert_raises, assert_true
 
 import numpy as np
 from numpy.testing import assert_allclose, assert_array_equal
 
+from philistine.mne.io import _find_events_blockwise
+from philistine.mne.io import _raw_block_reader, _read_vmrk_file
+from philistine.mne.io import _write_bveeg_blocks
 from philistine.mne.io import _write_bveeg_file
 from philistine.mne.io import _write_vhdr_file
-from philistine.mne.io import write_raw_brainvision
+from philistine.mne.io import append_raw_brainvision, write_raw_brainvision
+from philistine.mne.io import write_array_brainvision
+from philistine.mne.io import write_epochs_brainvision
+from philistine.mne.io import read_brainvision, verify_brainvision
+from philistine.mne.io import compare_raw_brainvision
 from philistine.mne.utils import _generate_raw, _mktmpdir
 
 # TODO: events of all types (stim channel, extra events, no events,
@@ -101,3 +109,457 @@ def test_bv_writer_oi_cycle():
     assert_equal(raw.info['highpass'], raw_written.info['highpass'])
 
     rmtree(tmpdir)
+
+
+def test_bv_writer_int_formats():
+    """Test that integer formats round trip within the resolution."""
+    raw = _generate_raw()
+    # give the channels rather different amplitudes
+    raw._data[:-1] *= np.logspace(0, 3, raw._data.shape[0] - 1)[:, np.newaxis]
+    tmpdir = _mktmpdir()
+
+    fname = os.path.join(tmpdir, "philistine.vhdr")
+    data = raw.copy().pick_types(eeg=True, stim=False)._data
+
+    for fmt, size in [('binary_int16', 2), ('binary_int32', 4)]:
+        write_raw_brainvision(raw, fname, format=fmt)
+        assert_equal(os.path.getsize(fname[:-4] + 'eeg'), data.size * size)
+
+        raw_written = mne.io.read_raw_brainvision(fname, preload=True)
+        raw_written.pick_types(eeg=True, stim=False)
+        resolution = np.array([ch['cal'] for ch in raw_written.info['chs']])
+        # each channel gets its own resolution
+        assert_equal(len(np.unique(resolution)), len(resolution))
+        err = np.max(np.abs(raw_written._data - data), axis=1)
+        assert_true(np.all(err <= resolution / 2 * (1 + 1e-6)))
+
+    rmtree(tmpdir)
+
+
+def test_bv_writer_clipping():
+    """Test that clipping with an explicit resolution is an error."""
+    raw = _generate_raw()
+    # remove the DC offset to get into the microvolt range
+    raw._data -= raw._data.mean(axis=1, keepdims=True)
+    tmpdir = _mktmpdir()
+
+    fname = os.path.join(tmpdir, "philistine.vhdr")
+    assert_raises(ValueError, write_raw_brainvision, raw, fname,
+                  format='binary_int16', resolution=1e-6)
+    assert_raises(ValueError, write_raw_brainvision, raw, fname,
+                  format='binary_int16', resolution=-1)
+    # but a coarse enough resolution works fine
+    write_raw_brainvision(raw, fname, format='binary_int16', resolution=0.1)
+    raw_written = mne.io.read_raw_brainvision(fname, preload=True)
+    assert_allclose(raw.copy().pick_types(eeg=True)._data,
+                    raw_written.pick_types(eeg=True)._data, atol=0.05e-6)
+
+    # a failed export leaves an earlier export at the same path intact
+    contents = dict()
+    for ext in ('vhdr', 'vmrk', 'eeg'):
+        with open(fname[:-4] + ext, 'rb') as fin:
+            contents[ext] = fin.read()
+    for orientation in ('multiplexed', 'vectorized'):
+        assert_raises(ValueError, write_raw_brainvision, raw, fname,
+                      format='binary_int16', resolution=1e-6,
+                      orientation=orientation)
+    for ext in ('vhdr', 'vmrk', 'eeg'):
+        with open(fname[:-4] + ext, 'rb') as fin:
+            assert_equal(fin.read(), contents[ext])
+
+    rmtree(tmpdir)
+
+
+def test_bv_writer_vectorized():
+    """Test that vectorized and multiplexed exports read back identically."""
+    raw = _generate_raw()
+    tmpdir = _mktmpdir()
+
+    fname_mux = os.path.join(tmpdir, "multiplexed.vhdr")
+    fname_vec = os.path.join(tmpdir, "vectorized.vhdr")
+
+    for fmt in ['binary_float32', 'binary_int16']:
+        write_raw_brainvision(raw, fname_mux, format=fmt)
+        write_raw_brainvision(raw, fname_vec, format=fmt,
+                              orientation='VECTORIZED')
+
+        raw_mux = mne.io.read_raw_brainvision(fname_mux, preload=True)
+        raw_vec = mne.io.read_raw_brainvision(fname_vec, preload=True)
+        assert_array_equal(raw_mux._data, raw_vec._data)
+
+    assert_raises(ValueError, write_raw_brainvision, raw, fname_vec,
+                  orientation='bad')
+
+    rmtree(tmpdir)
+
+
+def test_bv_writer_annotations():
+    """Test that annotations are exported with types and durations."""
+    raw = _generate_raw()
+    raw.set_annotations(mne.Annotations(onset=[1., 2.5, 4., 10.],
+                                        duration=[0., 0.5, 0., 0.],
+                                        description=['Response/R  1',
+                                                     'eyes, closed',
+                                                     'BAD boundary',
+                                                     'Stimulus/S 12']))
+    tmpdir = _mktmpdir()
+
+    fname = os.path.join(tmpdir, "philistine.vhdr")
+    write_raw_brainvision(raw, fname, events=False)
+
+    raw_written = mne.io.read_raw_brainvision(fname)
+    annot = raw_written.annotations
+    assert_equal(list(annot.description),
+                 ['Response/R  1', 'Comment/eyes, closed',
+                  'New Segment/', 'Stimulus/S 12'])
+    assert_allclose(annot.onset, raw.annotations.onset)
+    assert_allclose(annot.duration, [1. / raw.info['sfreq'], 0.5,
+                                     1. / raw.info['sfreq'],
+                                     1. / raw.info['sfreq']])
+
+    write_raw_brainvision(raw, fname, events=False, annotations=False)
+    raw_written = mne.io.read_raw_brainvision(fname)
+    assert_equal(len(raw_written.annotations), 0)
+
+    # annotations are positioned relative to the first exported sample,
+    # with and without measurement date
+    raw = mne.io.RawArray(raw.get_data(), raw.info, first_samp=100,
+                          verbose=False)
+    for meas_date in (None, 0):
+        raw.set_meas_date(meas_date)
+        # onsets are relative to the first sample without orig_time and
+        # relative to the measurement date with it
+        onset = 0.5 if meas_date is None else 0.5 + raw.first_time
+        raw.set_annotations(mne.Annotations([onset], [0.], ['Comment/x'],
+                                            orig_time=raw.info['meas_date']))
+        write_raw_brainvision(raw, fname, events=False)
+        append_raw_brainvision(raw, fname, events=False)
+        positions = _read_vmrk_file(fname[:-4] + 'vmrk')['position']
+        offset = int(0.5 * raw.info['sfreq'])
+        assert_array_equal(positions, [0, offset, raw.n_times,
+                                       raw.n_times + offset])
+
+    rmtree(tmpdir)
+
+
+def test_bv_writer_markers():
+    """Test that structured marker arrays are written as is."""
+    raw = _generate_raw()
+    tmpdir = _mktmpdir()
+
+    fname = os.path.join(tmpdir, "philistine.vhdr")
+    markers = np.zeros(3, dtype=[('type', 'U8'), ('description', 'U4'),
+                                 ('position', int), ('size', int),
+                                 ('channel', int)])
+    markers['type'] = ['Stimulus', 'Response', 'Comment']
+    markers['description'] = ['S  1', 'R  2', 'a,b']
+    markers['position'] = [10, 20, 30]
+    markers['size'] = [1, 5, 1]
+    markers['channel'] = [0, 2, 0]
+
+    write_raw_brainvision(raw, fname, events=markers)
+    raw_written = mne.io.read_raw_brainvision(fname)
+    annot = raw_written.annotations
+    assert_equal(list(annot.description),
+                 ['Stimulus/S  1', 'Response/R  2', 'Comment/a,b'])
+    assert_allclose(annot.onset * raw.info['sfreq'], markers['position'])
+    assert_allclose(annot.duration * raw.info['sfreq'], markers['size'])
+
+    rmtree(tmpdir)
+
+
+def test_bv_writer_blocks():
+    """Test that blockwise writing is independent of the block size."""
+    raw = _generate_raw(duration=5)
+    tmpdir = _mktmpdir()
+
+    eeg_fname = os.path.join(tmpdir, "philistine.eeg")
+    picks = np.arange(len(raw.ch_names) - 1)
+    read_block = _raw_block_reader(raw, picks)
+    resolution = np.full(len(picks), 0.1)
+    data = raw._data[picks]
+
+    for orientation in ['multiplexed', 'vectorized']:
+        for block_size in [1, 7, 1000, 100000]:
+            _write_bveeg_blocks(eeg_fname, read_block, len(picks),
+                                raw.n_times, orientation,
+                                np.dtype('<f4'), resolution,
+                                block_size=block_size)
+            written = np.fromfile(eeg_fname, dtype='<f4')
+            if orientation == 'multiplexed':
+                written = written.reshape(-1, len(picks)).T
+            else:
+                written = written.reshape(len(picks), -1)
+            assert_allclose(written * 1e-7, data, rtol=1e-6)
+
+    rmtree(tmpdir)
+
+
+def test_bv_writer_not_preloaded():
+    """Test that Raws that are not preloaded are exported blockwise."""
+    raw = _generate_raw(duration=5)
+    raw.add_events(np.array([[1, 0, 82], [10, 0, 56]]))
+    tmpdir = _mktmpdir()
+
+    fif_fname = os.path.join(tmpdir, "philistine_raw.fif")
+    raw.save(fif_fname)
+    raw = mne.io.read_raw_fif(fif_fname, preload=True)
+    raw_lazy = mne.io.read_raw_fif(fif_fname, preload=False)
+
+    for fmt in ['binary_float32', 'binary_int16']:
+        fname = os.path.join(tmpdir, "preloaded.vhdr")
+        write_raw_brainvision(raw, fname, format=fmt)
+        fname_lazy = os.path.join(tmpdir, "lazy.vhdr")
+        write_raw_brainvision(raw_lazy, fname_lazy, format=fmt)
+        assert_true(not raw_lazy.preload)
+
+        with open(fname[:-4] + 'eeg', 'rb') as fin:
+            expected = fin.read()
+        with open(fname_lazy[:-4] + 'eeg', 'rb') as fin:
+            assert_equal(fin.read(), expected)
+        assert_array_equal(_read_vmrk_file(fname_lazy[:-4] + 'vmrk'),
+                           _read_vmrk_file(fname[:-4] + 'vmrk'))
+
+    rmtree(tmpdir)
+
+
+def test_bv_append():
+    """Test appending segments to an existing file."""
+    raw = _generate_raw(duration=5)
+    raw.add_events(np.array([[1, 0, 82], [10, 0, 56]]))
+    raw2 = _generate_raw(duration=3, iaf=11.25)
+    raw2.add_events(np.array([[5, 0, 31]]))
+    tmpdir = _mktmpdir()
+
+    fname = os.path.join(tmpdir, "philistine.vhdr")
+    for fmt in ['binary_float32', 'binary_int16']:
+        write_raw_brainvision(raw, fname, format=fmt)
+        raw_written = mne.io.read_raw_brainvision(fname, preload=True)
+        append_raw_brainvision(raw2, fname)
+
+        raw_appended = mne.io.read_raw_brainvision(fname, preload=True)
+        assert_equal(raw_appended.n_times, raw.n_times + raw2.n_times)
+        # the existing data are untouched
+        assert_array_equal(raw_appended._data[:, :raw.n_times],
+                           raw_written._data)
+        # the appended data are written with the existing resolution
+        atol = np.max([ch['cal'] for ch in raw_written.info['chs']])
+        assert_allclose(raw_appended._data[:, raw.n_times:],
+                        raw2.copy().pick_types(eeg=True)._data,
+                        atol=atol / 2 * (1 + 1e-6))
+
+        annot = raw_appended.annotations
+        assert_equal(list(annot.description),
+                     ['Stimulus/S82', 'Stimulus/S56', 'New Segment/',
+                      'Stimulus/S31'])
+        assert_allclose(annot.onset * raw.info['sfreq'],
+                        [0, 9, raw.n_times, raw.n_times + 4])
+
+    # integer data must fit into the existing resolution
+    raw2._data *= 1e3
+    with open(fname[:-4] + 'eeg', 'rb') as fin:
+        before = fin.read()
+    assert_raises(ValueError, append_raw_brainvision, raw2, fname)
+    with open(fname[:-4] + 'eeg', 'rb') as fin:
+        assert_equal(fin.read(), before)
+
+    # channels and orientation must match
+    assert_raises(ValueError, append_raw_brainvision,
+                  raw2.copy().pick(['0', '1']), fname)
+    write_raw_brainvision(raw, fname, orientation='vectorized')
+    assert_raises(ValueError, append_raw_brainvision, raw2, fname)
+
+    rmtree(tmpdir)
+
+
+def test_bv_writer_epochs():
+    """Test writing epochs as segmented data."""
+    raw = _generate_raw(duration=10)
+    raw._data[:-1] -= raw._data[:-1].mean(axis=1, keepdims=True)
+    events = np.array([[200, 0, 1], [1000, 0, 2], [2000, 0, 1]])
+    tmpdir = _mktmpdir()
+
+    fname = os.path.join(tmpdir, "philistine.vhdr")
+    for preload in [True, False]:
+        epochs = mne.Epochs(raw, events, dict(a=1, b=2), tmin=-0.1, tmax=0.5,
+                            baseline=None, preload=preload)
+        expected = epochs.get_data(picks='eeg')
+        n_samp = len(epochs.times)
+        for fmt in ['binary_float32', 'binary_int16']:
+            for orient in ['multiplexed', 'vectorized']:
+                write_epochs_brainvision(epochs, fname, format=fmt,
+                                         orientation=orient)
+                raw_bv = mne.io.read_raw_brainvision(fname, preload=True)
+                assert_equal(raw_bv.n_times, 3 * n_samp)
+                atol = np.max([ch['cal'] for ch in raw_bv.info['chs']])
+                assert_allclose(raw_bv._data,
+                                np.concatenate(expected, axis=-1),
+                                rtol=1e-6, atol=atol / 2 * (1 + 1e-6))
+
+        markers = _read_vmrk_file(fname[:-4] + 'vmrk')
+        assert_equal(list(markers['type']),
+                     ['New Segment', 'Time 0', 'Stimulus'] * 3)
+        assert_equal(list(markers['description'][2::3]), ['S1', 'S2', 'S1'])
+        zero = int(round(0.1 * raw.info['sfreq']))
+        assert_array_equal(markers['position'][::3], np.arange(3) * n_samp)
+        assert_array_equal(markers['position'][1::3],
+                           np.arange(3) * n_samp + zero)
+        assert_array_equal(markers['position'][2::3],
+                           np.arange(3) * n_samp + zero)
+
+    rmtree(tmpdir)
+
+
+def test_bv_writer_index():
+    """Test the integrity index of the data file."""
+    raw = _generate_raw()
+    tmpdir = _mktmpdir()
+
+    fname = os.path.join(tmpdir, "philistine.vhdr")
+    eeg_fname = os.path.join(tmpdir, "philistine.eeg")
+    idx_fname = os.path.join(tmpdir, "philistine.vidx")
+    for orientation in ['multiplexed', 'vectorized']:
+        write_raw_brainvision(raw, fname, format='binary_int32',
+                              orientation=orientation, index=True)
+        result = verify_brainvision(fname)
+        assert_true(result.valid)
+
+        with open(idx_fname) as fin:
+            index = json.load(fin)
+        with read_brainvision(fname) as bv:
+            for ch, data in zip(bv.ch_names, bv.data):
+                assert_equal(index['channels'][ch]['min'], data.min())
+                assert_equal(index['channels'][ch]['max'], data.max())
+                assert_equal(index['channels'][ch]['sum'], data.sum())
+
+    # one block per channel for vectorized data
+    assert_equal(verify_brainvision(fname, n_blocks=3).n_checked, 3)
+
+    with open(eeg_fname, 'r+b') as fout:
+        fout.seek(5000)
+        byte = fout.read(1)
+        fout.seek(5000)
+        fout.write(bytes([byte[0] ^ 0xff]))
+    result = verify_brainvision(fname)
+    assert_equal(result.valid, False)
+    assert_true(result.size_matches)
+    assert_equal(len(result.corrupt), 1)
+    offset, length = result.corrupt[0]
+    assert_true(offset <= 5000 < offset + length)
+
+    with open(eeg_fname, 'r+b') as fout:
+        fout.truncate(1000)
+    result = verify_brainvision(fname, n_blocks=1, random_state=0)
+    assert_equal(result.size_matches, False)
+    assert_equal(result.valid, False)
+
+    # exports without an index remove stale indices
+    write_raw_brainvision(raw, fname)
+    assert_equal(os.path.exists(idx_fname), False)
+
+    rmtree(tmpdir)
+
+
+def test_bv_writer_compare():
+    """Test comparing written files to their source."""
+    raw = _generate_raw()
+    raw._data[:-1] -= raw._data[:-1].mean(axis=1, keepdims=True)
+    tmpdir = _mktmpdir()
+
+    fname = os.path.join(tmpdir, "philistine.vhdr")
+    for fmt in ['binary_float32', 'binary_int16', 'binary_int32']:
+        for orientation in ['multiplexed', 'vectorized']:
+            write_raw_brainvision(raw, fname, format=fmt,
+                                  orientation=orientation)
+            result = compare_raw_brainvision(raw, fname)
+            assert_true(result.valid)
+            assert_equal(result.ch_names, raw.ch_names[:-1])
+            assert_true(np.all(result.max_error <= result.tolerance))
+
+    raw2 = raw.copy()
+    raw2._data[3, 100] += 1e-3
+    result = compare_raw_brainvision(raw2, fname)
+    assert_equal(result.valid, False)
+    assert_equal(list(np.nonzero(result.max_error > result.tolerance)[0]),
+                 [3])
+    assert_allclose(result.max_error[3], 1e-3, rtol=1e-3)
+
+    # appended segments are compared at their offset
+    write_raw_brainvision(raw, fname)
+    raw2 = raw.copy().crop(0, 2)
+    append_raw_brainvision(raw2, fname)
+    assert_true(compare_raw_brainvision(raw2, fname, start=raw.n_times).valid)
+    assert_raises(ValueError, compare_raw_brainvision, raw2, fname,
+                  start=raw.n_times + 1)
+    assert_raises(ValueError, compare_raw_brainvision,
+                  raw2.copy().pick(['0', '1']), fname)
+
+    rmtree(tmpdir)
+
+
+def test_find_events_blockwise():
+    """Test blockwise event extraction against MNE."""
+    raw = _generate_raw(duration=10)
+    raw.add_events(np.array([[1, 0, 82], [10, 0, 56], [999, 0, 3],
+                             [1000, 0, 5], [2499, 0, 7]]))
+    raw._data[-1, 1500:1510] = 4
+    raw._data[-1, 1505:1507] = 9
+    tmpdir = _mktmpdir()
+
+    fname = os.path.join(tmpdir, "philistine_raw.fif")
+    raw.save(fname)
+    raw_fif = mne.io.read_raw_fif(fname, preload=False)
+    expected = mne.find_events(raw_fif, shortest_event=1)
+    assert_true(len(expected) > 0)
+    for block_size in [None, 1000, 999, 7]:
+        events = _find_events_blockwise(raw_fif, block_size=block_size)
+        assert_array_equal(events, expected)
+    assert_equal(raw_fif.preload, False)
+
+    raw.pick_types(eeg=True)
+    assert_equal(_find_events_blockwise(raw).shape, (0, 3))
+
+    rmtree(tmpdir)
+
+
+def test_bv_writer_array():
+    """Test writing arrays and memmaps without a Raw."""
+    raw = _generate_raw()
+    raw._data[:-1] -= raw._data[:-1].mean(axis=1, keepdims=True)
+    data = raw.get_data(picks='eeg')
+    ch_names = raw.ch_names[:-1]
+    tmpdir = _mktmpdir()
+
+    fname = os.path.join(tmpdir, "philistine.vhdr")
+    fname_raw = os.path.join(tmpdir, "philistine_raw.vhdr")
+    npy_fname = os.path.join(tmpdir, "philistine.npy")
+    # stored as time x channels, as from many acquisition tools
+    np.save(npy_fname, np.ascontiguousarray(data.T))
+    mmap = np.load(npy_fname, mmap_mode='r').T
+
+    for fmt in ['binary_float32', 'binary_int16']:
+        for orientation in ['multiplexed', 'vectorized']:
+            write_array_brainvision(mmap, fname, ch_names,
+                                    raw.info['sfreq'], format=fmt,
+                                    orientation=orientation)
+            write_raw_brainvision(raw, fname_raw, events=False, format=fmt,
+                                  orientation=orientation)
+            for ext in ['eeg', 'vhdr']:
+                with open(fname[:-4] + ext, 'rb') as fin:
+                    written = fin.read().replace(b'philistine.',
+                                                 b'philistine_raw.')
+                with open(fname_raw[:-4] + ext, 'rb') as fin:
+                    assert_equal(written, fin.read())
+
+    events = np.array([[10, 0, 1], [100, 0, 2]])
+    write_array_brainvision(data, fname, ch_names, raw.info['sfreq'],
+                            events=events)
+    raw_bv = mne.io.read_raw_brainvision(fname)
+    assert_allclose(raw_bv.annotations.onset * raw.info['sfreq'], [10, 100])
+
+    assert_raises(ValueError, write_array_brainvision, data[0], fname,
+                  ch_names, raw.info['sfreq'])
+    assert_raises(ValueError, write_array_brainvision, data, fname,
+                  ch_names[1:], raw.info['sfreq'])
+
+    rmtree(tmpdir)
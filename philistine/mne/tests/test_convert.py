@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Batch conversion tests."""
+
+import os
+from shutil import rmtree
+
+import mne
+
+from nose.tools import assert_equal
+
+from numpy.testing import assert_allclose
+
+from philistine.mne.convert import convert_to_brainvision, main
+from philistine.mne.io import read_brainvision
+from philistine.mne.utils import _generate_raw, _mktmpdir
+
+
+def test_convert_to_brainvision():
+    """Test conversion of a directory tree with skipping of current files."""
+    tmpdir = _mktmpdir()
+    in_dir = os.path.join(tmpdir, 'fif')
+    out_dir = os.path.join(tmpdir, 'bv')
+    os.makedirs(os.path.join(in_dir, 'sub-02'))
+
+    raw = _generate_raw(duration=5)
+    fnames = [os.path.join(in_dir, 'sub-01_raw.fif'),
+              os.path.join(in_dir, 'sub-02', 'sub-02_raw.fif')]
+    for fname in fnames:
+        raw.save(fname, verbose=False)
+    # not matching the pattern
+    with open(os.path.join(in_dir, 'notes.txt'), 'w') as fout:
+        fout.write('nothing to see here')
+
+    report = convert_to_brainvision(in_dir, out_dir, n_jobs=2,
+                                    verbose=False)
+    assert_equal(sorted(report.converted), fnames)
+    assert_equal(report.skipped, [])
+    assert_equal(report.failed, [])
+
+    vhdr_fname = os.path.join(out_dir, 'sub-02', 'sub-02_raw.vhdr')
+    raw_written = mne.io.read_raw_brainvision(vhdr_fname, preload=True)
+    assert_allclose(raw.copy().pick_types(eeg=True)._data,
+                    raw_written._data)
+
+    # everything is up to date
+    report = convert_to_brainvision(in_dir, out_dir, verbose=False)
+    assert_equal(report.converted, [])
+    assert_equal(report.skipped, fnames)
+
+    # a changed input and a deleted output are converted again
+    raw.save(fnames[0], overwrite=True, verbose=False)
+    os.remove(vhdr_fname)
+    report = convert_to_brainvision(in_dir, out_dir, verbose=False)
+    assert_equal(sorted(report.converted), fnames)
+
+    # hashes are recorded on demand
+    report = convert_to_brainvision(in_dir, out_dir, check='hash',
+                                    verbose=False)
+    assert_equal(sorted(report.converted), fnames)
+    report = convert_to_brainvision(in_dir, out_dir, check='hash',
+                                    verbose=False)
+    assert_equal(report.skipped, fnames)
+
+    # outputs written with other options are converted again
+    report = convert_to_brainvision(in_dir, out_dir, format='binary_int16',
+                                    verbose=False)
+    assert_equal(sorted(report.converted), fnames)
+    with read_brainvision(vhdr_fname) as bv:
+        assert_equal(bv.format, 'binary_int16')
+    report = convert_to_brainvision(in_dir, out_dir, format='binary_int16',
+                                    verbose=False)
+    assert_equal(report.skipped, fnames)
+
+    # command line
+    assert_equal(main([in_dir, out_dir, '--check', 'none', '-j', '2',
+                       '--format', 'binary_int16']), 0)
+
+    rmtree(tmpdir)
@@ -78,3 +78,9 @@ def test_abs_treshold():
     # catch negative values exceeding threshold
     epochs._data = -np.abs(epochs._data)
     assert_array_equal(abs_threshold(epochs, threshold), target_mask)
+
+    # the data of the epochs are left as they are
+    data = epochs._data.copy()
+    for precision in ('float64', 'float32'):
+        abs_threshold(epochs, threshold, precision=precision)
+        assert_array_equal(epochs._data, data)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Study pipeline tests."""
+
+import json
+import os
+from shutil import rmtree
+
+import mne
+
+from nose.tools import assert_equal, assert_raises, assert_true
+
+from philistine.mne import simulate_raw
+from philistine.mne.pipeline import main, run_pipeline
+from philistine.mne.utils import _mktmpdir
+
+
+def test_run_pipeline():
+    """Test running, resuming and rerunning the stages of a pipeline."""
+    tmpdir = _mktmpdir()
+    in_dir = os.path.join(tmpdir, 'raw')
+    os.makedirs(in_dir)
+    for seed, subject in enumerate(('sub-01', 'sub-02')):
+        raw = simulate_raw(iaf=10.5, alpha_amplitude=20e-6, seed=seed)
+        raw.save(os.path.join(in_dir, subject + '_raw.fif'), verbose=False)
+
+    config = dict(in_dir='raw', out_dir='derivatives',
+                  stages=dict(savgol_iaf=dict(),
+                              epochs=dict(tmin=-0.1, tmax=0.5,
+                                          baseline=None),
+                              abs_threshold=dict(threshold=1.)))
+    config_fname = os.path.join(tmpdir, 'pipeline.json')
+    with open(config_fname, 'w') as fout:
+        json.dump(config, fout)
+
+    report = run_pipeline(config_fname, n_jobs=2, verbose=False)
+    assert_equal(report.completed, ['sub-01_raw', 'sub-02_raw'])
+    assert_equal(report.failed, [])
+    assert_equal(sorted(report.stage_times),
+                 ['abs_threshold', 'epochs', 'savgol_iaf'])
+
+    out_dir = os.path.join(tmpdir, 'derivatives', 'sub-01_raw')
+    with open(os.path.join(out_dir, 'iaf.json')) as fin:
+        assert_equal(json.load(fin)['PeakAlphaFrequency'], 10.5)
+    epochs = mne.read_epochs(os.path.join(out_dir, 'clean-epo.fif'))
+    assert_true(len(epochs) > 0)
+
+    # everything is up to date
+    report = run_pipeline(config_fname, verbose=False)
+    assert_equal(report.skipped, ['sub-01_raw', 'sub-02_raw'])
+
+    # deleted outputs are written again
+    for fname in ('epochs-epo.fif', 'clean-epo.fif'):
+        os.remove(os.path.join(out_dir, fname))
+    report = run_pipeline(config_fname, verbose=False)
+    assert_equal(report.completed, ['sub-01_raw'])
+    assert_equal(sorted(report.stage_times), ['abs_threshold', 'epochs'])
+    assert_true(os.path.exists(os.path.join(out_dir, 'clean-epo.fif')))
+
+    # changed parameters rerun the stage and the stages depending on it
+    config['stages']['epochs']['tmax'] = 0.4
+    config['stages']['write_raw_brainvision'] = dict()
+    with open(config_fname, 'w') as fout:
+        json.dump(config, fout)
+    report = run_pipeline(config_fname, verbose=False)
+    assert_equal(sorted(report.stage_times),
+                 ['abs_threshold', 'epochs', 'write_raw_brainvision'])
+    assert_true(os.path.exists(os.path.join(out_dir, 'sub-01_raw.vhdr')))
+
+    # failures are reported and the completed stages are kept
+    config['stages']['abs_threshold'] = dict(thresh=1.)
+    with open(config_fname, 'w') as fout:
+        json.dump(config, fout)
+    assert_equal(main([config_fname]), 1)
+    report = run_pipeline(config_fname, verbose=False)
+    assert_equal([f[:2] for f in report.failed],
+                 [('sub-01_raw', 'abs_threshold'),
+                  ('sub-02_raw', 'abs_threshold')])
+    assert_equal(report.stage_times, dict())
+
+    config['stages'] = dict(retrieve=dict(windows=dict(a=[0, 100])))
+    assert_raises(ValueError, run_pipeline, config)
+    config['stages'] = dict(filter=dict())
+    assert_raises(ValueError, run_pipeline, config)
+
+    rmtree(tmpdir)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Working precision tests."""
+
+import os
+from shutil import rmtree
+
+import mne
+
+import numpy as np
+
+from nose.tools import assert_equal, assert_raises, assert_true
+
+from numpy.testing import assert_allclose, assert_array_equal
+
+from philistine import get_precision, set_precision, use_precision
+from philistine.mne import (abs_threshold, attenuation_iaf,
+                            compare_raw_brainvision, savgol_iaf,
+                            simulate_raw, write_raw_brainvision)
+from philistine.mne._spectral import _welch_psd
+from philistine.mne.utils import _mktmpdir
+
+
+def test_precision_setting():
+    """Test setting the precision globally and temporarily."""
+    assert_equal(get_precision(), 'float64')
+    with use_precision('float32'):
+        assert_equal(get_precision(), 'float32')
+    assert_equal(get_precision(), 'float64')
+    assert_raises(ValueError, set_precision, 'float16')
+    assert_raises(ValueError, use_precision('half').__enter__)
+    assert_equal(get_precision(), 'float64')
+
+
+def test_float32_results():
+    """Test that single precision matches double precision."""
+    raw = simulate_raw(iaf=10.5, alpha_amplitude=20e-6, seed=0)
+    raw2 = simulate_raw(iaf=10.5, alpha_amplitude=2e-6, seed=1)
+
+    # the PSD matches MNE's
+    n_fft = int(raw.info['sfreq'] / 0.25)
+    spectrum = raw.compute_psd(n_fft=n_fft, fmin=1., fmax=30.)
+    psd, freqs = _welch_psd(raw, None, n_fft, 1., 30., np.float32)
+    assert_equal(psd.dtype, np.float32)
+    assert_array_equal(freqs, spectrum.freqs)
+    assert_allclose(psd, spectrum.get_data(), rtol=1e-5)
+
+    iaf = savgol_iaf(raw, ax=False)
+    assert_equal(savgol_iaf(raw, ax=False, precision='float32'), iaf)
+    with use_precision('float32'):
+        assert_equal(savgol_iaf(raw, ax=False), iaf)
+        assert_equal(attenuation_iaf([raw, raw2], ax=False),
+                     attenuation_iaf([raw, raw2], ax=False,
+                                     precision='float64'))
+
+    events = mne.find_events(raw, verbose=False)
+    epochs = mne.Epochs(raw, events, tmin=0, tmax=0.5, baseline=None,
+                        preload=True, verbose=False)
+    data = epochs.copy().pick('eeg').get_data()
+    threshold = np.median(np.abs(data).max(axis=(1, 2)))
+    rej = abs_threshold(epochs.copy(), threshold)
+    assert_equal(rej.sum(), len(epochs) // 2)
+    assert_array_equal(abs_threshold(epochs.copy(), threshold,
+                                     precision='float32'), rej)
+
+    tmpdir = _mktmpdir()
+    fnames = [os.path.join(tmpdir, p + '.vhdr') for p in ('f64', 'f32')]
+    for fname, precision in zip(fnames, ('float64', 'float32')):
+        write_raw_brainvision(raw, fname, format='binary_int16',
+                              precision=precision)
+    data = [mne.io.read_raw_brainvision(f, preload=True)._data
+            for f in fnames]
+    # integers are scaled in double precision
+    assert_array_equal(data[1], data[0])
+    for fmt in ('binary_int16', 'binary_float32'):
+        write_raw_brainvision(raw, fnames[1], format=fmt,
+                              precision='float32')
+        assert_true(compare_raw_brainvision(raw, fnames[1]).valid)
+
+    rmtree(tmpdir)
@@ -3,10 +3,22 @@
 # License: BSD (3-clause)
 """Savitzky-Golaf IAF tests."""
 
-from nose.tools import assert_raises, assert_sequence_equal
+import os
+from shutil import rmtree
+
+import matplotlib.pyplot as plt
+
+from nose.tools import (assert_equal, assert_raises, assert_sequence_equal,
+                        assert_true)
+
+import numpy as np
+
+from numpy.testing import assert_allclose
 
 from philistine.mne import attenuation_iaf, savgol_iaf
-from philistine.mne.utils import _generate_raw
+from philistine.mne import plot_iaf_diagnostics, render_iaf_diagnostics
+from philistine.mne._spectral import _fft_psd
+from philistine.mne.utils import _generate_raw, _mktmpdir
 
 
 def test_basic_sgf_iaf():
@@ -76,3 +88,76 @@ def test_attenuation_sgf_iaf():
 
     iaf = attenuation_iaf([raw, raw2], fmin=7., fmax=13., flat_max_r=0)
     assert_sequence_equal(iaf, (None, None, (7., 13.)))
+
+
+def test_iaf_diagnostics():
+    """Test returning and rendering IAF diagnostics."""
+    raw = _generate_raw(iaf=11.25)
+    raw2 = _generate_raw(iaf=35)
+    n_figs = len(plt.get_fignums())
+
+    iaf, diag = savgol_iaf(raw, return_diagnostics=True)
+    assert_sequence_equal(iaf, (11.25, 11.25, (9.25, 13.)))
+    assert_equal(diag.estimate, iaf)
+    assert_equal(diag.psd.shape, diag.freqs.shape)
+    assert_true(diag.freqs_search is not None)
+
+    iaf2, diag2 = attenuation_iaf([raw, raw2], fmin=7., fmax=13.,
+                                  return_diagnostics=True)
+    assert_equal(diag2.freqs_search, None)
+
+    # no figures are created when returning diagnostics
+    assert_equal(len(plt.get_fignums()), n_figs)
+
+    fig, ax = plt.subplots()
+    plot_iaf_diagnostics(diag, ax)
+    assert_equal(len(ax.get_legend().get_texts()), 4)
+    plt.close(fig)
+
+    tmpdir = _mktmpdir()
+    fname = os.path.join(tmpdir, 'iaf.pdf')
+    assert_equal(render_iaf_diagnostics([diag, diag2], fname), [fname])
+    assert_true(os.path.getsize(fname) > 0)
+
+    fname = os.path.join(tmpdir, 'iaf_{}.png')
+    fnames = render_iaf_diagnostics([diag, diag2], fname,
+                                    titles=['sub-01', 'sub-02'], n_jobs=2)
+    assert_equal(fnames, [fname.format('sub-01'), fname.format('sub-02')])
+    assert_true(all(os.path.exists(f) for f in fnames))
+    assert_equal(len(plt.get_fignums()), n_figs)
+
+    assert_raises(ValueError, render_iaf_diagnostics, [diag, diag2],
+                  os.path.join(tmpdir, 'iaf.png'))
+    assert_raises(ValueError, render_iaf_diagnostics, [diag], fname,
+                  titles=['a', 'b'])
+
+    rmtree(tmpdir)
+
+
+def test_fft_backend():
+    """Test that the batched FFT backend matches the Welch backend."""
+    raw = _generate_raw(iaf=11.25)
+    raw2 = _generate_raw(iaf=35)
+    raw_bads = raw.copy()
+    raw_bads.info['bads'] = [raw.ch_names[0]]
+
+    n_fft = int(raw.info['sfreq'] / 0.25)
+    spectrum = raw_bads.compute_psd(n_fft=n_fft, fmin=1., fmax=30.)
+    psd, freqs = _fft_psd(raw_bads, None, n_fft, 1., 30., np.float64,
+                          n_jobs=2)
+    assert_allclose(freqs, spectrum.freqs)
+    assert_allclose(psd, spectrum.get_data(), rtol=1e-12)
+    assert_raises(ValueError, _fft_psd, raw, None, raw.n_times + 1, 1., 30.,
+                  np.float64)
+
+    for kwargs in (dict(), dict(fmin=7., fmax=13.)):
+        iaf, diag = savgol_iaf(raw, return_diagnostics=True, **kwargs)
+        iaf_fft, diag_fft = savgol_iaf(raw, return_diagnostics=True,
+                                       backend='fft', n_jobs=-1, **kwargs)
+        assert_equal(iaf_fft, iaf)
+        assert_allclose(diag_fft.psd, diag.psd, rtol=1e-12)
+        assert_equal(attenuation_iaf([raw, raw2], backend='fft', ax=False,
+                                     **kwargs),
+                     attenuation_iaf([raw, raw2], ax=False, **kwargs))
+
+    assert_raises(ValueError, savgol_iaf, raw, backend='multitaper')
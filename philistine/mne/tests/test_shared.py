@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Shared memory tests."""
+
+import pickle
+
+import mne
+
+import numpy as np
+
+from nose.tools import assert_equal, assert_raises, assert_true
+
+from numpy.testing import assert_array_equal
+
+from philistine.mne import (SharedData, abs_threshold, parallel_sweep,
+                            savgol_iaf, simulate_raw)
+
+
+def test_shared_data():
+    """Test views of Raw and Epochs data in shared memory."""
+    raw = simulate_raw(iaf=10.5, alpha_amplitude=20e-6, seed=0)
+    raw.set_annotations(mne.Annotations([1.], [0.5], ['blink']))
+
+    with SharedData(raw) as shared:
+        raw_view = shared.get()
+        assert_array_equal(raw_view._data, raw._data)
+        assert_equal(raw_view.annotations.description[0], 'blink')
+        # views in the same process and from unpickled handles share memory
+        other = pickle.loads(pickle.dumps(shared)).get()
+        assert_true(np.shares_memory(raw_view._data, other._data))
+        # the shared data can't be changed by accident
+        assert_raises(ValueError, raw_view._data.__imul__, 2)
+        del raw_view, other
+
+    events = mne.find_events(raw, verbose=False)
+    epochs = mne.Epochs(raw, events, tmin=-0.1, tmax=0.5, verbose=False)
+    with SharedData(epochs) as shared:
+        epochs_view = shared.get()
+        assert_array_equal(epochs_view.get_data(), epochs.get_data())
+        assert_array_equal(epochs_view.events, epochs.events)
+        del epochs_view
+
+    assert_raises(ValueError, SharedData, events)
+
+
+def test_parallel_sweep():
+    """Test sweeping parameters in worker processes."""
+    raw = simulate_raw(iaf=10.5, alpha_amplitude=20e-6, seed=0)
+    params = [dict(resolution=r, ax=False) for r in (0.25, 0.5)]
+    assert_equal(parallel_sweep(savgol_iaf, raw, params, n_jobs=2),
+                 [savgol_iaf(raw, **p) for p in params])
+
+    events = mne.find_events(raw, verbose=False)
+    epochs = mne.Epochs(raw, events, tmin=0, tmax=0.5, baseline=None,
+                        preload=True, verbose=False)
+    thresholds = [20e-6, 40e-6, 80e-6]
+    with SharedData(epochs) as shared:
+        rejs = parallel_sweep(abs_threshold, shared,
+                              [dict(threshold=t) for t in thresholds],
+                              n_jobs=2)
+    for rej, threshold in zip(rejs, thresholds):
+        assert_array_equal(rej, abs_threshold(epochs.copy(), threshold))
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Simulation tests."""
+
+import os
+from shutil import rmtree
+
+import mne
+
+from nose.tools import assert_equal, assert_raises, assert_true
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+
+from philistine.mne import simulate_eeg, simulate_events, simulate_raw
+from philistine.mne.utils import _mktmpdir
+
+
+def test_simulate_eeg():
+    """Test simulating EEG data in chunks."""
+    data = simulate_eeg(n_chan=4, sfreq=250., duration=20., iaf=11.,
+                        seed=1)
+    assert_equal(data.shape, (4, 5000))
+    # the data don't depend on the chunk size
+    assert_array_equal(simulate_eeg(n_chan=4, sfreq=250., duration=20.,
+                                    iaf=11., seed=1, chunk_duration=0.9),
+                       data)
+
+    data32 = simulate_eeg(n_chan=4, sfreq=250., duration=20., iaf=11.,
+                          seed=1, dtype=np.float32)
+    assert_equal(data32.dtype, np.float32)
+    assert_allclose(data32, data, rtol=1e-6)
+
+    # alpha peak on top of 1/f noise
+    psd, freqs = mne.time_frequency.psd_array_welch(data, 250., fmin=1.,
+                                                    fmax=30., n_fft=1000,
+                                                    verbose=False)
+    psd = psd.mean(axis=0)
+    assert_equal(freqs[np.argmax(psd)], 11.)
+    assert_true(psd[freqs == 2.] > psd[freqs == 8.])
+
+    tmpdir = _mktmpdir()
+    fname = os.path.join(tmpdir, 'sim.npy')
+    out = simulate_eeg(n_chan=4, sfreq=250., duration=20., iaf=11., seed=1,
+                       out=fname)
+    assert_true(isinstance(out, np.memmap))
+    del out
+    assert_array_equal(np.load(fname), data)
+
+    assert_raises(ValueError, simulate_eeg, n_chan=4, duration=20.,
+                  out=np.empty((4, 10)))
+    rmtree(tmpdir)
+
+
+def test_simulate_events():
+    """Test simulating event streams."""
+    events = simulate_events(250 * 600, 250., rate=2., event_id=[1, 2],
+                             min_isi=0.3, seed=1)
+    assert_true(np.all(np.diff(events[:, 0]) >= 0.3 * 250 - 1))
+    assert_true(np.all(events[:, 0] < 250 * 600))
+    assert_allclose(len(events) / 600., 2., rtol=0.1)
+    assert_equal(set(events[:, 2]), set([1, 2]))
+
+    assert_raises(ValueError, simulate_events, 1000, 250., rate=2.,
+                  min_isi=0.5)
+
+
+def test_simulate_raw():
+    """Test simulating Raws in memory and on disk."""
+    raw = simulate_raw(n_chan=4, duration=20., event_id=[1, 2], seed=3)
+    assert_equal(raw.ch_names, ['0', '1', '2', '3', 'STI 014'])
+    events = mne.find_events(raw, shortest_event=1, verbose=False)
+    assert_true(len(events) > 10)
+
+    tmpdir = _mktmpdir()
+    fname = os.path.join(tmpdir, 'sim.vhdr')
+    raw_bv = simulate_raw(n_chan=4, duration=20., event_id=[1, 2], seed=3,
+                          fname=fname, chunk_duration=3.)
+    assert_equal(raw_bv.preload, False)
+    assert_allclose(raw_bv.get_data(), raw.get_data(picks='eeg'),
+                    rtol=1e-6, atol=1e-12)
+    assert_allclose(raw_bv.annotations.onset * raw.info['sfreq'],
+                    events[:, 0])
+
+    rmtree(tmpdir)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Result store tests."""
+
+import os
+from shutil import rmtree
+
+import mne
+
+import numpy as np
+
+from nose.tools import assert_equal, assert_raises, assert_true
+
+import pandas as pd
+
+from philistine import profile, use_precision
+from philistine.mne import ResultStore, savgol_iaf, simulate_raw
+from philistine.mne.utils import _mktmpdir
+
+
+def _n_computed(prof, name):
+    """Count how often a function was run under the profiler."""
+    return sum(rec.name == name for rec in prof.records)
+
+
+def test_result_store():
+    """Test storing IAF results and recomputing only changed inputs."""
+    tmpdir = _mktmpdir()
+    db_fname = os.path.join(tmpdir, 'results.db')
+    raws = dict()
+    for subject, iaf in (('sub-01', 11.), ('sub-02', 9.5)):
+        vhdr_fname = os.path.join(tmpdir, subject + '.vhdr')
+        raws[subject] = simulate_raw(iaf=iaf, seed=0, fname=vhdr_fname)
+
+    with ResultStore(db_fname) as store, profile() as prof:
+        for subject, raw in raws.items():
+            iaf = store.savgol_iaf(raw, subject)
+            assert_equal(iaf, savgol_iaf(raw, ax=False))
+    assert_equal(_n_computed(prof, 'savgol_iaf'), 4)
+
+    # a rerun only recomputes new parameters, also after reopening
+    with ResultStore(db_fname) as store, profile() as prof:
+        for subject, raw in raws.items():
+            store.savgol_iaf(raw, subject)
+            store.savgol_iaf(raw, subject, fmin=7.)
+        assert_equal(_n_computed(prof, 'savgol_iaf'), 2)
+        assert_equal(store.subjects(), ['sub-01', 'sub-02'])
+
+        # changed data in memory are detected
+        raw = raws['sub-01'].copy().load_data()
+        raw._data *= 2
+        store.savgol_iaf(raw, 'sub-01')
+        assert_equal(_n_computed(prof, 'savgol_iaf'), 3)
+
+        # changed files are detected
+        vhdr_fname = os.path.join(tmpdir, 'sub-02.vhdr')
+        raw = simulate_raw(iaf=10.5, seed=0, fname=vhdr_fname)
+        # make sure the modification time differs on coarse file systems
+        os.utime(vhdr_fname[:-4] + 'eeg', (0, 0))
+        iaf = store.savgol_iaf(raw, 'sub-02')
+        assert_equal(_n_computed(prof, 'savgol_iaf'), 4)
+        assert_equal(iaf, savgol_iaf(raw, ax=False))
+
+        dat = store.iaf_table('savgol_iaf')
+        assert_equal(len(dat), 4)
+        dat = store.iaf_table(subjects=['sub-02'])
+        assert_equal(list(dat.subject.unique()), ['sub-02'])
+        assert_true(iaf.PeakAlphaFrequency in dat.paf.values)
+
+        results = store.load('savgol_iaf', subjects=['sub-02'])
+        assert_equal(len(results), 2)
+        assert_equal(sorted(params.get('fmin') is not None
+                            for _, params, _ in results), [False, True])
+
+    rmtree(tmpdir)
+
+
+def test_result_store_key():
+    """Test that everything changing a result changes its key."""
+    tmpdir = _mktmpdir()
+    raw = simulate_raw(iaf=10.5, seed=0)
+
+    with ResultStore(os.path.join(tmpdir, 'results.db')) as store, \
+            profile() as prof:
+        store.savgol_iaf(raw, 'sub-01')
+        # bad segments change the spectrum
+        raw.set_annotations(mne.Annotations([1.], [2.], ['BAD_blink']))
+        store.savgol_iaf(raw, 'sub-01')
+        assert_equal(_n_computed(prof, 'savgol_iaf'), 2)
+        # as does the package-wide precision
+        with use_precision('float32'):
+            store.savgol_iaf(raw, 'sub-01')
+        assert_equal(_n_computed(prof, 'savgol_iaf'), 3)
+        store.savgol_iaf(raw, 'sub-01', precision='float64')
+        store.savgol_iaf(raw, 'sub-01', precision='float64')
+        assert_equal(_n_computed(prof, 'savgol_iaf'), 4)
+
+        # the events, times and metadata of epochs
+        events = mne.find_events(raw, verbose=False)
+        epochs = mne.Epochs(raw, events, tmin=-0.1, tmax=0.5, preload=True,
+                            verbose=False)
+        key = store._inputs_key([epochs], 'float64')
+        assert_equal(store._inputs_key([epochs.copy()], 'float64'), key)
+        changed = epochs.copy()
+        changed.events[0, 2] = 2
+        changed.event_id = dict(a=1, b=2)
+        other = epochs.copy()
+        other.metadata = pd.DataFrame(dict(item=np.arange(len(epochs))))
+        shifted = epochs.copy().shift_time(0.1)
+        for inst in (changed, other, shifted):
+            assert_true(store._inputs_key([inst], 'float64') != key)
+
+        # functions without a stable name can't be stored
+        assert_raises(TypeError, store.retrieve, epochs, dict(a=(0, 100)),
+                      'sub-01', summary_fnc=dict(mean=lambda x: x.mean()))
+
+    rmtree(tmpdir)
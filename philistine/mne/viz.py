@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2017-2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Plotting of IAF diagnostics, without pyplot's global state."""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ._base import AttenuationDiagnostics, SavgolDiagnostics
+
+
+def plot_iaf_diagnostics(diagnostics, ax):
+    """Plot the spectra and fits behind an IAF estimate.
+
+    Parameters
+    ----------
+    diagnostics : SavgolDiagnostics | AttenuationDiagnostics
+        The diagnostics as returned by savgol_iaf or attenuation_iaf with
+        ``return_diagnostics=True``.
+    ax : instance of matplotlib Axes
+        Axes to plot into.
+    """
+    if isinstance(diagnostics, SavgolDiagnostics):
+        handles = _plot_savgol(diagnostics, ax)
+    elif isinstance(diagnostics, AttenuationDiagnostics):
+        handles = _plot_attenuation(diagnostics, ax)
+    else:
+        raise ValueError('Unknown diagnostics of type '
+                         '{}.'.format(type(diagnostics).__name__))
+
+    # the search parabola only exists if the alpha band was estimated
+    if diagnostics.freqs_search is not None:
+        plt_search, = ax.plot(diagnostics.freqs_search,
+                              diagnostics.psd_search,
+                              label='Alpha-band Search Parabola')
+        # the 1/f fit of savgol_iaf is listed last
+        pos = len(handles) - isinstance(diagnostics, SavgolDiagnostics)
+        handles.insert(pos, plt_search)
+    ax.legend(handles=handles)
+
+    ax.set_ylabel("PSD")
+    ax.set_xlabel("Hz")
+
+
+def _plot_savgol(diag, ax):
+    """Plot the curves of savgol_iaf, returning the legend handles."""
+    plt_psd, = ax.plot(diag.freqs, diag.psd, label="Raw PSD")
+    plt_smooth, = ax.plot(diag.freqs, diag.psd_smooth, label="Smoothed PSD")
+    plt_pink, = ax.plot(diag.freqs, diag.pink_fit,
+                        label='$1/f$ fit ($R^2={:0.2}$)'.format(diag.pink_r2))
+    return [plt_psd, plt_smooth, plt_pink]
+
+
+def _plot_attenuation(diag, ax):
+    """Plot the curves of attenuation_iaf, returning the legend handles."""
+    sgnote = '(with SG-Smoothing)' if diag.savgol == 'each' else ''
+    plt_psd1, = ax.plot(diag.freqs, diag.psds[0],
+                        label="Raw PSD #1 {}".format(sgnote))
+    plt_psd2, = ax.plot(diag.freqs, diag.psds[1],
+                        label="Raw PSD #2 {}".format(sgnote))
+
+    sgnote = '(with SG-Smoothing)' if diag.savgol == 'diff' else ''
+    plt_att_psd, = ax.plot(diag.freqs, diag.att_psd,
+                           label="Attenuated PSD {}".format(sgnote))
+    ax.text(np.max(diag.freqs) * 0.5, np.max(diag.att_psd) * 0.67,
+            'Raw PSD Pearson $r={:0.2}$'.format(diag.r))
+    return [plt_psd1, plt_psd2, plt_att_psd]
+
+
+def render_iaf_diagnostics(diagnostics, fname, titles=None, n_jobs=1,
+                           dpi=100):
+    """Render IAF diagnostics of many estimates to files.
+
+    Parameters
+    ----------
+    diagnostics : list of SavgolDiagnostics | AttenuationDiagnostics
+        The diagnostics as returned by savgol_iaf or attenuation_iaf with
+        ``return_diagnostics=True``.
+    fname : str
+        If the name ends in '.pdf', all diagnostics are rendered as pages of
+        a single PDF. Otherwise, a template for the names of one image per
+        diagnostics, with ``{}`` as placeholder for the title, e.g.
+        'iaf_{}.png'.
+    titles : list of str | None
+        Titles for the plots, e.g. subject identifiers. If None, the
+        position in diagnostics is used.
+    n_jobs : int
+        The number of images to render in parallel, each in its own process.
+        Pages of a PDF are always rendered one after another.
+    dpi : int
+        Resolution of the images.
+
+    Returns
+    -------
+    fnames : list of str
+        The names of the written files.
+
+    Notes
+    -----
+    The figures are created with the Agg backend directly, without pyplot.
+    Nothing is added to pyplot's list of open figures and the figures are
+    freed as soon as they are written, so that this is safe for batches of
+    hundreds of subjects and in headless environments.
+    """
+    if titles is None:
+        titles = [str(ii) for ii in range(len(diagnostics))]
+    if len(titles) != len(diagnostics):
+        raise ValueError('The number of titles ({}) does not match the '
+                         'number of diagnostics '
+                         '({}).'.format(len(titles), len(diagnostics)))
+
+    if fname.lower().endswith('.pdf'):
+        from matplotlib.backends.backend_pdf import PdfPages
+
+        with PdfPages(fname) as pdf:
+            for diag, title in zip(diagnostics, titles):
+                pdf.savefig(_figure(diag, title))
+        return [fname]
+
+    fnames = [fname.format(title) for title in titles]
+    if len(set(fnames)) != len(fnames):
+        raise ValueError('fname must contain a placeholder for the title '
+                         'to give each image its own file.')
+
+    jobs = list(zip(diagnostics, titles, fnames))
+    if n_jobs == 1:
+        for job in jobs:
+            _render_image(*job, dpi=dpi)
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+            futures = [pool.submit(_render_image, *job, dpi=dpi)
+                       for job in jobs]
+            for future in futures:
+                future.result()
+
+    return fnames
+
+
+def _figure(diagnostics, title):
+    """Create a figure with the plot of diagnostics on an Agg canvas."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(1, 1, 1)
+    plot_iaf_diagnostics(diagnostics, ax)
+    ax.set_title(title)
+    return fig
+
+
+def _render_image(diagnostics, title, fname, dpi=100):
+    """Render diagnostics to an image file."""
+    _figure(diagnostics, title).savefig(fname, dpi=dpi)
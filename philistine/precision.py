@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Package-wide floating point precision of working arrays."""
+
+import os
+from contextlib import contextmanager
+
+_precisions = ('float64', 'float32')
+
+# the initial setting can be given in the environment, e.g. for the worker
+# processes of a pipeline
+_precision = os.environ.get('PHILISTINE_PRECISION', 'float64')
+
+
+def _check_precision(precision):
+    """Check that precision is supported."""
+    if precision not in _precisions:
+        raise ValueError('precision must be one of {}, got '
+                         '{!r}.'.format(', '.join(_precisions), precision))
+    return precision
+
+
+def get_precision():
+    """Get the precision of working arrays.
+
+    Returns
+    -------
+    precision : str
+        Either 'float64' or 'float32'.
+    """
+    return _check_precision(_precision)
+
+
+def set_precision(precision):
+    """Set the precision of working arrays for the whole package.
+
+    Parameters
+    ----------
+    precision : str
+        Either 'float64' (the default) or 'float32'. Functions supporting
+        single precision keep their working arrays in float32, which halves
+        the memory of these arrays. The accuracy and the effect on memory
+        use for each function are documented in its ``precision`` parameter,
+        which overrides this setting for a single call.
+
+    Notes
+    -----
+    The initial precision can be set with the environment variable
+    PHILISTINE_PRECISION.
+    """
+    global _precision
+    _precision = _check_precision(precision)
+
+
+@contextmanager
+def use_precision(precision):
+    """Temporarily set the precision of working arrays.
+
+    Parameters
+    ----------
+    precision : str
+        Either 'float64' or 'float32', see set_precision.
+    """
+    old = get_precision()
+    set_precision(precision)
+    try:
+        yield
+    finally:
+        set_precision(old)
+
+
+def _working_dtype(precision=None):
+    """Get the dtype of working arrays, for a per-call override or None."""
+    import numpy as np
+
+    if precision is None:
+        precision = get_precision()
+    return np.dtype(_check_precision(precision))
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Opt-in profiling of the stages of philistine's functions."""
+
+from __future__ import division, print_function
+
+import functools
+import json
+import os
+import threading
+import time
+import tracemalloc
+from collections import namedtuple
+from contextlib import contextmanager
+
+StageRecord = namedtuple('StageRecord',
+                         ['name', 'depth', 'start', 'wall', 'cpu', 'peak'])
+
+# the active profilers, innermost last
+_profilers = []
+
+
+class Profile(object):
+    """Record the stages of philistine's functions.
+
+    Use :func:`profile` to create an active instance.
+
+    Attributes
+    ----------
+    records : list of StageRecord
+        The recorded stages in the order they finished. Each record has the
+        stage name, its nesting depth, its start time and wall time in
+        seconds (relative to the start of profiling), the CPU time of the
+        process in seconds and the peak memory allocated during the stage
+        in bytes (None if memory is not traced).
+    """
+
+    def __init__(self, memory=False, callback=None):  # noqa: D107
+        self.memory = memory
+        self.callback = callback
+        self.records = []
+        self._stack = []
+        self._t0 = time.perf_counter()
+
+    def _enter(self, name):
+        """Start a stage."""
+        frame = dict(name=name, start=time.perf_counter(),
+                     cpu=time.process_time(), peak=None, inner_peak=0)
+        if self.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._stack:
+                # the peak of the enclosing stage up to now
+                parent = self._stack[-1]
+                parent['inner_peak'] = max(parent['inner_peak'], peak)
+            _reset_peak()
+            frame['base'] = current
+        self._stack.append(frame)
+
+    def _exit(self):
+        """Finish the innermost stage and record it."""
+        frame = self._stack.pop()
+        wall = time.perf_counter() - frame['start']
+        cpu = time.process_time() - frame['cpu']
+        peak = None
+        if self.memory:
+            abs_peak = max(tracemalloc.get_traced_memory()[1],
+                           frame['inner_peak'])
+            peak = abs_peak - frame['base']
+            if self._stack:
+                parent = self._stack[-1]
+                parent['inner_peak'] = max(parent['inner_peak'], abs_peak)
+
+        record = StageRecord(frame['name'], len(self._stack),
+                             frame['start'] - self._t0, wall, cpu, peak)
+        self.records.append(record)
+        if self.callback is not None:
+            self.callback(record)
+
+    def summary(self):
+        """Summarize the records by stage name.
+
+        Returns
+        -------
+        summary : list of tuple
+            For each stage name, in order of first appearance, the name, the
+            number of calls, the total wall and CPU time and the maximum
+            peak memory.
+        """
+        stats = dict()
+        for rec in sorted(self.records, key=lambda r: r.start):
+            count, wall, cpu, peak = stats.get(rec.name, (0, 0., 0., None))
+            if rec.peak is not None:
+                peak = max(peak or 0, rec.peak)
+            stats[rec.name] = (count + 1, wall + rec.wall, cpu + rec.cpu,
+                               peak)
+        return [(name,) + values for name, values in stats.items()]
+
+    def table(self):
+        """Format the summary as a text table.
+
+        Returns
+        -------
+        table : str
+            The table with one row per stage name.
+        """
+        rows = ['{:<40} {:>6} {:>10} {:>10} {:>10}'.format(
+            'stage', 'calls', 'wall (s)', 'cpu (s)', 'peak (MiB)')]
+        for name, count, wall, cpu, peak in self.summary():
+            peak = '-' if peak is None else '{:.1f}'.format(peak / 2 ** 20)
+            rows.append('{:<40} {:>6} {:>10.3f} {:>10.3f} {:>10}'.format(
+                name, count, wall, cpu, peak))
+        return '\n'.join(rows)
+
+    def save_chrome_trace(self, fname):
+        """Save the records in the Chrome trace event format.
+
+        Parameters
+        ----------
+        fname : str
+            Name of the JSON file to write. It can be opened in
+            chrome://tracing or https://ui.perfetto.dev.
+        """
+        pid = os.getpid()
+        tid = threading.get_ident()
+        events = []
+        for rec in self.records:
+            args = dict(cpu_s=rec.cpu)
+            if rec.peak is not None:
+                args['peak_bytes'] = rec.peak
+            # complete events with times in microseconds
+            events.append(dict(name=rec.name, cat='philistine', ph='X',
+                               ts=rec.start * 1e6, dur=rec.wall * 1e6,
+                               pid=pid, tid=tid, args=args))
+        with open(fname, 'w') as fout:
+            json.dump(dict(traceEvents=events, displayTimeUnit='ms'), fout)
+
+
+@contextmanager
+def profile(memory=False, callback=None):
+    """Profile the stages of philistine's functions.
+
+    Parameters
+    ----------
+    memory : bool
+        Whether to trace the peak memory allocated in each stage with
+        ``tracemalloc``. This slows down allocation-heavy code considerably.
+    callback : callable | None
+        Function called with each StageRecord as soon as its stage finishes,
+        e.g. for logging.
+
+    Yields
+    ------
+    prof : instance of Profile
+        The records of all stages finished while the context is active.
+
+    Notes
+    -----
+    Profiling is opt-in: outside of this context, the stages cost no more
+    than a function call each. Only stages run in the thread that entered
+    the context are recorded.
+
+    Examples
+    --------
+    >>> with profile() as prof:  # doctest: +SKIP
+    ...     savgol_iaf(raw, ax=False)
+    >>> print(prof.table())  # doctest: +SKIP
+    """
+    prof = Profile(memory=memory, callback=callback)
+    started = memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    prof._thread = threading.get_ident()
+    _profilers.append(prof)
+    try:
+        yield prof
+    finally:
+        _profilers.remove(prof)
+        if started:
+            tracemalloc.stop()
+
+
+def _reset_peak():
+    """Reset the peak of traced memory, where supported (Python 3.9+)."""
+    reset = getattr(tracemalloc, 'reset_peak', None)
+    if reset is not None:
+        reset()
+
+
+@contextmanager
+def _recording(prof, name):
+    """Record a stage with the given profiler."""
+    prof._enter(name)
+    try:
+        yield
+    finally:
+        prof._exit()
+
+
+class _NoStage(object):
+    """Do-nothing context for stages outside of profiling."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_no_stage = _NoStage()
+
+
+def _stage(name):
+    """Get a context manager marking a stage of a function."""
+    if _profilers and _profilers[-1]._thread == threading.get_ident():
+        return _recording(_profilers[-1], name)
+    return _no_stage
+
+
+def _profiled(func):
+    """Decorate a function to be recorded as a stage of its own."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _stage(func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
@@ -3,7 +3,10 @@
 # License: BSD (3-clause)
 """Epoch manipulation tests."""
 
-from nose.tools import assert_dict_equal, assert_raises
+import subprocess
+import sys
+
+from nose.tools import assert_dict_equal, assert_equal, assert_raises
 
 from philistine import invert_dict
 
@@ -19,3 +22,19 @@ def test_invert_dict():
     d['B'] = 'hot'
 
     assert_raises(ValueError, invert_dict, d)
+
+
+def test_lazy_import():
+    """Test that importing the package and the BrainVision IO is cheap."""
+    code = ('import sys, philistine, philistine.mne.io; '
+            'print(sorted(m for m in ("matplotlib.pyplot", "pandas", '
+            '"scipy.stats") if m in sys.modules))')
+    out = subprocess.check_output([sys.executable, '-c', code])
+    assert_equal(out.decode().strip(), '[]')
+
+    # submodules are available as attributes without importing them
+    code = ('import philistine; '
+            'print(philistine.mne.io.write_raw_brainvision.__name__, '
+            '"io" in dir(philistine.mne))')
+    out = subprocess.check_output([sys.executable, '-c', code])
+    assert_equal(out.decode().strip(), 'write_raw_brainvision True')
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Copyright (C) 2023 Phillip Alday <me@phillipalday.com>
+# License: BSD (3-clause)
+"""Stage profiling tests."""
+
+import json
+import os
+from shutil import rmtree
+
+from nose.tools import assert_equal, assert_in, assert_true
+
+from philistine import profile
+from philistine.mne import savgol_iaf, write_raw_brainvision
+from philistine.mne.utils import _generate_raw, _mktmpdir
+
+
+def test_profile():
+    """Test recording and exporting the stages of functions."""
+    raw = _generate_raw(iaf=11.25)
+    tmpdir = _mktmpdir()
+    vhdr_fname = os.path.join(tmpdir, 'test.vhdr')
+
+    # nothing is recorded outside of the context
+    savgol_iaf(raw, ax=False)
+
+    finished = []
+    with profile(memory=True, callback=finished.append) as prof:
+        iaf = savgol_iaf(raw, ax=False)
+        write_raw_brainvision(raw, vhdr_fname)
+    # profiling doesn't change the results
+    assert_equal(iaf, savgol_iaf(raw, ax=False))
+    assert_equal(finished, prof.records)
+
+    names = [rec.name for rec in prof.records]
+    for name in ('savgol_iaf', 'savgol_iaf.psd', 'savgol_iaf.band_search',
+                 'write_raw_brainvision', 'write_raw_brainvision.markers',
+                 'write_brainvision.eeg'):
+        assert_in(name, names)
+    assert_equal(names.count('savgol_iaf'), 1)
+
+    records = dict((rec.name, rec) for rec in prof.records)
+    assert_equal(records['savgol_iaf'].depth, 0)
+    assert_equal(records['savgol_iaf.psd'].depth, 1)
+    # stages are nested in time and their peaks propagate outward
+    outer, inner = records['savgol_iaf'], records['savgol_iaf.psd']
+    assert_true(outer.start <= inner.start)
+    assert_true(inner.start + inner.wall <= outer.start + outer.wall)
+    assert_true(outer.peak >= inner.peak > 0)
+
+    table = prof.table().splitlines()
+    assert_equal(len(table), len(set(names)) + 1)
+    assert_true(table[1].startswith('savgol_iaf '))
+
+    trace_fname = os.path.join(tmpdir, 'trace.json')
+    prof.save_chrome_trace(trace_fname)
+    with open(trace_fname) as fin:
+        events = json.load(fin)['traceEvents']
+    assert_equal(len(events), len(prof.records))
+    assert_equal(set(ev['ph'] for ev in events), set(['X']))
+    assert_in('peak_bytes', events[0]['args'])
+
+    rmtree(tmpdir)
@@ -67,4 +67,8 @@ if __name__ == "__main__":
                        'Operating System :: MacOS'],
           platforms='any',
           packages=package_tree('philistine'),
+          entry_points={'console_scripts': [
+              'philistine-fif2bv = philistine.mne.convert:main',
+              'philistine-pipeline = philistine.mne.pipeline:main',
+          ]},
     )